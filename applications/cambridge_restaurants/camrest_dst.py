@@ -14,7 +14,6 @@ __author__ = "Alexandros Papangelis"
 from plato.agent.component.dialogue_state_tracker.ludwig_dst import LudwigDST
 from plato.dialogue.state import SlotFillingDialogueState
 from copy import deepcopy
-import pandas as pd
 
 """
 CamRestDST implements Dialogue State Tracking for the Cambridge Restaurants 
@@ -97,29 +96,28 @@ class CamRestDST(LudwigDST):
 
         dst_in['nlu_intent'] = ' '.join(intents)
 
-        input_data = [dst_in]
-
         # Warning: Make sure the same tokenizer that was used to train
         # the model is used during prediction
-        result = self.model.predict(pd.DataFrame(data=input_data))
+        result = self.predictor.predict(dst_in)
 
         area_prediction = result['dst_area_predictions'][0]
         if area_prediction == 'none':
             area_prediction = None
 
-        self.DState.slots_filled['area'] = area_prediction
+        self.DState.writable('slots_filled')['area'] = area_prediction
 
         food_prediction = result['dst_food_predictions'][0]
         if food_prediction == 'none':
             food_prediction = None
 
-        self.DState.slots_filled['food'] = food_prediction
+        self.DState.writable('slots_filled')['food'] = food_prediction
 
         pricerange_prediction = result['dst_pricerange_predictions'][0]
         if pricerange_prediction == 'none':
             pricerange_prediction = None
 
-        self.DState.slots_filled['pricerange'] = pricerange_prediction
+        self.DState.writable('slots_filled')['pricerange'] = \
+            pricerange_prediction
 
         req_slot_prediction = result['dst_req_slot_predictions'][0]
         if req_slot_prediction == 'none':
@@ -93,10 +93,8 @@ class CamRestNLU(LudwigNLU):
 
         # Warning: Make sure the same tokenizer that was used to train the
         # model is used during prediction
-        result = \
-            self.model.predict(
-                pd.DataFrame(
-                    data={'transcript': [utterance]}), return_type=dict)
+        result = self.predictor.predict({'transcript': utterance},
+                                        return_type=dict)
 
         dacts = []
 
@@ -30,12 +30,13 @@ from plato.agent.component.dialogue_policy.deep_learning.supervised_policy \
 from plato.agent.component.dialogue_policy.deep_learning.reinforce_policy \
     import ReinforcePolicy
 from plato.domain.ontology import Ontology
-from plato.domain.database import DataBase, SQLDataBase, JSONDataBase
+from plato.domain.database import DataBase, SQLDataBase, JSONDataBase, \
+    ColumnarDataBase
+from plato.domain.lookup_cache import DBLookupCache
 from plato.agent.component.conversational_module import ConversationalModule
 from copy import deepcopy
 
 import random
-import math
 
 """
 The DialogueManager consists of a dialogue state tracker and a policy. 
@@ -100,6 +101,10 @@ class DialogueManager(ConversationalModule):
         self.dialogue_counter = 0
         self.CALCULATE_SLOT_ENTROPIES = True
 
+        # Cache database lookups (see plato.domain.lookup_cache)
+        self.DB_CACHE = True
+        self.db_cache = None
+
         if isinstance(ontology, Ontology):
             self.ontology = ontology
         elif isinstance(ontology, str):
@@ -111,15 +116,23 @@ class DialogueManager(ConversationalModule):
             self.database = database
 
         elif isinstance(database, str):
-            if database[-3:] == '.db':
+            if 'db_type' in args and args['db_type'] == 'columnar':
+                self.database = ColumnarDataBase(database)
+            elif database[-3:] == '.db':
                 self.database = SQLDataBase(database)
-            elif database[-5:] == '.json':
+            elif database[-5:] == '.json' or database[-6:] == '.jsonl':
                 self.database = JSONDataBase(database)
             else:
                 raise ValueError('Unacceptable database type %s ' % database)
 
         else:
             raise ValueError('Unacceptable database type %s ' % database)
+
+        if 'db_cache' in args:
+            self.DB_CACHE = bool(args['db_cache'])
+
+        if self.DB_CACHE:
+            self.db_cache = DBLookupCache(self.database)
                 
         if args and args['policy']:
             if 'domain' in self.settings['DIALOGUE']:
@@ -157,6 +170,10 @@ class DialogueManager(ConversationalModule):
                     epsilon_decay = \
                         float(args['policy']['exploration_decay_rate'])
 
+                q_table = 'dict'
+                if 'q_table' in args['policy']:
+                    q_table = args['policy']['q_table']
+
                 self.policy = \
                     QPolicy({
                         'ontology': self.ontology,
@@ -168,7 +185,8 @@ class DialogueManager(ConversationalModule):
                         'epsilon': epsilon,
                         'gamma': gamma,
                         'alpha_decay': alpha_decay,
-                        'epsilon_decay': epsilon_decay})
+                        'epsilon_decay': epsilon_decay,
+                        'q_table': q_table})
 
             elif args['policy']['type'] == 'minimax_q':
                 alpha = 0.25
@@ -229,6 +247,10 @@ class DialogueManager(ConversationalModule):
                     epsilon_decay = \
                         float(args['policy']['exploration_decay_rate'])
 
+                batch_training = False
+                if 'batch_training' in args['policy']:
+                    batch_training = bool(args['policy']['batch_training'])
+
                 self.policy = \
                     WoLFPHCPolicy({
                         'ontology': self.ontology,
@@ -240,7 +262,8 @@ class DialogueManager(ConversationalModule):
                         'epsilon': epsilon,
                         'gamma': gamma,
                         'alpha_decay': alpha_decay,
-                        'epsilon_decay': epsilon_decay})
+                        'epsilon_decay': epsilon_decay,
+                        'batch_training': batch_training})
 
             elif args['policy']['type'] == 'reinforce':
                 alpha = None
@@ -264,6 +287,14 @@ class DialogueManager(ConversationalModule):
                     epsilon_decay = \
                         float(args['policy']['exploration_decay_rate'])
 
+                batch_training = False
+                if 'batch_training' in args['policy']:
+                    batch_training = bool(args['policy']['batch_training'])
+
+                num_workers = 0
+                if 'num_workers' in args['policy']:
+                    num_workers = int(args['policy']['num_workers'])
+
                 self.policy = \
                     ReinforcePolicy({
                         'ontology': self.ontology,
@@ -275,7 +306,9 @@ class DialogueManager(ConversationalModule):
                         'epsilon': epsilon,
                         'gamma': gamma,
                         'alpha_decay': alpha_decay,
-                        'epsilon_decay': epsilon_decay})
+                        'epsilon_decay': epsilon_decay,
+                        'batch_training': batch_training,
+                        'num_workers': num_workers})
 
             elif args['policy']['type'] == 'calculated':
                 self.policy = \
@@ -603,9 +636,12 @@ class DialogueManager(ConversationalModule):
                     sys_acts_copy.remove(sys_act)
 
         # Append unique new sys acts
+        existing_sys_acts = {sa.freeze() for sa in sys_acts_copy}
         for sa in new_sys_acts:
-            if sa not in sys_acts_copy:
+            frozen_sa = sa.freeze()
+            if frozen_sa not in existing_sys_acts:
                 sys_acts_copy.append(sa)
+                existing_sys_acts.add(frozen_sa)
 
         self.DSTracker.update_state_sysact(sys_acts_copy)
 
@@ -624,47 +660,21 @@ class DialogueManager(ConversationalModule):
 
         d_state = self.DSTracker.get_state()
 
-        # Query the database
-        db_result = self.database.db_lookup(d_state)
+        # Query the database, or the cache in front of it. Cached results
+        # are shared, so they must not be modified.
+        database = self.db_cache if self.db_cache else self.database
+        db_result = database.db_lookup(d_state, self.MAX_DB_RESULTS)
 
         if db_result:
             # Calculate entropy of requestable slot values in results -
-            # if the flag is off this will be empty
+            # if the flag is off this will be empty. Entropies are calculated
+            # over all the results, not just the ones that were retrieved.
             entropies = \
                 dict.fromkeys(self.ontology.ontology['system_requestable'])
 
             if self.CALCULATE_SLOT_ENTROPIES:
-                value_probabilities = {}
-
-                # Count the values
-                for req_slot in self.ontology.ontology['system_requestable']:
-                    value_probabilities[req_slot] = {}
-
-                    for db_item in db_result:
-                        if db_item[req_slot] not in \
-                                value_probabilities[req_slot]:
-                            value_probabilities[req_slot][
-                                db_item[req_slot]] = 1
-                        else:
-                            value_probabilities[req_slot][
-                                db_item[req_slot]] += 1
-
-                # Calculate probabilities
-                for slot in value_probabilities:
-                    for value in value_probabilities[slot]:
-                        value_probabilities[slot][value] /= len(db_result)
-
-                # Calculate entropies
-                for slot in entropies:
-                    entropies[slot] = 0
-
-                    if slot in value_probabilities:
-                        for value in value_probabilities[slot]:
-                            entropies[slot] += \
-                                value_probabilities[slot][value] * \
-                                math.log(value_probabilities[slot][value])
-
-                    entropies[slot] = -entropies[slot]
+                entropies = database.get_slot_entropies(
+                    d_state, self.ontology.ontology['system_requestable'])
 
             return db_result[:self.MAX_DB_RESULTS], entropies
 
@@ -681,6 +691,10 @@ class DialogueManager(ConversationalModule):
 
         self.DSTracker.initialize(args)
         self.policy.restart(args)
+
+        if self.db_cache:
+            self.db_cache.restart()
+
         self.dialogue_counter += 1
 
     def update_goal(self, goal):
@@ -17,7 +17,9 @@ from plato.dialogue.action import DialogueAct, DialogueActItem, Operator
 from plato.agent.component.dialogue_state_tracker.\
     slot_filling_dst import SlotFillingDST
 from plato.domain.ontology import Ontology
-from plato.domain.database import DataBase, SQLDataBase, JSONDataBase
+from plato.domain.database import DataBase, SQLDataBase, JSONDataBase, \
+    ColumnarDataBase
+from plato.domain.lookup_cache import DBLookupCache
 
 from copy import deepcopy
 
@@ -25,7 +27,6 @@ from plato.agent.component.conversational_module \
     import ConversationalModule
 
 import random
-import math
 
 """
 The DialogueManagerGeneric consists of a dialogue_state_tracker and a 
@@ -99,6 +100,10 @@ class DialogueManagerGeneric(ConversationalModule):
         self.dialogue_counter = 0
         self.CALCULATE_SLOT_ENTROPIES = True
 
+        # Cache database lookups (see plato.domain.lookup_cache)
+        self.DB_CACHE = True
+        self.db_cache = None
+
         if isinstance(ontology, Ontology):
             self.ontology = ontology
         elif isinstance(ontology, str):
@@ -110,15 +115,23 @@ class DialogueManagerGeneric(ConversationalModule):
             self.database = database
 
         elif isinstance(database, str):
-            if database[-3:] == '.db':
+            if 'db_type' in args and args['db_type'] == 'columnar':
+                self.database = ColumnarDataBase(database)
+            elif database[-3:] == '.db':
                 self.database = SQLDataBase(database)
-            elif database[-5:] == '.json':
+            elif database[-5:] == '.json' or database[-6:] == '.jsonl':
                 self.database = JSONDataBase(database)
             else:
                 raise ValueError('Unacceptable database type %s ' % database)
 
         else:
             raise ValueError('Unacceptable database type %s ' % database)
+
+        if 'db_cache' in args:
+            self.DB_CACHE = bool(args['db_cache'])
+
+        if self.DB_CACHE:
+            self.db_cache = DBLookupCache(self.database)
                 
         if args and args['policy']:
             if 'domain' in self.settings['DIALOGUE']:
@@ -468,9 +481,12 @@ class DialogueManagerGeneric(ConversationalModule):
                     sys_acts_copy.remove(sys_act)
 
         # Append unique new sys acts
+        existing_sys_acts = {sa.freeze() for sa in sys_acts_copy}
         for sa in new_sys_acts:
-            if sa not in sys_acts_copy:
+            frozen_sa = sa.freeze()
+            if frozen_sa not in existing_sys_acts:
                 sys_acts_copy.append(sa)
+                existing_sys_acts.add(frozen_sa)
 
         self.DSTracker.update_state_sysact(sys_acts_copy)
 
@@ -489,47 +505,21 @@ class DialogueManagerGeneric(ConversationalModule):
 
         d_state = self.DSTracker.get_state()
 
-        # Query the database
-        db_result = self.database.db_lookup(d_state)
+        # Query the database, or the cache in front of it. Cached results
+        # are shared, so they must not be modified.
+        database = self.db_cache if self.db_cache else self.database
+        db_result = database.db_lookup(d_state, self.MAX_DB_RESULTS)
 
         if db_result:
             # Calculate entropy of requestable slot values in results -
-            # if the flag is off this will be empty
+            # if the flag is off this will be empty. Entropies are calculated
+            # over all the results, not just the ones that were retrieved.
             entropies = \
                 dict.fromkeys(self.ontology.ontology['system_requestable'])
 
             if self.CALCULATE_SLOT_ENTROPIES:
-                value_probabilities = {}
-
-                # Count the values
-                for req_slot in self.ontology.ontology['system_requestable']:
-                    value_probabilities[req_slot] = {}
-
-                    for db_item in db_result:
-                        if db_item[req_slot] not in \
-                                value_probabilities[req_slot]:
-                            value_probabilities[req_slot][
-                                db_item[req_slot]] = 1
-                        else:
-                            value_probabilities[req_slot][
-                                db_item[req_slot]] += 1
-
-                # Calculate probabilities
-                for slot in value_probabilities:
-                    for value in value_probabilities[slot]:
-                        value_probabilities[slot][value] /= len(db_result)
-
-                # Calculate entropies
-                for slot in entropies:
-                    entropies[slot] = 0
-
-                    if slot in value_probabilities:
-                        for value in value_probabilities[slot]:
-                            entropies[slot] += \
-                                value_probabilities[slot][value] * \
-                                math.log(value_probabilities[slot][value])
-
-                    entropies[slot] = -entropies[slot]
+                entropies = database.get_slot_entropies(
+                    d_state, self.ontology.ontology['system_requestable'])
 
             return db_result[:self.MAX_DB_RESULTS], entropies
 
@@ -546,6 +536,10 @@ class DialogueManagerGeneric(ConversationalModule):
 
         self.DSTracker.initialize(args)
         self.policy.restart(args)
+
+        if self.db_cache:
+            self.db_cache.restart()
+
         self.dialogue_counter += 1
 
     def update_goal(self, goal):
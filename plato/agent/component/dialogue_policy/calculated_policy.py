@@ -11,14 +11,16 @@ limitations under the License.
 
 __author__ = "Alexandros Papangelis"
 
-from plato.agent.component.dialogue_policy import dialogue_policy
+from plato.agent.component.dialogue_policy import dialogue_policy, \
+    state_encoder
+from plato.agent.component.dialogue_policy.state_encoder import StateEncoder
 from plato.domain.ontology import Ontology
 from plato.domain.database import DataBase
 from plato.dialogue.action import DialogueAct, DialogueActItem, Operator
 from plato.dialogue.state import SlotFillingDialogueState
+from plato.utilities import policy_file
 from copy import deepcopy
 
-import pickle
 import random
 import os
 
@@ -83,6 +85,8 @@ class CalculatedPolicy(dialogue_policy.DialoguePolicy):
         self.system_requestable_slots = \
             deepcopy(self.ontology.ontology['system_requestable'])
 
+        self.state_encoder = self.build_state_encoder()
+
         self.dstc2_acts = None
 
         # Plato does not use action masks (rules to define which
@@ -260,78 +264,76 @@ class CalculatedPolicy(dialogue_policy.DialoguePolicy):
         """
         pass
 
-    def encode_state(self, state):
+    def build_state_encoder(self):
         """
-        Encodes the dialogue state into an index used to address the matrix.
+        Build the encoder of dialogue states into indices used to address the
+        matrix.
 
-        :param state: the state to encode
-        :return: int - a unique state encoding
+        :return: a StateEncoder
         """
 
-        temp = [int(state.is_terminal_state)]
-
-        temp.append(1) if state.system_made_offer else temp.append(0)
+        encoder = StateEncoder()
+        encoder.add_flag(state_encoder.is_terminal)
+        encoder.add_flag(state_encoder.made_offer)
 
-        # If the agent plays the role of the user it needs access to its
-        #  own goal
         if self.agent_role == 'user':
             # The user agent needs to know which constraints and requests
             # need to be communicated and which of them
             # actually have.
-            if state.user_goal:
-                for c in self.informable_slots:
-                    if c != 'name':
-                        if c in state.user_goal.constraints and \
-                                state.user_goal.constraints[c].value:
-                            temp.append(1)
-                        else:
-                            temp.append(0)
-
-                        if c in state.user_goal.actual_constraints and \
-                                state.user_goal.actual_constraints[c].value:
-                            temp.append(1)
-                        else:
-                            temp.append(0)
-
-                for r in self.requestable_slots:
-                    if r in state.user_goal.requests:
-                        temp.append(1)
-                    else:
-                        temp.append(0)
-
-                    if r in state.user_goal.actual_requests and \
-                            state.user_goal.actual_requests[r].value:
-                        temp.append(1)
-                    else:
-                        temp.append(0)
+            features = []
 
-            else:
-                temp += [0] * 2 * (len(self.informable_slots) - 1 +
-                                   len(self.requestable_slots))
+            for c in self.informable_slots:
+                if c != 'name':
+                    features.append((state_encoder.has_constraint_value, c))
+                    features.append(
+                        (state_encoder.has_actual_constraint_value, c))
+
+            for r in self.requestable_slots:
+                features.append((state_encoder.has_request, r))
+                features.append((state_encoder.has_actual_request_value, r))
+
+            encoder.add_encoder(
+                StateEncoder().add_goal_flags(features),
+                state_encoder.has_user_goal,
+                2 * (len(self.informable_slots) - 1 +
+                     len(self.requestable_slots)))
 
         if self.agent_role == 'system':
-            for value in state.slots_filled.values():
-                # This contains the requested slot
-                temp.append(1) if value else temp.append(0)
+            encoder.add_values(state_encoder.slots_filled_values,
+                               len(self.system_requestable_slots))
+            encoder.add_one_hot(state_encoder.requested_slot,
+                                self.requestable_slots)
 
-            for r in self.requestable_slots:
-                temp.append(1) if r == state.requested_slot else temp.append(0)
+        return encoder
 
-        # Encode state
-        state_enc = 0
-        for t in temp:
-            state_enc = (state_enc << 1) | t
+    def encode_state(self, state):
+        """
+        Encodes the dialogue state into an index used to address the matrix.
+
+        :param state: the state to encode
+        :return: int - a unique state encoding
+        """
 
-        return state_enc
+        return self.state_encoder.encode(state)
 
     def save(self, path=None):
         """
-        Nothing to do here.
+        The dialogue policy is not trained, so there is nothing to save,
+        unless a policy file path is provided: then the action probabilities
+        of a (pickled) policy are saved as a policy file.
 
-        :param path:
+        :param path: path to save the dialogue policy to
         :return:
         """
-        pass
+
+        if path and path.endswith(policy_file.POLICY_FILE_EXTENSION) and \
+                isinstance(self.policy, dict):
+            policy_file.save_policy_file(
+                path, 'CalculatedPolicy',
+                tables={'dialogue_policy': policy_file.ragged_table(
+                    {state: self.policy[state]['dacts']
+                     for state in self.policy},
+                    field='dacts')})
 
     def load(self, path=None):
         """
@@ -352,14 +354,13 @@ class CalculatedPolicy(dialogue_policy.DialoguePolicy):
         self.policy = None
         if isinstance(pol_path, str):
             if os.path.isfile(pol_path):
-                with open(pol_path, 'rb') as file:
-                    obj = pickle.load(file)
+                obj = policy_file.load_model(pol_path)
 
-                    if 'dialogue_policy' in obj:
-                        self.policy = obj['dialogue_policy']
+                if 'dialogue_policy' in obj:
+                    self.policy = obj['dialogue_policy']
 
-                    print(f'Calculated dialogue policy {self.agent_role} '
-                          f'policy loaded.')
+                print(f'Calculated dialogue policy {self.agent_role} '
+                      f'policy loaded.')
 
             else:
                 print(f'Warning! {self.agent_role} dialogue policy file '
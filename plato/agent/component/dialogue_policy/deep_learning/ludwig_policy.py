@@ -13,6 +13,7 @@ __author__ = "Alexandros Papangelis"
 
 
 from ludwig.api import LudwigModel
+from plato.utilities.batch_predictor import load_predictor
 from .. import dialogue_policy
 import os.path
 
@@ -22,6 +23,8 @@ models.
 
 This is an example class that you can extend to interface with your Ludwig
 dialogue_policy model.
+Subclasses should query the model through self.predictor.predict(), so that
+the requests of concurrent dialogues can be batched.
 """
 
 
@@ -38,7 +41,17 @@ class LudwigPolicy(dialogue_policy):
         if 'model_path' in args:
             model_path = args['model_path']
 
+        # Requests of concurrent dialogues are batched if batch_size > 1
+        self.batch_size = 1
+        if 'batch_size' in args:
+            self.batch_size = int(args['batch_size'])
+
+        self.batch_wait_ms = 5
+        if 'batch_wait_ms' in args:
+            self.batch_wait_ms = float(args['batch_wait_ms'])
+
         self.model = None
+        self.predictor = None
 
         self.load(model_path)
 
@@ -49,7 +62,7 @@ class LudwigPolicy(dialogue_policy):
         :return:
         """
 
-        if self.model:
+        if self.model and not self.predictor.shared:
             self.model.close()
 
     def initialize(self, args):
@@ -119,7 +132,10 @@ class LudwigPolicy(dialogue_policy):
         if isinstance(model_path, str):
             if os.path.isdir(model_path):
                 print('Loading Ludwig Policy model...')
-                self.model = LudwigModel.load(model_path)
+                self.predictor = \
+                    load_predictor(model_path, LudwigModel.load,
+                                   self.batch_size, self.batch_wait_ms)
+                self.model = self.predictor.model
                 print('done!')
 
             else:
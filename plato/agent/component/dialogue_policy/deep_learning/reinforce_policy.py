@@ -11,17 +11,21 @@ limitations under the License.
 
 __author__ = "Alexandros Papangelis"
 
-from .. import dialogue_policy
+from .. import dialogue_policy, state_encoder
+from ..state_encoder import StateEncoder
 from plato.agent.component.dialogue_policy.slot_filling_policy \
     import HandcraftedPolicy
 from plato.domain.ontology import Ontology
 from plato.domain.database import DataBase
 from plato.dialogue.action import DialogueAct, DialogueActItem, Operator
 from plato.dialogue.state import SlotFillingDialogueState
+from plato.utilities import policy_file
 from plato.agent.component.user_simulator.\
     agenda_based_user_simulator.agenda_based_us import AgendaBasedUS
+from scipy.signal import lfilter
 from copy import deepcopy
 
+import multiprocessing
 import numpy as np
 import random
 import os
@@ -33,6 +37,26 @@ learning.
 """
 
 
+# The policy and the turns that worker processes compute policy gradients for
+# (see ReinforcePolicy.parallel_policy_gradient())
+worker_job = None
+
+
+def worker_policy_gradient(bounds):
+    """
+    Calculates the policy gradient of a range of the turns of worker_job.
+
+    :param bounds: the start and end of the range
+    :return: the gradient with respect to the weights
+    """
+
+    policy, states, actions, returns = worker_job
+    start, end = bounds
+
+    return policy.policy_gradient(states[start:end], actions[start:end],
+                                  returns[start:end])
+
+
 class ReinforcePolicy(dialogue_policy.DialoguePolicy):
 
     def __init__(self, args):
@@ -81,6 +105,15 @@ class ReinforcePolicy(dialogue_policy.DialoguePolicy):
         self.exploration_decay_rate = \
             args['epsilon_decay'] if 'epsilon_decay' in args else 0.9995
 
+        # Train on whole minibatches with a few matrix operations, instead
+        # of one turn at a time, optionally using worker processes to
+        # compute the gradient
+        self.batch_training = \
+            bool(args['batch_training']) if 'batch_training' in args \
+            else False
+        self.num_workers = \
+            int(args['num_workers']) if 'num_workers' in args else 0
+
         self.IS_GREEDY = False
 
         self.policy_path = None
@@ -118,6 +151,8 @@ class ReinforcePolicy(dialogue_policy.DialoguePolicy):
         self.system_requestable_slots = \
             deepcopy(self.ontology.ontology['system_requestable'])
 
+        self.state_encoder = self.build_state_encoder()
+
         if not domain:
             # Default to CamRest dimensions
             self.NStateFeatures = 56
@@ -382,17 +417,43 @@ class ReinforcePolicy(dialogue_policy.DialoguePolicy):
         if not self.is_training:
             return
 
+        # The weights may have been loaded from a (read-only) policy file
+        if not self.weights.flags.writeable:
+            self.weights = np.array(self.weights)
+
+        if self.batch_training:
+            self.train_batch(dialogues)
+
+        else:
+            self.train_sequential(dialogues)
+
+        if self.alpha > 0.01:
+            self.alpha *= self.alpha_decay_rate
+
+        if self.epsilon > 0.5:
+            self.epsilon *= self.exploration_decay_rate
+
+        print(f'REINFORCE train, alpha: {self.alpha}, epsilon: {self.epsilon}')
+
+    def train_sequential(self, dialogues):
+        """
+        Update the policy after each turn of each dialogue.
+
+        :param dialogues: dialogue experience
+        :return: nothing
+        """
+
         for dialogue in dialogues:
-            discount = self.gamma
+            if not dialogue:
+                continue
 
-            if len(dialogue) > 1:
-                dialogue[-2]['reward'] = dialogue[-1]['reward']
+            rewards, turn_indices = self.get_rewards(dialogue)
+            discount = self.gamma ** (turn_indices[0] + 1)
 
-            rewards = [t['reward'] for t in dialogue]
             norm_rewards = \
                 (rewards - np.mean(rewards)) / (np.std(rewards) + 0.000001)
 
-            for (t, turn) in enumerate(dialogue):
+            for (t, turn) in zip(turn_indices, dialogue):
                 act_enc = self.encode_action(turn['action'],
                                              self.agent_role == 'system')
                 if act_enc < 0:
@@ -421,78 +482,216 @@ class ReinforcePolicy(dialogue_policy.DialoguePolicy):
                         log_policy_grad[None, :])
                 gradient = np.clip(gradient, -1.0, 1.0)
 
-                # Train policy
+                # Train policy (transitions sampled from a replay buffer are
+                # weighted by their importance sampling weight)
                 self.weights += \
-                    self.alpha * gradient * norm_rewards[t] * discount
+                    self.alpha * turn.get('weight', 1.0) * gradient * \
+                    norm_rewards[t] * discount
                 self.weights = np.clip(self.weights, -1, 1)
 
                 discount *= self.gamma
 
-        if self.alpha > 0.01:
-            self.alpha *= self.alpha_decay_rate
+    def train_batch(self, dialogues):
+        """
+        Update the policy once, with the average policy gradient over all
+        turns of the dialogues. Each turn is weighted by its discounted
+        return, normalized over the whole minibatch.
 
-        if self.epsilon > 0.5:
-            self.epsilon *= self.exploration_decay_rate
+        :param dialogues: dialogue experience
+        :return: nothing
+        """
 
-        print(f'REINFORCE train, alpha: {self.alpha}, epsilon: {self.epsilon}')
+        states = []
+        actions = []
+        returns = []
+        weights = []
 
-    def encode_state(self, state):
+        for dialogue in dialogues:
+            rewards, turn_indices = self.get_rewards(dialogue)
+            dialogue_returns = \
+                self.discounted_returns(rewards, self.gamma)[turn_indices]
+
+            for turn, turn_return in zip(dialogue, dialogue_returns):
+                act_enc = self.encode_action(turn['action'],
+                                             self.agent_role == 'system')
+                if act_enc < 0:
+                    continue
+
+                states.append(turn['state'])
+                actions.append(act_enc)
+                returns.append(turn_return)
+                weights.append(turn.get('weight', 1.0))
+
+        if not states:
+            return
+
+        returns = np.asarray(returns)
+        returns = (returns - np.mean(returns)) / (np.std(returns) + 0.000001)
+
+        # Transitions sampled from a replay buffer are weighted by their
+        # importance sampling weight
+        returns = returns * np.asarray(weights)
+
+        if self.num_workers > 1 and len(states) > self.num_workers:
+            gradient = self.parallel_policy_gradient(states, actions, returns)
+        else:
+            gradient = self.policy_gradient(states, actions, returns)
+
+        self.weights += self.alpha * gradient / len(states)
+        self.weights = np.clip(self.weights, -1, 1)
+
+    @staticmethod
+    def get_rewards(dialogue):
+        """
+        Get the rewards of a dialogue, after copying the reward of its last
+        turn to the turn before it. Transitions sampled from a replay buffer
+        (see plato.utilities.replay_buffer) are one-turn dialogues that carry
+        the rewards of their whole dialogue.
+
+        :param dialogue: the dialogue, a list of turns
+        :return: the rewards of the whole dialogue, and the index in it of
+                 each turn of the given dialogue
         """
-        Encodes the dialogue state into a vector.
 
-        :param state: the state to encode
-        :return: int - a unique state encoding
+        if len(dialogue) == 1 and 'dialogue_rewards' in dialogue[0]:
+            return dialogue[0]['dialogue_rewards'], \
+                [dialogue[0]['turn_index']]
+
+        if len(dialogue) > 1:
+            dialogue[-2]['reward'] = dialogue[-1]['reward']
+
+        return [t['reward'] for t in dialogue], list(range(len(dialogue)))
+
+    @staticmethod
+    def discounted_returns(rewards, gamma):
+        """
+        Calculates the discounted return of each turn of a dialogue
+
+        :param rewards: the rewards of the turns
+        :param gamma: the discount factor
+        :return: an array with the return of each turn
         """
 
-        temp = [int(state.is_terminal_state), int(state.system_made_offer)]
+        rewards = np.asarray(rewards, dtype=np.float64)
+
+        return lfilter([1], [1, -gamma], rewards[::-1])[::-1]
+
+    def policy_gradient(self, states, actions, returns):
+        """
+        Calculates the sum of the policy gradients of a number of turns
+
+        :param states: the dialogue states of the turns
+        :param actions: the encoded actions taken at the turns
+        :param returns: the (normalized) returns of the turns
+        :return: the gradient with respect to the weights
+        """
+
+        state_encs = self.state_encoder.encode_batch_bits(states)
+
+        if state_encs.shape[1] != self.NStateFeatures:
+            raise ValueError(f'Reinforce dialogue policy '
+                             f'{self.agent_role} mismatch in state'
+                             f'dimensions: State Features: '
+                             f'{self.NStateFeatures} != State '
+                             f'Encoding Length: {state_encs.shape[1]}')
+
+        state_encs = state_encs.astype(np.float64)
+
+        # Action probabilities of all turns
+        logits = state_encs.dot(self.weights)
+        probabilities = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+
+        # Gradient of the log probability of each action taken, with
+        # respect to the logits
+        log_policy_grads = -probabilities
+        log_policy_grads[np.arange(len(actions)), actions] += 1
+
+        return state_encs.T.dot(
+            log_policy_grads * np.asarray(returns)[:, None])
+
+    def parallel_policy_gradient(self, states, actions, returns):
+        """
+        Calculates the sum of the policy gradients of a number of turns,
+        splitting the turns among worker processes. The workers are forked,
+        so they inherit the turns instead of receiving them pickled.
+
+        :param states: the dialogue states of the turns
+        :param actions: the encoded actions taken at the turns
+        :param returns: the (normalized) returns of the turns
+        :return: the gradient with respect to the weights
+        """
+
+        global worker_job
+
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            print('WARNING! Reinforce policy: Worker processes are not '
+                  'supported on this platform, computing the gradient in '
+                  'this process.')
+            return self.policy_gradient(states, actions, returns)
+
+        bounds = np.linspace(0, len(states), self.num_workers + 1, dtype=int)
+        worker_job = (self, states, actions, returns)
+
+        try:
+            with multiprocessing.get_context('fork').Pool(
+                    self.num_workers) as pool:
+                gradients = pool.map(worker_policy_gradient,
+                                     zip(bounds[:-1], bounds[1:]))
+        finally:
+            worker_job = None
+
+        return np.sum(gradients, axis=0)
+
+    def build_state_encoder(self):
+        """
+        Build the encoder of dialogue states into vectors.
+
+        :return: a StateEncoder
+        """
+
+        encoder = StateEncoder()
+        encoder.add_flag(state_encoder.is_terminal)
+        encoder.add_flag(state_encoder.made_offer)
 
         if self.agent_role == 'user':
             # The user agent needs to know which constraints and requests
             # need to be communicated and which of them
             # actually have.
-            if state.user_goal:
-                for c in self.informable_slots:
-                    if c != 'name':
-                        if c in state.user_goal.constraints:
-                            temp.append(1)
-                        else:
-                            temp.append(0)
-
-                for c in self.informable_slots:
-                    if c != 'name':
-                        if c in state.user_goal.actual_constraints and \
-                                state.user_goal.actual_constraints[c].value:
-                            temp.append(1)
-                        else:
-                            temp.append(0)
-
-                for r in self.requestable_slots:
-                    if r in state.user_goal.requests:
-                        temp.append(1)
-                    else:
-                        temp.append(0)
-
-                for r in self.requestable_slots:
-
-                    if r in state.user_goal.actual_requests and \
-                            state.user_goal.actual_requests[r].value:
-                        temp.append(1)
-                    else:
-                        temp.append(0)
-
-            else:
-                temp += [0] * 2 * (len(self.informable_slots) - 1 +
-                                   len(self.requestable_slots))
+            constraints = [c for c in self.informable_slots if c != 'name']
+
+            goal_encoder = StateEncoder().add_goal_flags(
+                [(state_encoder.has_constraint, c) for c in constraints] +
+                [(state_encoder.has_actual_constraint_value, c)
+                 for c in constraints] +
+                [(state_encoder.has_request, r)
+                 for r in self.requestable_slots] +
+                [(state_encoder.has_actual_request_value, r)
+                 for r in self.requestable_slots])
+
+            encoder.add_encoder(
+                goal_encoder,
+                state_encoder.has_user_goal,
+                2 * (len(self.informable_slots) - 1 +
+                     len(self.requestable_slots)))
 
         if self.agent_role == 'system':
-            for value in state.slots_filled.values():
-                # This contains the requested slot
-                temp.append(1) if value else temp.append(0)
+            encoder.add_values(state_encoder.slots_filled_values,
+                               len(self.system_requestable_slots))
+            encoder.add_one_hot(state_encoder.requested_slot,
+                                self.requestable_slots)
+
+        return encoder
+
+    def encode_state(self, state):
+        """
+        Encodes the dialogue state into a vector.
 
-            for r in self.requestable_slots:
-                temp.append(1) if r == state.requested_slot else temp.append(0)
+        :param state: the state to encode
+        :return: a numpy array of zeros and ones
+        """
 
-        return temp
+        return self.state_encoder.encode_bits(state)
 
     def encode_action(self, actions, system=True):
         """
@@ -639,6 +838,14 @@ class ReinforcePolicy(dialogue_policy.DialoguePolicy):
                'epsilon': self.epsilon,
                'exploration_decay_rate': self.exploration_decay_rate}
 
+        if path.endswith(policy_file.POLICY_FILE_EXTENSION):
+            del obj['weights']
+
+            policy_file.save_policy_file(
+                path, 'ReinforcePolicy', params=obj,
+                arrays={'weights': self.weights})
+            return
+
         with open(path, 'wb') as file:
             pickle.dump(obj, file, pickle.HIGHEST_PROTOCOL)
 
@@ -656,27 +863,26 @@ class ReinforcePolicy(dialogue_policy.DialoguePolicy):
 
         if isinstance(path, str):
             if os.path.isfile(path):
-                with open(path, 'rb') as file:
-                    obj = pickle.load(file)
+                obj = policy_file.load_model(path)
 
-                    if 'weights' in obj:
-                        self.weights = obj['weights']
+                if 'weights' in obj:
+                    self.weights = obj['weights']
 
-                    if 'alpha' in obj:
-                        self.alpha = obj['alpha']
+                if 'alpha' in obj:
+                    self.alpha = obj['alpha']
 
-                    if 'alpha_decay_rate' in obj:
-                        self.alpha_decay_rate = obj['alpha_decay_rate']
+                if 'alpha_decay_rate' in obj:
+                    self.alpha_decay_rate = obj['alpha_decay_rate']
 
-                    if 'epsilon' in obj:
-                        self.epsilon = obj['epsilon']
+                if 'epsilon' in obj:
+                    self.epsilon = obj['epsilon']
 
-                    if 'exploration_decay_rate' in obj:
-                        self.exploration_decay_rate = \
-                            obj['exploration_decay_rate']
+                if 'exploration_decay_rate' in obj:
+                    self.exploration_decay_rate = \
+                        obj['exploration_decay_rate']
 
-                    print('Reinforce policy loaded from {0}.'
-                          .format(path))
+                print('Reinforce policy loaded from {0}.'
+                      .format(path))
 
             else:
                 print('Warning! Reinforce policy file %s not found'
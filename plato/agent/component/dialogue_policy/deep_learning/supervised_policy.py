@@ -11,7 +11,8 @@ limitations under the License.
 
 __author__ = "Alexandros Papangelis"
 
-from .. import dialogue_policy
+from .. import dialogue_policy, state_encoder
+from ..state_encoder import StateEncoder
 from plato.agent.component.dialogue_policy.slot_filling_policy\
     import HandcraftedPolicy
 from plato.domain.ontology import Ontology
@@ -97,6 +98,8 @@ class SupervisedPolicy(dialogue_policy.DialoguePolicy):
         self.system_requestable_slots = \
             deepcopy(self.ontology.ontology['system_requestable'])
 
+        self.state_encoder = self.build_state_encoder()
+
         self.dstc2_acts = None
 
         if not domain:
@@ -362,65 +365,55 @@ class SupervisedPolicy(dialogue_policy.DialoguePolicy):
             pl_optimizer,
             feed_dict={pl_state: states, pl_newvals: actions})
 
-    def encode_state(self, state):
+    def build_state_encoder(self):
         """
-        Encodes the dialogue state into a vector.
+        Build the encoder of dialogue states into vectors.
 
-        :param state: the state to encode
-        :return: int - a unique state encoding
+        :return: a StateEncoder
         """
 
-        temp = [int(state.is_terminal_state)]
+        encoder = StateEncoder()
+        encoder.add_flag(state_encoder.is_terminal)
+        encoder.add_flag(state_encoder.made_offer)
 
-        temp.append(1) if state.system_made_offer else temp.append(0)
-
-        # If the agent plays the role of the user it needs access to its own
-        # goal
         if self.agent_role == 'user':
             # The user agent needs to know which constraints and requests
             # need to be communicated and which of them
             # actually have.
-            if state.user_goal:
-                for c in self.informable_slots:
-                    if c != 'name':
-                        if c in state.user_goal.constraints:
-                            temp.append(1)
-                        else:
-                            temp.append(0)
-
-                for c in self.informable_slots:
-                    if c != 'name':
-                        if c in state.user_goal.actual_constraints and \
-                                state.user_goal.actual_constraints[c].value:
-                            temp.append(1)
-                        else:
-                            temp.append(0)
-
-                for r in self.requestable_slots:
-                    if r in state.user_goal.requests:
-                        temp.append(1)
-                    else:
-                        temp.append(0)
-
-                for r in self.requestable_slots:
-                    if r in state.user_goal.actual_requests and \
-                            state.user_goal.actual_requests[r].value:
-                        temp.append(1)
-                    else:
-                        temp.append(0)
-            else:
-                temp += [0] * 2 * (len(self.informable_slots) - 1 +
-                                   len(self.requestable_slots))
+            constraints = [c for c in self.informable_slots if c != 'name']
+
+            goal_encoder = StateEncoder().add_goal_flags(
+                [(state_encoder.has_constraint, c) for c in constraints] +
+                [(state_encoder.has_actual_constraint_value, c)
+                 for c in constraints] +
+                [(state_encoder.has_request, r)
+                 for r in self.requestable_slots] +
+                [(state_encoder.has_actual_request_value, r)
+                 for r in self.requestable_slots])
+
+            encoder.add_encoder(
+                goal_encoder,
+                state_encoder.has_user_goal,
+                2 * (len(self.informable_slots) - 1 +
+                     len(self.requestable_slots)))
 
         if self.agent_role == 'system':
-            for value in state.slots_filled.values():
-                # This contains the requested slot
-                temp.append(1) if value else temp.append(0)
+            encoder.add_values(state_encoder.slots_filled_values,
+                               len(self.system_requestable_slots))
+            encoder.add_one_hot(state_encoder.requested_slot,
+                                self.requestable_slots)
+
+        return encoder
 
-            for r in self.requestable_slots:
-                temp.append(1) if r == state.requested_slot else temp.append(0)
+    def encode_state(self, state):
+        """
+        Encodes the dialogue state into a vector.
+
+        :param state: the state to encode
+        :return: a numpy array of zeros and ones
+        """
 
-        return temp
+        return self.state_encoder.encode_bits(state)
 
     def encode_action(self, actions, system=True):
         """
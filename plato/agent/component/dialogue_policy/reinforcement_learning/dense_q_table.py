@@ -0,0 +1,332 @@
+"""
+Copyright (c) 2019 Uber Technologies, Inc.
+
+Licensed under the Uber Non-Commercial License (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at the root directory of this project.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = "Alexandros Papangelis"
+
+import numpy as np
+
+"""
+DenseQTable stores Q values in a dense float32 matrix with one row per state
+and one column per action. A hash index maps state encodings to rows, so a
+batch of transitions can be updated with a few vectorized operations instead
+of one dictionary lookup per turn.
+"""
+
+
+class DenseQTable:
+    """
+    Dense Q table. Like the dictionary Q table of the QPolicy, it keeps track
+    of which actions have been visited from each state, so maxima and greedy
+    actions only consider visited actions.
+    """
+
+    def __init__(self, num_actions, capacity=1024):
+        """
+        Initialize an empty Q table.
+
+        :param num_actions: the number of actions (columns)
+        :param capacity: the initial number of rows
+        """
+
+        self.num_actions = num_actions
+
+        # State encoding -> row
+        self.index = {}
+
+        self.values = np.zeros((max(capacity, 1), num_actions),
+                               dtype=np.float32)
+        self.visited = np.zeros((max(capacity, 1), num_actions), dtype=bool)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, state_enc):
+        return state_enc in self.index
+
+    def __getstate__(self):
+        """
+        Get the table's attributes for pickling, without the unused rows.
+
+        :return: a dictionary with the table's attributes
+        """
+
+        return {'num_actions': self.num_actions,
+                'index': dict(self.index.items())
+                if not isinstance(self.index, dict) else self.index,
+                'values': self.values[:len(self.index)],
+                'visited': self.visited[:len(self.index)]}
+
+    def __setstate__(self, state):
+        """
+        Restore the table's attributes.
+
+        :param state: a dictionary with the table's attributes
+        :return: nothing
+        """
+
+        self.num_actions = state['num_actions']
+        self.index = state['index']
+        self.values = np.array(state['values'], dtype=np.float32)
+        self.visited = np.array(state['visited'], dtype=bool)
+        self.reserve(len(self.index) + 1)
+
+    @classmethod
+    def from_arrays(cls, index, values, visited):
+        """
+        Create a table from existing arrays, without copying them (e.g. from
+        the read-only arrays of a policy file). The table is copied the first
+        time it is modified.
+
+        :param index: a mapping of state encoding -> row
+        :param values: the Q values, with one row per state
+        :param visited: the visited actions, with one row per state
+        :return: a DenseQTable
+        """
+
+        table = cls.__new__(cls)
+        table.num_actions = values.shape[1]
+        table.index = index
+        table.values = values
+        table.visited = visited
+
+        return table
+
+    def make_writable(self):
+        """
+        Copy the index and the matrices if they cannot be modified (see
+        from_arrays()).
+
+        :return: nothing
+        """
+
+        if not isinstance(self.index, dict):
+            self.index = dict(self.index.items())
+
+        if not self.values.flags.writeable or \
+                not self.visited.flags.writeable:
+            self.values = np.array(self.values, dtype=np.float32)
+            self.visited = np.array(self.visited, dtype=bool)
+            self.reserve(len(self.index) + 1)
+
+    def row_keys(self):
+        """
+        Get the state encodings of the rows.
+
+        :return: a list of state encodings, in row order
+        """
+
+        keys = [None] * len(self.index)
+
+        for state_enc, row in self.index.items():
+            keys[row] = state_enc
+
+        return keys
+
+    def reserve(self, num_rows):
+        """
+        Make sure that the matrices have at least num_rows rows, doubling
+        their size as needed.
+
+        :param num_rows: the number of rows
+        :return: nothing
+        """
+
+        capacity = self.values.shape[0]
+
+        if num_rows <= capacity:
+            return
+
+        capacity = max(capacity, 1)
+        while capacity < num_rows:
+            capacity *= 2
+
+        values = np.zeros((capacity, self.num_actions), dtype=np.float32)
+        visited = np.zeros((capacity, self.num_actions), dtype=bool)
+
+        values[:self.values.shape[0]] = self.values
+        visited[:self.visited.shape[0]] = self.visited
+
+        self.values = values
+        self.visited = visited
+
+    def lookup(self, state_encs):
+        """
+        Get the rows of a number of states.
+
+        :param state_encs: the state encodings
+        :return: an array of rows, with -1 for unknown states
+        """
+
+        index = self.index
+
+        return np.fromiter((index.get(s, -1) for s in state_encs),
+                           dtype=np.int64, count=len(state_encs))
+
+    def add(self, state_encs):
+        """
+        Get the rows of a number of states, adding rows for unknown states.
+
+        :param state_encs: the state encodings
+        :return: an array of rows
+        """
+
+        self.make_writable()
+
+        index = self.index
+        rows = np.empty(len(state_encs), dtype=np.int64)
+
+        for i, state_enc in enumerate(state_encs):
+            row = index.get(state_enc)
+
+            if row is None:
+                row = len(index)
+                index[state_enc] = row
+
+            rows[i] = row
+
+        self.reserve(len(index))
+
+        return rows
+
+    def max_values(self, rows):
+        """
+        Get the maximum Q value over the visited actions of each row.
+
+        :param rows: the rows, as returned by lookup()
+        :return: a float32 array, with 0 for unknown or unvisited rows
+        """
+
+        rows = np.asarray(rows, dtype=np.int64)
+        result = np.zeros(len(rows), dtype=np.float32)
+        known = rows >= 0
+
+        if known.any():
+            known_rows = rows[known]
+            maxima = np.where(self.visited[known_rows],
+                              self.values[known_rows],
+                              -np.inf).max(axis=1)
+            result[known] = np.where(np.isfinite(maxima), maxima, 0)
+
+        return result
+
+    def greedy_action(self, state_enc):
+        """
+        Get the visited action with the maximum Q value from a state.
+
+        :param state_enc: the state encoding
+        :return: the action encoding, or -1 if no action has been visited
+        """
+
+        row = self.index.get(state_enc, -1)
+
+        if row < 0 or not self.visited[row].any():
+            return -1
+
+        return int(np.argmax(np.where(self.visited[row],
+                                      self.values[row],
+                                      -np.inf)))
+
+    def action_values(self, state_enc):
+        """
+        Get the Q values of all actions from a state.
+
+        :param state_enc: the state encoding
+        :return: a float32 array (zeros for unknown states)
+        """
+
+        row = self.index.get(state_enc, -1)
+
+        if row < 0:
+            return np.zeros(self.num_actions, dtype=np.float32)
+
+        return self.values[row]
+
+    def update(self, rows, actions, targets, alpha, weights=None):
+        """
+        Move the Q values of a batch of transitions towards their targets.
+        All TD errors are computed from the Q values before the update, and
+        transitions with the same state and action share the mean of their
+        (weighted) TD errors.
+
+        :param rows: the rows of the transitions' states, as returned by add()
+        :param actions: the transitions' action encodings
+        :param targets: the transitions' TD targets
+        :param alpha: the learning rate
+        :param weights: the transitions' weights (e.g. importance sampling
+                        weights), or None to weigh them equally
+        :return: an array with the TD error of each transition
+        """
+
+        rows = np.asarray(rows, dtype=np.int64)
+        actions = np.asarray(actions, dtype=np.int64)
+
+        if not len(rows):
+            return np.zeros(0)
+
+        self.make_writable()
+
+        cells = rows * self.num_actions + actions
+        cells, inverse, counts = \
+            np.unique(cells, return_inverse=True, return_counts=True)
+
+        flat_values = self.values.reshape(-1)
+        errors = np.asarray(targets, dtype=np.float64) - \
+            flat_values[cells][inverse]
+
+        weighted_errors = errors if weights is None else \
+            errors * np.asarray(weights, dtype=np.float64)
+
+        flat_values[cells] += \
+            alpha * np.bincount(inverse, weights=weighted_errors) / counts
+        self.visited.reshape(-1)[cells] = True
+
+        return errors
+
+    def to_dict(self):
+        """
+        Convert the table to the dictionary format of the QPolicy.
+
+        :return: a dictionary of state encoding -> action encoding -> Q value
+        """
+
+        Q = {}
+
+        for state_enc, row in self.index.items():
+            actions = np.flatnonzero(self.visited[row])
+            Q[state_enc] = dict(zip(actions.tolist(),
+                                    self.values[row, actions].tolist()))
+
+        return Q
+
+    @classmethod
+    def from_dict(cls, Q, num_actions):
+        """
+        Create a table from the dictionary format of the QPolicy.
+
+        :param Q: a dictionary of state encoding -> action encoding -> Q value
+        :param num_actions: the number of actions
+        :return: a DenseQTable
+        """
+
+        # States without any visited actions are left out, as they would be
+        # unknown to the dictionary Q table's greedy policy too
+        Q = {state_enc: action_values
+             for state_enc, action_values in Q.items() if action_values}
+
+        table = cls(num_actions, len(Q))
+        rows = table.add(list(Q))
+
+        for row, action_values in zip(rows, Q.values()):
+            for action_enc, value in action_values.items():
+                table.values[row, action_enc] = value
+                table.visited[row, action_enc] = True
+
+        return table
@@ -11,10 +11,12 @@ limitations under the License.
 
 __author__ = "Alexandros Papangelis"
 
-from .. import dialogue_policy, slot_filling_policy
+from .. import dialogue_policy, slot_filling_policy, state_encoder
+from ..state_encoder import StateEncoder
 from plato.dialogue.action import DialogueAct, DialogueActItem, Operator
 from plato.domain.ontology import Ontology
 from plato.domain.database import DataBase
+from plato.utilities import policy_file
 from plato.agent.component.user_simulator.agenda_based_user_simulator.\
     agenda_based_us import AgendaBasedUS
 
@@ -35,6 +37,9 @@ in multi-agent environments.
 
 
 class MinimaxQPolicy(dialogue_policy.DialoguePolicy):
+    # Maximum (relative) duality gap for reusing the last maxmin solution
+    MAXMIN_TOLERANCE = 1e-9
+
     def __init__(self, args):
         """
         Initialize parameters and internal structures
@@ -88,6 +93,17 @@ class MinimaxQPolicy(dialogue_policy.DialoguePolicy):
         self.V = {}
         self.pi = {}
 
+        # The maxmin linear program, which has the same structure for all
+        # states (see build_maxmin_lp())
+        self.maxmin_lp = None
+
+        # State encoding -> (policy, other agent's policy) of the last
+        # maxmin solution, used to warm start maxmin()
+        self.maxmin_solutions = {}
+
+        # States whose Q values changed since their V was last computed
+        self.dirty_states = set()
+
         self.pp = pprint.PrettyPrinter(width=160)     # For debug!
 
         # System and user expert policies (optional)
@@ -135,6 +151,8 @@ class MinimaxQPolicy(dialogue_policy.DialoguePolicy):
             deepcopy(self.ontology.ontology['requestable'])
         self.system_requestable_slots = \
             deepcopy(self.ontology.ontology['system_requestable'])
+
+        self.state_encoder = self.build_state_encoder()
         
         if self.dstc2_acts_sys:
             if self.agent_role == 'system':
@@ -265,16 +283,17 @@ class MinimaxQPolicy(dialogue_policy.DialoguePolicy):
 
         return sys_acts
 
-    def encode_state(self, state):
+    def build_state_encoder(self):
         """
-        Encodes the dialogue state into an index used to address the Q matrix.
+        Build the encoder of dialogue states into indices used to address the
+        Q matrix.
 
-        :param state: the state to encode
-        :return: int - a unique state encoding
+        :return: a StateEncoder
         """
-        temp = [int(state.is_terminal_state)]
 
-        temp.append(1) if state.system_made_offer else temp.append(0)
+        encoder = StateEncoder()
+        encoder.add_flag(state_encoder.is_terminal)
+        encoder.add_flag(state_encoder.made_offer)
 
         # If the agent plays the role of the user it needs access to its own
         # goal
@@ -282,44 +301,42 @@ class MinimaxQPolicy(dialogue_policy.DialoguePolicy):
             # The user agent needs to know which constraints and requests need
             # to be communicated and which of them
             # actually have.
-            if state.user_goal:
-                found_unanswered_constr = False
-                found_unanswered_req = False
-
-                for c in self.informable_slots:
-                    if c != 'name':
-                        if c in state.user_goal.constraints and \
-                                c not in state.user_goal.actual_constraints:
-                            found_unanswered_constr = True
-                            break
-
-                for r in self.requestable_slots:
-                    if r in state.user_goal.requests and \
-                            not state.user_goal.requests[r].value:
-                        found_unanswered_req = True
-                        break
-
-                temp += \
-                    [int(found_unanswered_constr), int(found_unanswered_req)]
-            else:
-                temp += [0, 0]
+            constraints = [c for c in self.informable_slots if c != 'name']
+            requests = self.requestable_slots
+
+            goal_encoder = StateEncoder()
+            goal_encoder.add_flag(
+                lambda state: any(
+                    c in state.user_goal.constraints and
+                    c not in state.user_goal.actual_constraints
+                    for c in constraints))
+            goal_encoder.add_flag(
+                lambda state: any(
+                    r in state.user_goal.requests and
+                    not state.user_goal.requests[r].value
+                    for r in requests))
+
+            encoder.add_encoder(goal_encoder, state_encoder.has_user_goal, 2)
 
         if self.agent_role == 'system':
-            temp.append(int(state.is_terminal()))
-            temp.append(int(state.system_made_offer))
+            encoder.add_flag(lambda state: state.is_terminal())
+            encoder.add_flag(state_encoder.made_offer)
+            encoder.add_values(state_encoder.slots_filled_values,
+                               len(self.system_requestable_slots))
+            encoder.add_one_hot(state_encoder.requested_slot,
+                                self.requestable_slots)
 
-            for value in state.slots_filled.values():
-                # This contains the requested slot
-                temp.append(1) if value else temp.append(0)
+        return encoder
 
-            for r in self.requestable_slots:
-                temp.append(1) if r == state.requested_slot else temp.append(0)
+    def encode_state(self, state):
+        """
+        Encodes the dialogue state into an index used to address the Q matrix.
 
-        state_enc = 0
-        for t in temp:
-            state_enc = (state_enc << 1) | t
+        :param state: the state to encode
+        :return: int - a unique state encoding
+        """
 
-        return state_enc
+        return self.state_encoder.encode(state)
 
     def encode_action(self, actions, system=True):
         """
@@ -466,13 +483,22 @@ class MinimaxQPolicy(dialogue_policy.DialoguePolicy):
         if not self.is_training:
             return
 
+        # The model may have been loaded from a (read-only) policy file
+        self.Q = policy_file.to_arrays(self.Q)
+        self.V = policy_file.to_dict(self.V)
+        self.pi = policy_file.to_dict(self.pi)
+
         for dialogue in dialogues:
             if len(dialogue) > 1:
                 dialogue[-2]['reward'] = dialogue[-1]['reward']
 
-            for turn in dialogue:
-                state_enc = self.encode_state(turn['state'])
-                new_state_enc = self.encode_state(turn['new_state'])
+            state_encs = self.state_encoder.encode_batch(
+                [turn['state'] for turn in dialogue])
+            new_state_encs = self.state_encoder.encode_batch(
+                [turn['new_state'] for turn in dialogue])
+
+            for turn, state_enc, new_state_enc in \
+                    zip(dialogue, state_encs, new_state_encs):
                 action_enc = \
                     self.encode_action(
                         turn['action'],
@@ -487,19 +513,17 @@ class MinimaxQPolicy(dialogue_policy.DialoguePolicy):
                     continue
 
                 if state_enc not in self.Q:
-                    self.Q[state_enc] = []
-
-                    for oa in range(self.NOtherActions):
-                        self.Q[state_enc].append([])
-
-                        for a in range(self.NActions):
-                            self.Q[state_enc][oa].append(1)
+                    self.Q[state_enc] = \
+                        np.ones((self.NOtherActions, self.NActions))
+                    self.dirty_states.add(state_enc)
 
                 if state_enc not in self.pi:
                     self.pi[state_enc] = float(1/self.NActions)
 
-                if action_enc not in self.Q[state_enc][other_action_enc]:
-                    self.Q[state_enc][other_action_enc][action_enc] = 0
+                Q = self.Q[state_enc]
+
+                if not np.any(Q[other_action_enc] == action_enc):
+                    Q[other_action_enc, action_enc] = 0
 
                 if new_state_enc not in self.V:
                     self.V[new_state_enc] = 0
@@ -511,11 +535,23 @@ class MinimaxQPolicy(dialogue_policy.DialoguePolicy):
 
                 # Only update Q values (actor) that lead to an increase in Q
                 # if delta > self.Q[state_enc][other_action_enc][action_enc]:
-                self.Q[state_enc][other_action_enc][action_enc] += \
-                    self.alpha * delta
+                # Transitions sampled from a replay buffer are weighted by
+                # their importance sampling weight and report their TD error
+                q = Q[other_action_enc, action_enc]
+                Q[other_action_enc, action_enc] += \
+                    self.alpha * turn.get('weight', 1.0) * delta
 
-                # Update V (critic)
-                self.V[state_enc] = self.maxmin(state_enc)
+                if 'replay_index' in turn:
+                    turn['td_error'] = float(delta - q)
+
+                if Q[other_action_enc, action_enc] != q:
+                    self.dirty_states.add(state_enc)
+
+                # Update V (critic), unless Q has not changed since the last
+                # time V was computed
+                if state_enc in self.dirty_states or \
+                        state_enc not in self.V:
+                    self.V[state_enc] = self.maxmin(state_enc)
 
         # Decay learning rate after each episode
         if self.alpha > 0.001:
@@ -528,30 +564,72 @@ class MinimaxQPolicy(dialogue_policy.DialoguePolicy):
         print('MiniMaxQ [alpha: {0}, epsilon: {1}]'
               .format(self.alpha, self.epsilon))
 
-    def maxmin(self, state_enc, retry=False):
+    def build_maxmin_lp(self):
         """
-        Solve the maxmin problem
+        Build the maxmin linear program: maximize v subject to
+        v <= sum_a pi(a) * Q(o, a) for each action o of the other agent,
+        where pi is a probability distribution over actions. The variables
+        are [v, pi(0), ..., pi(NActions - 1)] and only the Q values of the
+        constraint matrix depend on the state.
 
-        :param state_enc: the encoding to the state
-        :param retry:
-        :return:
+        :return: a dictionary with the linear program's arguments
         """
 
         c = np.zeros(self.NActions + 1)
         c[0] = -1
         A_ub = np.ones((self.NOtherActions, self.NActions + 1))
-        A_ub[:, 1:] = -np.asarray(self.Q[state_enc])
         b_ub = np.zeros(self.NOtherActions)
         A_eq = np.ones((1, self.NActions + 1))
         A_eq[0, 0] = 0
         b_eq = [1]
         bounds = ((None, None),) + ((0, 1),) * self.NActions
 
-        res = linprog(c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq,
-                      b_eq=b_eq, bounds=bounds)
+        return {'c': c, 'A_ub': A_ub, 'b_ub': b_ub, 'A_eq': A_eq,
+                'b_eq': b_eq, 'bounds': bounds}
+
+    def maxmin(self, state_enc, retry=False):
+        """
+        Solve the maxmin problem
+
+        :param state_enc: the encoding to the state
+        :param retry:
+        :return:
+        """
+
+        Q = self.Q[state_enc]
+
+        # Warm start: Q usually changes by a single value between two
+        # solves, which often leaves the last solution optimal. It is, if
+        # the worst case value of the policy matches the best case value
+        # of the other agent's policy (the duals of the last solution).
+        if state_enc in self.maxmin_solutions and not retry:
+            pi, other_pi = self.maxmin_solutions[state_enc]
+            value = np.min(np.dot(Q, pi))
+
+            if np.max(np.dot(other_pi, Q)) - value <= \
+                    self.MAXMIN_TOLERANCE * max(1.0, abs(value)):
+                self.pi[state_enc] = pi
+                self.dirty_states.discard(state_enc)
+                return value
+
+        if self.maxmin_lp is None:
+            self.maxmin_lp = self.build_maxmin_lp()
+
+        lp = self.maxmin_lp
+        lp['A_ub'][:, 1:] = -Q
+
+        res = linprog(**lp)
 
         if res.success:
             self.pi[state_enc] = res.x[1:]
+            self.dirty_states.discard(state_enc)
+
+            # The duals are only available from the HiGHS solvers
+            ineqlin = getattr(res, 'ineqlin', None)
+            if ineqlin is not None:
+                self.maxmin_solutions[state_enc] = \
+                    (res.x[1:], -ineqlin.marginals)
+
         elif not retry:
             return self.maxmin(state_enc, retry=True)
         else:
@@ -592,6 +670,21 @@ class MinimaxQPolicy(dialogue_policy.DialoguePolicy):
                'e': self.epsilon,
                'g': self.gamma}
 
+        if path.endswith(policy_file.POLICY_FILE_EXTENSION):
+            # States that have not been solved yet have a uniform policy,
+            # stored as a single probability
+            pi = [np.broadcast_to(p, (self.NActions,))
+                  for p in self.pi.values()]
+
+            policy_file.save_policy_file(
+                path, 'MinimaxQPolicy',
+                params={'a': self.alpha, 'e': self.epsilon, 'g': self.gamma},
+                tables={
+                    'Q': policy_file.dense_table(self.Q, self.Q.values()),
+                    'V': policy_file.dense_table(self.V, self.V.values()),
+                    'pi': policy_file.dense_table(self.pi, pi)})
+            return
+
         with open(path, 'wb') as file:
             pickle.dump(obj, file, pickle.HIGHEST_PROTOCOL)
 
@@ -609,23 +702,22 @@ class MinimaxQPolicy(dialogue_policy.DialoguePolicy):
 
         if isinstance(path, str):
             if os.path.isfile(path):
-                with open(path, 'rb') as file:
-                    obj = pickle.load(file)
-
-                    if 'Q' in obj:
-                        self.Q = obj['Q']
-                    if 'V' in obj:
-                        self.V = obj['V']
-                    if 'pi' in obj:
-                        self.pi = obj['pi']
-                    if 'a' in obj:
-                        self.alpha = obj['a']
-                    if 'e' in obj:
-                        self.epsilon = obj['e']
-                    if 'g' in obj:
-                        self.gamma = obj['g']
-
-                    print('Q dialogue_policy loaded from {0}.'.format(path))
+                obj = policy_file.load_model(path)
+
+                if 'Q' in obj:
+                    self.Q = obj['Q']
+                if 'V' in obj:
+                    self.V = obj['V']
+                if 'pi' in obj:
+                    self.pi = obj['pi']
+                if 'a' in obj:
+                    self.alpha = obj['a']
+                if 'e' in obj:
+                    self.epsilon = obj['e']
+                if 'g' in obj:
+                    self.gamma = obj['g']
+
+                print('Q dialogue_policy loaded from {0}.'.format(path))
 
             else:
                 print('Warning! Q dialogue_policy file %s not found' % path)
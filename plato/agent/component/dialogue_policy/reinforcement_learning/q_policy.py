@@ -11,14 +11,18 @@ limitations under the License.
 
 __author__ = "Alexandros Papangelis"
 
-from .. import dialogue_policy, slot_filling_policy
+from .. import dialogue_policy, slot_filling_policy, state_encoder
+from ..state_encoder import StateEncoder
+from .dense_q_table import DenseQTable
 from plato.dialogue.action import DialogueAct, DialogueActItem, Operator
 from plato.agent.component.user_simulator.agenda_based_user_simulator.\
     agenda_based_us import AgendaBasedUS
 from plato.domain.ontology import Ontology
 from plato.domain.database import DataBase
+from plato.utilities import policy_file
 from copy import deepcopy
 
+import numpy as np
 import pickle
 import random
 import pprint
@@ -77,6 +81,14 @@ class QPolicy(dialogue_policy.DialoguePolicy):
         self.epsilon_decay = \
             args['epsilon_decay'] if 'epsilon_decay' in args else 0.9995
 
+        # Q table storage: 'dict' (a dictionary of dictionaries) or 'dense'
+        # (a DenseQTable, trained with batched updates)
+        self.q_table = args['q_table'] if 'q_table' in args else 'dict'
+
+        if self.q_table not in ['dict', 'dense']:
+            raise ValueError('QPolicy dialogue policy: Unacceptable q_table '
+                             '%s ' % self.q_table)
+
         self.is_training = False
         self.IS_GREEDY_POLICY = True
 
@@ -110,6 +122,8 @@ class QPolicy(dialogue_policy.DialoguePolicy):
         self.system_requestable_slots = \
             deepcopy(self.ontology.ontology['system_requestable'])
 
+        self.state_encoder = self.build_state_encoder()
+
         self.dstc2_acts = None
 
         if not domain:
@@ -163,6 +177,14 @@ class QPolicy(dialogue_policy.DialoguePolicy):
                     else:
                         self.NActions += len(self.requestable_slots)
 
+        if self.q_table == 'dense':
+            if not hasattr(self, 'NActions'):
+                print('WARNING! QPolicy dialogue policy: Unknown number of '
+                      'actions, using dict Q table.')
+                self.q_table = 'dict'
+            else:
+                self.Q = DenseQTable(self.NActions)
+
     def initialize(self, args):
         """
         Initialize internal parameters
@@ -219,7 +241,18 @@ class QPolicy(dialogue_policy.DialoguePolicy):
                         range(0, self.NActions)),
                     self.agent_role == 'system')
 
-        if self.IS_GREEDY_POLICY:
+        if self.q_table == 'dense':
+            if self.IS_GREEDY_POLICY:
+                action_enc = self.Q.greedy_action(state_enc)
+            else:
+                action_enc = random.choices(
+                    range(0, self.NActions),
+                    self.Q.action_values(state_enc))[0]
+
+            sys_acts = self.decode_action(action_enc,
+                                          self.agent_role == 'system')
+
+        elif self.IS_GREEDY_POLICY:
             # Return action with maximum Q value from the given state
             sys_acts = self.decode_action(max(self.Q[state_enc],
                                               key=self.Q[state_enc].get),
@@ -233,94 +266,86 @@ class QPolicy(dialogue_policy.DialoguePolicy):
 
         return sys_acts
 
-    def encode_state(self, state):
+    def build_state_encoder(self):
         """
-        Encodes the dialogue state into an index used to address the Q matrix.
+        Build the encoder of dialogue states into indices used to address the
+        Q matrix.
 
-        :param state: the state to encode
-        :return: int - a unique state ID
+        :return: a StateEncoder
         """
 
-        temp = []
-
-        temp += [int(b) for b in format(state.turn, '06b')]
-
-        for value in state.slots_filled.values():
-            # This contains the requested slot
-            temp.append(1) if value else temp.append(0)
-
-        for slot in self.ontology.ontology['requestable']:
-            temp.append(1) if slot == state.requested_slot else temp.append(0)
+        requestable = self.ontology.ontology['requestable']
+        informable = list(self.ontology.ontology['informable'])
 
-        temp.append(int(state.is_terminal_state))
+        encoder = StateEncoder()
+        encoder.add_field(lambda state: state.turn, 6)
+        encoder.add_values(state_encoder.slots_filled_values,
+                           len(self.system_requestable_slots))
+        encoder.add_one_hot(state_encoder.requested_slot, requestable)
+        encoder.add_flag(state_encoder.is_terminal)
 
         # If the agent is a system, then this shows what the top db result is.
         # If the agent is a user, then this shows what information the
         # system has provided
-        if state.item_in_focus:
-            for slot in self.ontology.ontology['requestable']:
-                if slot in state.item_in_focus and state.item_in_focus[slot]:
-                    temp.append(1)
-                else:
-                    temp.append(0)
-        else:
-            temp += [0] * len(self.ontology.ontology['requestable'])
-
-        if state.db_matches_ratio >= 0:
-            temp += \
-                [int(b) for b in
-                 format(int(round(state.db_matches_ratio, 2) * 100), '07b')]
-        else:
-            # If the number is negative (should not happen in general) there
-            # will be a minus sign
-            temp += \
-                [int(b) for b in
-                 format(int(round(state.db_matches_ratio, 2) * 100),
-                        '07b')[1:]]
-
-        temp.append(1) if state.system_made_offer else temp.append(0)
-
-        if state.user_acts:
-            temp += \
-                [int(b) for b in
-                 format(self.encode_action(state.user_acts, False), '05b')]
-        else:
-            temp += [0, 0, 0, 0, 0]
-
-        if state.last_sys_acts:
-            temp += \
-                [int(b) for b in
-                 format(self.encode_action([state.last_sys_acts[0]]), '04b')]
-        else:
-            temp += [0, 0, 0, 0]
+        encoder.add_flags(
+            lambda state, slot:
+            state.item_in_focus and slot in state.item_in_focus and
+            state.item_in_focus[slot],
+            requestable)
+
+        encoder.add_field(self.encode_db_matches_ratio, None)
+        encoder.add_flag(state_encoder.made_offer)
+        encoder.add_field(
+            lambda state:
+            self.encode_action(state.user_acts, False)
+            if state.user_acts else 0,
+            5)
+        encoder.add_field(
+            lambda state:
+            self.encode_action([state.last_sys_acts[0]])
+            if state.last_sys_acts else 0,
+            4)
 
         # If the agent plays the role of the user it needs access to its own
         # goal
-        if state.user_goal:
-            for c in self.ontology.ontology['informable']:
-                if c in state.user_goal.constraints and \
-                        state.user_goal.constraints[c].value:
-                    temp.append(1)
-                else:
-                    temp.append(0)
+        goal_encoder = StateEncoder().add_goal_flags(
+            [(state_encoder.has_constraint_value, c) for c in informable] +
+            [(state_encoder.has_request_value, r) for r in requestable])
 
-            for r in self.ontology.ontology['requestable']:
-                if r in state.user_goal.requests and \
-                        state.user_goal.requests[r].value:
-                    temp.append(1)
-                else:
-                    temp.append(0)
-        else:
-            # Just for symmetry, for all other roles append zeros
-            temp += [0] * (len(self.ontology.ontology['informable']) +
-                           len(self.ontology.ontology['requestable']))
+        encoder.add_encoder(goal_encoder,
+                            state_encoder.has_user_goal,
+                            len(informable) + len(requestable))
+
+        return encoder
+
+    @staticmethod
+    def encode_db_matches_ratio(state):
+        """
+        Encode the ratio of database items that match the state's
+        constraints as a percentage.
+
+        :param state: the state
+        :return: the percentage and its width in bits
+        """
+
+        percentage = int(round(state.db_matches_ratio, 2) * 100)
+
+        if state.db_matches_ratio >= 0:
+            return percentage, max(7, percentage.bit_length())
+
+        # If the number is negative (should not happen in general) drop the
+        # minus sign, as the legacy string encoding did
+        return abs(percentage), max(6, abs(percentage).bit_length())
+
+    def encode_state(self, state):
+        """
+        Encodes the dialogue state into an index used to address the Q matrix.
 
-        # Encode state
-        state_enc = 0
-        for t in temp:
-            state_enc = (state_enc << 1) | t
+        :param state: the state to encode
+        :return: int - a unique state ID
+        """
 
-        return state_enc
+        return self.state_encoder.encode(state)
 
     def encode_action(self, actions, system=True):
         """
@@ -452,13 +477,46 @@ class QPolicy(dialogue_policy.DialoguePolicy):
         :return:
         """
 
+        if self.q_table == 'dense':
+            self.train_batch(dialogues)
+
+        else:
+            self.train_sequential(dialogues)
+
+        # Decay learning rate
+        if self.alpha > 0.001:
+            self.alpha *= self.alpha_decay
+
+        # Decay exploration rate
+        if self.epsilon > 0.05:
+            self.epsilon *= self.epsilon_decay
+
+        print('Q-Learning: [alpha: {0}, epsilon: {1}]'
+              .format(self.alpha, self.epsilon))
+
+    def train_sequential(self, dialogues):
+        """
+        Update the dictionary Q table one turn at a time.
+
+        :param dialogues: a list dialogues, which is a list of dialogue turns
+                          (state, action, reward triplets).
+        :return:
+        """
+
+        # The Q table may have been loaded from a (read-only) policy file
+        self.Q = policy_file.to_dict(self.Q)
+
         for dialogue in dialogues:
             if len(dialogue) > 1:
                 dialogue[-2]['reward'] = dialogue[-1]['reward']
 
-            for turn in dialogue:
-                state_enc = self.encode_state(turn['state'])
-                new_state_enc = self.encode_state(turn['new_state'])
+            state_encs = self.state_encoder.encode_batch(
+                [turn['state'] for turn in dialogue])
+            new_state_encs = self.state_encoder.encode_batch(
+                [turn['new_state'] for turn in dialogue])
+
+            for turn, state_enc, new_state_enc in \
+                    zip(dialogue, state_encs, new_state_encs):
                 action_enc = self.encode_action(turn['action'])
 
                 if action_enc < 0:
@@ -474,21 +532,70 @@ class QPolicy(dialogue_policy.DialoguePolicy):
                 if new_state_enc in self.Q:
                     max_q = max(self.Q[new_state_enc].values())
 
+                td_error = turn['reward'] + self.gamma * max_q - \
+                    self.Q[state_enc][action_enc]
+
+                # Transitions sampled from a replay buffer are weighted by
+                # their importance sampling weight and report their TD error
                 self.Q[state_enc][action_enc] += \
-                    self.alpha * (turn['reward'] +
-                                  self.gamma * max_q -
-                                  self.Q[state_enc][action_enc])
+                    self.alpha * turn.get('weight', 1.0) * td_error
 
-        # Decay learning rate
-        if self.alpha > 0.001:
-            self.alpha *= self.alpha_decay
+                if 'replay_index' in turn:
+                    turn['td_error'] = td_error
 
-        # Decay exploration rate
-        if self.epsilon > 0.05:
-            self.epsilon *= self.epsilon_decay
+    def train_batch(self, dialogues):
+        """
+        Update the dense Q table with all turns of the dialogues at once. The
+        TD targets are computed from the Q values before the update.
 
-        print('Q-Learning: [alpha: {0}, epsilon: {1}]'
-              .format(self.alpha, self.epsilon))
+        :param dialogues: a list dialogues, which is a list of dialogue turns
+                          (state, action, reward triplets).
+        :return:
+        """
+
+        turns = []
+        states = []
+        new_states = []
+        actions = []
+        rewards = []
+        weights = []
+
+        for dialogue in dialogues:
+            if len(dialogue) > 1:
+                dialogue[-2]['reward'] = dialogue[-1]['reward']
+
+            for turn in dialogue:
+                action_enc = self.encode_action(turn['action'])
+
+                if action_enc < 0:
+                    continue
+
+                turns.append(turn)
+                states.append(turn['state'])
+                new_states.append(turn['new_state'])
+                actions.append(action_enc)
+                rewards.append(turn['reward'])
+                weights.append(turn.get('weight', 1.0))
+
+        if not states:
+            return
+
+        max_q = self.Q.max_values(
+            self.Q.lookup(self.state_encoder.encode_batch(new_states)))
+        rows = self.Q.add(self.state_encoder.encode_batch(states))
+
+        # Transitions sampled from a replay buffer are weighted by their
+        # importance sampling weight and report their TD error
+        td_errors = self.Q.update(rows,
+                                  actions,
+                                  np.asarray(rewards, dtype=np.float64) +
+                                  self.gamma * max_q,
+                                  self.alpha,
+                                  weights)
+
+        for turn, td_error in zip(turns, td_errors):
+            if 'replay_index' in turn:
+                turn['td_error'] = float(td_error)
 
     def save(self, path=None):
         """
@@ -516,6 +623,21 @@ class QPolicy(dialogue_policy.DialoguePolicy):
                'e': self.epsilon,
                'g': self.gamma}
 
+        if path.endswith(policy_file.POLICY_FILE_EXTENSION):
+            if self.q_table == 'dense':
+                size = len(self.Q)
+                table = policy_file.dense_table(
+                    self.Q.row_keys(), self.Q.values[:size],
+                    dtype=np.float32, visited=self.Q.visited[:size])
+            else:
+                table = policy_file.ragged_table(self.Q)
+
+            policy_file.save_policy_file(
+                path, 'QPolicy',
+                params={'a': self.alpha, 'e': self.epsilon, 'g': self.gamma},
+                tables={'Q': table})
+            return
+
         with open(path, 'wb') as file:
             pickle.dump(obj, file, pickle.HIGHEST_PROTOCOL)
 
@@ -533,19 +655,34 @@ class QPolicy(dialogue_policy.DialoguePolicy):
 
         if isinstance(path, str):
             if os.path.isfile(path):
-                with open(path, 'rb') as file:
-                    obj = pickle.load(file)
-
-                    if 'Q' in obj:
-                        self.Q = obj['Q']
-                    if 'a' in obj:
-                        self.alpha = obj['a']
-                    if 'e' in obj:
-                        self.epsilon = obj['e']
-                    if 'g' in obj:
-                        self.gamma = obj['g']
-
-                    print('Q dialogue policy loaded from {0}.'.format(path))
+                obj = policy_file.load_model(path)
+
+                if 'Q' in obj:
+                    self.Q = obj['Q']
+
+                    if isinstance(self.Q, policy_file.DenseTable):
+                        self.Q = DenseQTable.from_arrays(
+                            self.Q.index, self.Q.values,
+                            self.Q.columns['visited'])
+
+                    # Convert between the Q table formats if needed
+                    if self.q_table == 'dense' and \
+                            not isinstance(self.Q, DenseQTable):
+                        self.Q = DenseQTable.from_dict(self.Q,
+                                                       self.NActions)
+
+                    elif self.q_table == 'dict' and \
+                            isinstance(self.Q, DenseQTable):
+                        self.Q = self.Q.to_dict()
+
+                if 'a' in obj:
+                    self.alpha = obj['a']
+                if 'e' in obj:
+                    self.epsilon = obj['e']
+                if 'g' in obj:
+                    self.gamma = obj['g']
+
+                print('Q dialogue policy loaded from {0}.'.format(path))
 
             else:
                 print('Warning! Q dialogue policy file %s not found' % path)
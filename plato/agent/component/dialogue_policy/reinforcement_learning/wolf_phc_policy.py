@@ -11,10 +11,12 @@ limitations under the License.
 
 __author__ = "Alexandros Papangelis"
 
-from .. import dialogue_policy, slot_filling_policy
+from .. import dialogue_policy, slot_filling_policy, state_encoder
+from ..state_encoder import StateEncoder
 from plato.dialogue.action import DialogueAct, DialogueActItem, Operator
 from plato.domain.ontology import Ontology
 from plato.domain.database import DataBase
+from plato.utilities import policy_file
 from plato.agent.component.user_simulator.agenda_based_user_simulator.\
     agenda_based_us import AgendaBasedUS
 
@@ -81,6 +83,12 @@ class WoLFPHCPolicy(dialogue_policy.DialoguePolicy):
         self.exploration_decay_rate = \
             args['epsilon_decay'] if 'epsilon_decay' in args else 0.9995
 
+        # Update the policy with one vectorized sweep over all transitions of
+        # a minibatch, instead of one transition at a time
+        self.batch_training = \
+            bool(args['batch_training']) if 'batch_training' in args \
+            else False
+
         self.IS_GREEDY_POLICY = False
 
         # TODO: Put these as arguments in the config
@@ -140,6 +148,8 @@ class WoLFPHCPolicy(dialogue_policy.DialoguePolicy):
         self.system_requestable_slots = \
             deepcopy(self.ontology.ontology['system_requestable'])
 
+        self.state_encoder = self.build_state_encoder()
+
         if self.dstc2_acts_sys:
             if self.agent_role == 'system':
                 # self.NActions = 5
@@ -303,68 +313,57 @@ class WoLFPHCPolicy(dialogue_policy.DialoguePolicy):
 
         return sys_acts
 
-    def encode_state(self, state):
+    def build_state_encoder(self):
         """
-        Encodes the dialogue state into an index used to address the Q matrix.
+        Build the encoder of dialogue states into indices used to address the
+        Q matrix.
 
-        :param state: the state to encode
-        :return: int - a unique state encoding
+        :return: a StateEncoder
         """
 
-        temp = [int(state.is_terminal_state)]
-
-        temp.append(1) if state.system_made_offer else temp.append(0)
+        encoder = StateEncoder()
+        encoder.add_flag(state_encoder.is_terminal)
+        encoder.add_flag(state_encoder.made_offer)
 
         if self.agent_role == 'user':
             # The user agent needs to know which constraints and requests
             # need to be communicated and which of them
             # actually have.
-            if state.user_goal:
-                for c in self.informable_slots:
-                    if c != 'name':
-                        if c in state.user_goal.constraints and \
-                                state.user_goal.constraints[c].value:
-                            temp.append(1)
-                        else:
-                            temp.append(0)
-
-                        if c in state.user_goal.actual_constraints and \
-                                state.user_goal.actual_constraints[c].value:
-                            temp.append(1)
-                        else:
-                            temp.append(0)
-
-                for r in self.requestable_slots:
-                    if r in state.user_goal.requests:
-                        temp.append(1)
-                    else:
-                        temp.append(0)
-
-                    if r in state.user_goal.actual_requests and \
-                            state.user_goal.actual_requests[r].value:
-                        temp.append(1)
-                    else:
-                        temp.append(0)
+            features = []
 
-            else:
-                temp += \
-                    [0] * 2*(len(self.informable_slots)-1 +
-                             len(self.requestable_slots))
+            for c in self.informable_slots:
+                if c != 'name':
+                    features.append((state_encoder.has_constraint_value, c))
+                    features.append(
+                        (state_encoder.has_actual_constraint_value, c))
+
+            for r in self.requestable_slots:
+                features.append((state_encoder.has_request, r))
+                features.append((state_encoder.has_actual_request_value, r))
+
+            encoder.add_encoder(
+                StateEncoder().add_goal_flags(features),
+                state_encoder.has_user_goal,
+                2 * (len(self.informable_slots) - 1 +
+                     len(self.requestable_slots)))
 
         if self.agent_role == 'system':
-            for value in state.slots_filled.values():
-                # This contains the requested slot
-                temp.append(1) if value else temp.append(0)
+            encoder.add_values(state_encoder.slots_filled_values,
+                               len(self.system_requestable_slots))
+            encoder.add_one_hot(state_encoder.requested_slot,
+                                self.requestable_slots)
 
-            for r in self.requestable_slots:
-                temp.append(1) if r == state.requested_slot else temp.append(0)
+        return encoder
 
-        # Encode state
-        state_enc = 0
-        for t in temp:
-            state_enc = (state_enc << 1) | t
+    def encode_state(self, state):
+        """
+        Encodes the dialogue state into an index used to address the Q matrix.
 
-        return state_enc
+        :param state: the state to encode
+        :return: int - a unique state encoding
+        """
+
+        return self.state_encoder.encode(state)
 
     def encode_action(self, actions, system=True):
         """
@@ -519,13 +518,68 @@ class WoLFPHCPolicy(dialogue_policy.DialoguePolicy):
         if not self.is_training:
             return
 
+        # The model may have been loaded from a (read-only) policy file or
+        # saved with lists as rows
+        self.Q = policy_file.to_arrays(self.Q)
+        self.pi = policy_file.to_arrays(self.pi)
+        self.mean_pi = policy_file.to_arrays(self.mean_pi)
+        self.state_counter = policy_file.to_dict(self.state_counter)
+
+        turns, transitions = self.get_transitions(dialogues)
+
+        if self.batch_training:
+            td_errors = self.train_batch(transitions)
+
+        else:
+            td_errors = [self.update(*transition)
+                         for transition in zip(*transitions)]
+
+        # Transitions sampled from a replay buffer report their TD error
+        for turn, td_error in zip(turns, td_errors):
+            if 'replay_index' in turn:
+                turn['td_error'] = float(td_error)
+
+        # Decay learning rate after each episode
+        if self.alpha > 0.001:
+            self.alpha *= self.alpha_decay_rate
+
+        # Decay exploration rate after each episode
+        if self.epsilon > 0.25:
+            self.epsilon *= self.exploration_decay_rate
+
+        print('[alpha: {0}, epsilon: {1}]'.format(self.alpha, self.epsilon))
+
+    def get_transitions(self, dialogues):
+        """
+        Extract the transitions to learn from from the dialogues.
+
+        :param dialogues: a list dialogues, which is a list of dialogue turns
+                         (state, action, reward triplets).
+        :return: the turns of the transitions, and lists of their state
+                 encodings, action encodings, rewards, new state encodings,
+                 and weights (the importance sampling weights of transitions
+                 sampled from a replay buffer, 1 otherwise)
+        """
+
+        turns = []
+        state_encs = []
+        action_encs = []
+        rewards = []
+        new_state_encs = []
+        weights = []
+
         for dialogue in dialogues:
             if len(dialogue) > 1:
                 dialogue[-2]['reward'] = dialogue[-1]['reward']
 
-            for turn in dialogue:
-                state_enc = self.encode_state(turn['state'])
-                new_state_enc = self.encode_state(turn['new_state'])
+            dialogue_state_encs = self.state_encoder.encode_batch(
+                [turn['state'] for turn in dialogue])
+            dialogue_new_state_encs = self.state_encoder.encode_batch(
+                [turn['new_state'] for turn in dialogue])
+
+            for turn, state_enc, new_state_enc in \
+                    zip(dialogue, dialogue_state_encs,
+                        dialogue_new_state_encs):
 
                 role = self.agent_role
                 if 'role' in turn:
@@ -540,83 +594,180 @@ class WoLFPHCPolicy(dialogue_policy.DialoguePolicy):
                 if action_enc < 0 or turn['action'][0].intent == 'bye':
                     continue
 
-                if state_enc not in self.Q:
-                    self.Q[state_enc] = [0] * self.NActions
+                turns.append(turn)
+                state_encs.append(state_enc)
+                action_encs.append(action_enc)
+                rewards.append(turn['reward'])
+                new_state_encs.append(new_state_enc)
+                weights.append(turn.get('weight', 1.0))
+
+        return turns, \
+            (state_encs, action_encs, rewards, new_state_encs, weights)
 
-                if new_state_enc not in self.Q:
-                    self.Q[new_state_enc] = [0] * self.NActions
+    def add_state(self, state_enc):
+        """
+        Add the rows of a state to Q, pi, and the mean pi, if they do not
+        exist.
 
-                if state_enc not in self.pi:
-                    self.pi[state_enc] = \
-                        [float(1/self.NActions)] * self.NActions
+        :param state_enc: the state encoding
+        :return: nothing
+        """
 
-                if state_enc not in self.mean_pi:
-                    self.mean_pi[state_enc] = \
-                        [float(1/self.NActions)] * self.NActions
+        if state_enc not in self.Q:
+            self.Q[state_enc] = np.zeros(self.NActions)
 
-                if state_enc not in self.state_counter:
-                    self.state_counter[state_enc] = 1
-                else:
-                    self.state_counter[state_enc] += 1
-
-                # Update Q
-                self.Q[state_enc][action_enc] = \
-                    ((1 - self.alpha) * self.Q[state_enc][action_enc]) + \
-                    self.alpha * (
-                            turn['reward'] +
-                            (self.gamma * np.max(self.Q[new_state_enc])))
-
-                # Update mean dialogue_policy estimate
-                for a in range(self.NActions):
-                    self.mean_pi[state_enc][a] = \
-                        self.mean_pi[state_enc][a] + \
-                        ((1.0 / self.state_counter[state_enc]) *
-                         (self.pi[state_enc][a] - self.mean_pi[state_enc][a]))
-
-                # Determine delta
-                sum_policy = 0.0
-                sum_mean_policy = 0.0
-
-                for a in range(self.NActions):
-                    sum_policy = sum_policy + (self.pi[state_enc][a] *
-                                               self.Q[state_enc][a])
-                    sum_mean_policy = \
-                        sum_mean_policy + \
-                        (self.mean_pi[state_enc][a] * self.Q[state_enc][a])
-
-                if sum_policy > sum_mean_policy:
-                    delta = self.d_win
-                else:
-                    delta = self.d_lose
+        if state_enc not in self.pi:
+            self.pi[state_enc] = np.full(self.NActions, 1 / self.NActions)
 
-                # Update dialogue_policy estimate
-                max_q_idx = np.argmax(self.Q[state_enc])
+        if state_enc not in self.mean_pi:
+            self.mean_pi[state_enc] = \
+                np.full(self.NActions, 1 / self.NActions)
 
-                d_plus = delta
-                d_minus = ((-1.0) * d_plus) / (self.NActions - 1.0)
+    def hill_climbing_step(self, Q, pi, mean_pi, steps=1):
+        """
+        Move policies towards the greedy actions of their Q values, with the
+        WoLF (Win or Learn Fast) step size: small if the policy does better
+        than the mean policy, large otherwise.
+
+        :param Q: Q values (one row per state)
+        :param pi: the policies (one row per state)
+        :param mean_pi: the mean policies (one row per state)
+        :param steps: the number of steps to take (one per state)
+        :return: the new policies
+        """
 
-                for a in range(self.NActions):
-                    if a == max_q_idx:
-                        self.pi[state_enc][a] = \
-                            min(1.0, self.pi[state_enc][a] + d_plus)
-                    else:
-                        self.pi[state_enc][a] = \
-                            max(0.0, self.pi[state_enc][a] + d_minus)
+        Q = np.atleast_2d(Q)
+        pi = np.atleast_2d(pi)
 
-                # Constrain pi to a legal probability distribution
-                sum_pi = sum(self.pi[state_enc])
-                for a in range(self.NActions):
-                    self.pi[state_enc][a] /= sum_pi
+        winning = np.sum(pi * Q, axis=1) > np.sum(np.atleast_2d(mean_pi) * Q,
+                                                  axis=1)
+        d_plus = np.where(winning, self.d_win, self.d_lose) * steps
 
-        # Decay learning rate after each episode
-        if self.alpha > 0.001:
-            self.alpha *= self.alpha_decay_rate
+        update = np.repeat((-d_plus / (self.NActions - 1.0))[:, None],
+                           self.NActions, axis=1)
+        greedy = np.argmax(Q, axis=1)
+        update[np.arange(len(Q)), greedy] = d_plus
 
-        # Decay exploration rate after each episode
-        if self.epsilon > 0.25:
-            self.epsilon *= self.exploration_decay_rate
+        pi = pi + update
+        pi[np.arange(len(Q)), greedy] = \
+            np.minimum(1.0, pi[np.arange(len(Q)), greedy])
+        pi = np.maximum(0.0, pi)
 
-        print('[alpha: {0}, epsilon: {1}]'.format(self.alpha, self.epsilon))
+        # Constrain pi to a legal probability distribution
+        return pi / np.sum(pi, axis=1, keepdims=True)
+
+    def update(self, state_enc, action_enc, reward, new_state_enc,
+               weight=1.0):
+        """
+        Update Q, the mean policy, and the policy with one transition.
+
+        :param state_enc: the encoding of the transition's state
+        :param action_enc: the encoding of the action taken
+        :param reward: the reward received
+        :param new_state_enc: the encoding of the resulting state
+        :param weight: the transition's weight (e.g. its importance sampling
+                       weight), which scales the learning rate
+        :return: the TD error of the transition
+        """
+
+        self.add_state(state_enc)
+
+        if new_state_enc not in self.Q:
+            self.Q[new_state_enc] = np.zeros(self.NActions)
+
+        self.state_counter[state_enc] = \
+            self.state_counter.get(state_enc, 0) + 1
+
+        Q = self.Q[state_enc]
+        pi = self.pi[state_enc]
+        mean_pi = self.mean_pi[state_enc]
+
+        # Update Q
+        alpha = self.alpha * weight
+        target = reward + self.gamma * np.max(self.Q[new_state_enc])
+        td_error = target - Q[action_enc]
+
+        Q[action_enc] = ((1 - alpha) * Q[action_enc]) + alpha * target
+
+        # Update mean dialogue_policy estimate
+        mean_pi += (pi - mean_pi) / self.state_counter[state_enc]
+
+        # Update dialogue_policy estimate
+        self.pi[state_enc] = self.hill_climbing_step(Q, pi, mean_pi)[0]
+
+        return td_error
+
+    def train_batch(self, transitions):
+        """
+        Update Q, the mean policies, and the policies with all transitions at
+        once. The targets of Q are computed from the Q values before the
+        sweep (transitions with the same state and action share the
+        weighted mean of their targets, with the mean of their weights
+        scaling the learning rate) and each state's policy takes one
+        hill-climbing step per transition from it.
+
+        :param transitions: lists of state encodings, action encodings,
+                            rewards, new state encodings, and weights
+        :return: an array with the TD error of each transition
+        """
+
+        state_encs, action_encs, rewards, new_state_encs, weights = \
+            transitions
+
+        if not state_encs:
+            return np.zeros(0)
+
+        for state_enc in state_encs:
+            self.add_state(state_enc)
+
+        for new_state_enc in new_state_encs:
+            if new_state_enc not in self.Q:
+                self.Q[new_state_enc] = np.zeros(self.NActions)
+
+        # Rows of the states that are updated
+        states, rows, counts = np.unique(
+            np.array(state_encs, dtype=object),
+            return_inverse=True, return_counts=True)
+        states = states.tolist()
+
+        Q = np.array([self.Q[s] for s in states])
+        pi = np.array([self.pi[s] for s in states])
+        mean_pi = np.array([self.mean_pi[s] for s in states])
+
+        # Update Q
+        max_new_Q = np.array([np.max(self.Q[s]) for s in new_state_encs])
+        targets = np.asarray(rewards, dtype=np.float64) + \
+            self.gamma * max_new_Q
+
+        cells, cell_index, cell_counts = np.unique(
+            rows * self.NActions + np.asarray(action_encs),
+            return_inverse=True, return_counts=True)
+        weights = np.asarray(weights, dtype=np.float64)
+        cell_weights = np.bincount(cell_index, weights=weights)
+        mean_targets = \
+            np.bincount(cell_index, weights=targets * weights) / cell_weights
+        alpha = self.alpha * (cell_weights / cell_counts)
+
+        Q_flat = Q.reshape(-1)
+        td_errors = targets - Q_flat[cells][cell_index]
+        Q_flat[cells] = (1 - alpha) * Q_flat[cells] + alpha * mean_targets
+
+        # Update mean dialogue_policy estimates, as if each transition had
+        # updated them with the current policy
+        state_counters = np.array([self.state_counter.get(s, 0)
+                                   for s in states]) + counts
+        mean_pi += (pi - mean_pi) * (counts / state_counters)[:, None]
+
+        # Update dialogue_policy estimates
+        pi = self.hill_climbing_step(Q, pi, mean_pi, counts)
+
+        for i, state_enc in enumerate(states):
+            self.Q[state_enc] = Q[i]
+            self.pi[state_enc] = pi[i]
+            self.mean_pi[state_enc] = mean_pi[i]
+            self.state_counter[state_enc] = int(state_counters[i])
+
+        return td_errors
 
     def save(self, path=None):
         """
@@ -647,8 +798,22 @@ class WoLFPHCPolicy(dialogue_policy.DialoguePolicy):
                'e': self.epsilon,
                'g': self.gamma}
 
-        with open(path, 'wb') as file:
-            pickle.dump(obj, file, pickle.HIGHEST_PROTOCOL)
+        if path.endswith(policy_file.POLICY_FILE_EXTENSION):
+            policy_file.save_policy_file(
+                path, 'WoLFPHCPolicy',
+                params={'a': self.alpha, 'e': self.epsilon, 'g': self.gamma},
+                tables={
+                    'Q': policy_file.dense_table(self.Q, self.Q.values()),
+                    'pi': policy_file.dense_table(self.pi, self.pi.values()),
+                    'mean_pi': policy_file.dense_table(
+                        self.mean_pi, self.mean_pi.values()),
+                    'state_counter': policy_file.dense_table(
+                        self.state_counter, self.state_counter.values(),
+                        dtype=np.int64)})
+
+        else:
+            with open(path, 'wb') as file:
+                pickle.dump(obj, file, pickle.HIGHEST_PROTOCOL)
 
         if self.statistics['total_turns'] > 0:
             print('DEBUG > {0} WoLF PHC dialogue_policy supervision ratio: {1}'
@@ -674,26 +839,25 @@ class WoLFPHCPolicy(dialogue_policy.DialoguePolicy):
 
         if isinstance(path, str):
             if os.path.isfile(path):
-                with open(path, 'rb') as file:
-                    obj = pickle.load(file)
-
-                    if 'Q' in obj:
-                        self.Q = obj['Q']
-                    if 'pi' in obj:
-                        self.pi = obj['pi']
-                    if 'mean_pi' in obj:
-                        self.mean_pi = obj['mean_pi']
-                    if 'state_counter' in obj:
-                        self.state_counter = obj['state_counter']
-                    if 'a' in obj:
-                        self.alpha = obj['a']
-                    if 'e' in obj:
-                        self.epsilon = obj['e']
-                    if 'g' in obj:
-                        self.gamma = obj['g']
-
-                    print('WoLF-PHC dialogue_policy loaded from {0}.'
-                          .format(path))
+                obj = policy_file.load_model(path)
+
+                if 'Q' in obj:
+                    self.Q = obj['Q']
+                if 'pi' in obj:
+                    self.pi = obj['pi']
+                if 'mean_pi' in obj:
+                    self.mean_pi = obj['mean_pi']
+                if 'state_counter' in obj:
+                    self.state_counter = obj['state_counter']
+                if 'a' in obj:
+                    self.alpha = obj['a']
+                if 'e' in obj:
+                    self.epsilon = obj['e']
+                if 'g' in obj:
+                    self.gamma = obj['g']
+
+                print('WoLF-PHC dialogue_policy loaded from {0}.'
+                      .format(path))
 
             else:
                 print('Warning! WoLF-PHC dialogue_policy file %s not found'
@@ -0,0 +1,381 @@
+"""
+Copyright (c) 2019 Uber Technologies, Inc.
+
+Licensed under the Uber Non-Commercial License (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at the root directory of this project.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = "Alexandros Papangelis"
+
+import numpy as np
+
+"""
+The StateEncoder encodes dialogue states into bit vectors, or into integers
+whose binary representation (most significant bit first) is that bit vector.
+Policies describe their state features once, as a sequence of fields, and the
+encoder precomputes the bit mask of each per-slot feature, so encoding a state
+does not build any intermediate lists or strings.
+"""
+
+
+class StateEncoder:
+    """
+    Encodes dialogue states according to a layout of fields. Each field has a
+    width and a function that computes the field's value from a state.
+    """
+
+    # Maximum number of bit vectors to keep for encode_bits()
+    MAX_CACHED_BITS = 65536
+
+    def __init__(self):
+        """
+        Initialize an empty layout.
+        """
+
+        # (function, width) for each field; if width is None, the function
+        # returns a (value, width) tuple
+        self.fields = []
+
+        # The number of bits of the layout
+        self.size = 0
+
+        # Bit vectors of recent encodings, keyed by (encoding, width)
+        self.bits_cache = {}
+
+    def add_field(self, function, width):
+        """
+        Add a field to the layout. Values that need more than width bits
+        widen the field, like format(value, '0<width>b') does.
+
+        :param function: computes the field's (non-negative) value from a
+                         state
+        :param width: the number of bits of the field, or None if the
+                      function returns a (value, width) tuple
+        :return: the encoder
+        """
+
+        self.fields.append((function, width))
+        self.size += width or 0
+
+        return self
+
+    def add_flag(self, function):
+        """
+        Add a single bit to the layout.
+
+        :param function: returns whether the bit is set for a state
+        :return: the encoder
+        """
+
+        return self.add_field(lambda state: 1 if function(state) else 0, 1)
+
+    def add_flags(self, function, names):
+        """
+        Add one bit per name (e.g. per slot) to the layout.
+
+        :param function: returns whether the bit of a name is set, given the
+                         state and the name
+        :param names: the names, in order
+        :return: the encoder
+        """
+
+        masks = [(name, 1 << (len(names) - 1 - i))
+                 for i, name in enumerate(names)]
+
+        def value(state):
+            bits = 0
+
+            for name, mask in masks:
+                if function(state, name):
+                    bits |= mask
+
+            return bits
+
+        return self.add_field(value, len(names))
+
+    def add_one_hot(self, function, names):
+        """
+        Add one bit per name to the layout, where the bit of the name that
+        the state has (if any) is set.
+
+        :param function: returns the state's name (e.g. its requested slot)
+        :param names: the names, in order
+        :return: the encoder
+        """
+
+        masks = {}
+        for i, name in enumerate(names):
+            masks[name] = masks.get(name, 0) | 1 << (len(names) - 1 - i)
+
+        return self.add_field(lambda state: masks.get(function(state), 0),
+                              len(names))
+
+    def add_values(self, function, width=None):
+        """
+        Add one bit per value that a state has (e.g. per filled slot) to the
+        layout. The bit is set if the value is truthy.
+
+        :param function: returns the state's values
+        :param width: the expected number of values
+        :return: the encoder
+        """
+
+        def value(state):
+            bits = 0
+            count = 0
+
+            for v in function(state):
+                bits = (bits << 1) | (1 if v else 0)
+                count += 1
+
+            return bits, count
+
+        self.add_field(value, None)
+        self.size += width or 0
+
+        return self
+
+    def add_goal_flags(self, features):
+        """
+        Add one bit per user goal feature to the layout. States must have a
+        user goal (see add_encoder() for states that may not have one).
+
+        :param features: (test, slot) tuples, where test is one of the goal
+                         tests of this module (e.g. has_constraint)
+        :return: the encoder
+        """
+
+        masks = [(test, slot, 1 << (len(features) - 1 - i))
+                 for i, (test, slot) in enumerate(features)]
+
+        def value(state):
+            goal = state.user_goal
+            bits = 0
+
+            for test, slot, mask in masks:
+                if test(goal, slot):
+                    bits |= mask
+
+            return bits
+
+        return self.add_field(value, len(features))
+
+    def add_encoder(self, encoder, condition=None, default_width=0):
+        """
+        Add the fields of another encoder to the layout.
+
+        :param encoder: the other encoder
+        :param condition: if provided and false for a state, default_width
+                          zeros are encoded instead
+        :param default_width: the number of zeros to encode
+        :return: the encoder
+        """
+
+        def value(state):
+            if condition is None or condition(state):
+                return encoder.encode_with_width(state)
+
+            return 0, default_width
+
+        self.add_field(value, None)
+        self.size += encoder.size
+
+        return self
+
+    def add_zeros(self, width):
+        """
+        Add bits that are never set to the layout.
+
+        :param width: the number of bits
+        :return: the encoder
+        """
+
+        return self.add_field(lambda state: 0, width)
+
+    def encode_with_width(self, state):
+        """
+        Encode a state into an integer.
+
+        :param state: the state to encode
+        :return: the encoding and its width in bits
+        """
+
+        encoding = 0
+        total_width = 0
+
+        for function, width in self.fields:
+            if width is None:
+                value, width = function(state)
+
+            else:
+                value = function(state)
+
+                if value < 0:
+                    raise ValueError(f'StateEncoder: Cannot encode negative '
+                                     f'value {value}')
+
+                if value >> width:
+                    width = value.bit_length()
+
+            encoding = (encoding << width) | value
+            total_width += width
+
+        return encoding, total_width
+
+    def encode(self, state):
+        """
+        Encode a state into an integer.
+
+        :param state: the state to encode
+        :return: int - a unique state encoding
+        """
+
+        return self.encode_with_width(state)[0]
+
+    def encode_bits(self, state):
+        """
+        Encode a state into a bit vector.
+
+        :param state: the state to encode
+        :return: a read-only uint8 array of zeros and ones
+        """
+
+        key = self.encode_with_width(state)
+        bits = self.bits_cache.get(key)
+
+        if bits is None:
+            if len(self.bits_cache) >= self.MAX_CACHED_BITS:
+                self.bits_cache.clear()
+
+            bits = self.unpack([key[0]], key[1])[0]
+            bits.setflags(write=False)
+            self.bits_cache[key] = bits
+
+        return bits
+
+    def encode_batch(self, states):
+        """
+        Encode a number of states into integers.
+
+        :param states: the states to encode
+        :return: a list of state encodings
+        """
+
+        return [self.encode_with_width(state)[0] for state in states]
+
+    def encode_batch_bits(self, states):
+        """
+        Encode a number of states into a matrix of bit vectors. All states
+        must have encodings of the same width.
+
+        :param states: the states to encode
+        :return: a uint8 matrix with one row per state
+        """
+
+        encodings = [self.encode_with_width(state) for state in states]
+
+        if not encodings:
+            return np.zeros((0, self.size), dtype=np.uint8)
+
+        width = encodings[0][1]
+
+        if any(w != width for _, w in encodings):
+            raise ValueError('StateEncoder: States have encodings of '
+                             'different widths')
+
+        return self.unpack([encoding for encoding, _ in encodings], width)
+
+    @staticmethod
+    def unpack(encodings, width):
+        """
+        Convert state encodings into bit vectors.
+
+        :param encodings: a list of integer state encodings
+        :param width: the number of bits of each encoding
+        :return: a uint8 matrix with one row per encoding
+        """
+
+        num_bytes = (width + 7) // 8
+
+        data = np.frombuffer(
+            b''.join(e.to_bytes(num_bytes, 'big') for e in encodings),
+            dtype=np.uint8).reshape(len(encodings), num_bytes)
+
+        return np.unpackbits(data, axis=1)[:, num_bytes * 8 - width:]
+
+    @staticmethod
+    def pack(bits):
+        """
+        Convert bit vectors into state encodings.
+
+        :param bits: a matrix of zeros and ones with one row per state
+        :return: a list of integer state encodings
+        """
+
+        bits = np.asarray(bits, dtype=np.uint8)
+        width = bits.shape[1]
+        padding = -width % 8
+
+        data = np.packbits(
+            np.pad(bits, ((0, 0), (padding, 0))), axis=1)
+
+        return [int.from_bytes(row.tobytes(), 'big') for row in data]
+
+
+"""
+State features that are shared by several policies.
+"""
+
+
+def is_terminal(state):
+    return state.is_terminal_state
+
+
+def made_offer(state):
+    return state.system_made_offer
+
+
+def slots_filled_values(state):
+    return state.slots_filled.values()
+
+
+def requested_slot(state):
+    return state.requested_slot
+
+
+def has_user_goal(state):
+    return state.user_goal
+
+
+"""
+User goal tests, for StateEncoder.add_goal_flags().
+"""
+
+
+def has_constraint(goal, slot):
+    return slot in goal.constraints
+
+
+def has_constraint_value(goal, slot):
+    return slot in goal.constraints and goal.constraints[slot].value
+
+
+def has_actual_constraint_value(goal, slot):
+    return slot in goal.actual_constraints and \
+        goal.actual_constraints[slot].value
+
+
+def has_request(goal, slot):
+    return slot in goal.requests
+
+
+def has_request_value(goal, slot):
+    return slot in goal.requests and goal.requests[slot].value
+
+
+def has_actual_request_value(goal, slot):
+    return slot in goal.actual_requests and goal.actual_requests[slot].value
@@ -14,9 +14,11 @@ __author__ = "Alexandros Papangelis"
 from plato.agent.component.dialogue_state_tracker.dialogue_state_tracker \
     import DialogueStateTracker
 from ludwig.api import LudwigModel
+from plato.utilities.batch_predictor import load_predictor
 
 from os import path
 
+import numpy as np
 import pandas as pd
 
 """
@@ -38,7 +40,17 @@ class LudwigDST(DialogueStateTracker):
         if 'model_path' in args:
             model_path = args['model_path']
 
+        # Requests of concurrent dialogues are batched if batch_size > 1
+        self.batch_size = 1
+        if 'batch_size' in args:
+            self.batch_size = int(args['batch_size'])
+
+        self.batch_wait_ms = 5
+        if 'batch_wait_ms' in args:
+            self.batch_wait_ms = float(args['batch_wait_ms'])
+
         self.model = None
+        self.predictor = None
 
         self.load(model_path)
 
@@ -49,7 +61,7 @@ class LudwigDST(DialogueStateTracker):
         :return: nothing
         """
 
-        if self.model:
+        if self.model and not self.predictor.shared:
             self.model.close()
 
     def initialize(self, args):
@@ -64,7 +76,9 @@ class LudwigDST(DialogueStateTracker):
         """
         Retrieve updated state by querying the Ludwig model.
 
-        :param inpt: the current input (usually the nlu output)
+        :param inpt: the current input (usually the nlu output): a dictionary
+                     of column -> list of values (one per row), a dictionary
+                     of column -> value, or a list of such dictionaries
         :return:
         """
 
@@ -74,7 +88,20 @@ class LudwigDST(DialogueStateTracker):
 
         # Warning: Make sure the same tokenizer that was used to train the
         # model is used during prediction
-        return self.model.predict(pd.DataFrame(data=inpt))
+        if isinstance(inpt, dict):
+            # Column-oriented input, e.g. {'col': [value]}, as accepted by
+            # pd.DataFrame
+            if any(isinstance(value, (list, tuple, np.ndarray, pd.Series))
+                   for value in inpt.values()):
+                inpt = pd.DataFrame(data=inpt).to_dict('records')
+
+            else:
+                return self.predictor.predict(inpt)
+
+        if len(inpt) == 1:
+            return self.predictor.predict(inpt[0])
+
+        return self.predictor.predict_batch(inpt)
 
     def update_state_db(self, db_result):
         """
@@ -118,7 +145,10 @@ class LudwigDST(DialogueStateTracker):
         if isinstance(model_path, str):
             if path.isdir(model_path):
                 print('Loading Ludwig DST model...')
-                self.model = LudwigModel.load(model_path)
+                self.predictor = \
+                    load_predictor(model_path, LudwigModel.load,
+                                   self.batch_size, self.batch_wait_ms)
+                self.model = self.predictor.model
                 print('done!')
 
             else:
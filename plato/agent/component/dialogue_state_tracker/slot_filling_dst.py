@@ -15,7 +15,8 @@ from plato.dialogue.state import SlotFillingDialogueState
 from plato.agent.component.dialogue_state_tracker.\
     dialogue_state_tracker import DialogueStateTracker
 from plato.domain.ontology import Ontology
-from plato.domain.database import DataBase, SQLDataBase, JSONDataBase
+from plato.domain.database import DataBase, SQLDataBase, JSONDataBase, \
+    ColumnarDataBase
 from copy import deepcopy
 
 """
@@ -64,7 +65,7 @@ class SlotFillingDST(DialogueStateTracker):
         elif isinstance(database, str):
             if database[-3:] == '.db':
                 self.database = SQLDataBase(database)
-            elif database[-5:] == '.json':
+            elif database[-5:] == '.json' or database[-6:] == '.jsonl':
                 self.database = JSONDataBase(database)
             else:
                 raise ValueError('Unacceptable database type %s ' % database)
@@ -97,11 +98,9 @@ class SlotFillingDST(DialogueStateTracker):
         :return:
         """
 
-        if isinstance(self.database, SQLDataBase):
-            cursor = self.database.SQL_connection.cursor()
-            cursor.execute("SELECT * FROM " + self.db_table_name)
-            tmp = cursor.fetchall()
-            self.DB_ITEMS = len(tmp)
+        if isinstance(self.database,
+                      (SQLDataBase, ColumnarDataBase, JSONDataBase)):
+            self.DB_ITEMS = self.database.get_item_count()
 
             if self.DB_ITEMS <= 0:
                 print('Warning! DST could not get number of DB items.')
@@ -114,7 +113,8 @@ class SlotFillingDST(DialogueStateTracker):
             self.DState.turn = 0
 
         else:
-            raise NotImplementedError('JSONDataBase not supported yet.')
+            raise NotImplementedError(f'{type(self.database).__name__} not '
+                                      f'supported yet.')
 
     def update_state(self, dacts):
         """
@@ -144,8 +144,8 @@ class SlotFillingDST(DialogueStateTracker):
 
                 for dact_item in dact.params:
                     if dact_item.slot in self.DState.slots_filled:
-                        self.DState.slots_filled[dact_item.slot] = \
-                            dact_item.value
+                        self.DState.writable('slots_filled')[
+                            dact_item.slot] = dact_item.value
 
                     elif self.DState.user_goal:
                         if dact_item.slot in \
@@ -228,7 +228,8 @@ class SlotFillingDST(DialogueStateTracker):
             for sys_act in sys_acts:
                 if sys_act.intent in ['inform', 'offer']:
                     for item in sys_act.params:
-                        self.DState.item_in_focus[item.slot] = item.value
+                        self.DState.writable('item_in_focus')[
+                            item.slot] = item.value
 
                         if self.DState.user_goal:
                             if item.slot in \
@@ -13,6 +13,7 @@ __author__ = "Alexandros Papangelis"
 
 
 from ludwig.api import LudwigModel
+from plato.utilities.batch_predictor import load_predictor
 from plato.agent.component.conversational_module import ConversationalModule
 import os.path
 import pandas as pd
@@ -35,7 +36,17 @@ class MetalWOZSeq2Seq(ConversationalModule):
         if 'model_path' in args:
             model_path = args['model_path']
 
+        # Requests of concurrent dialogues are batched if batch_size > 1
+        self.batch_size = 1
+        if 'batch_size' in args:
+            self.batch_size = int(args['batch_size'])
+
+        self.batch_wait_ms = 5
+        if 'batch_wait_ms' in args:
+            self.batch_wait_ms = float(args['batch_wait_ms'])
+
         self.model = None
+        self.predictor = None
 
         self.load(model_path)
 
@@ -46,7 +57,7 @@ class MetalWOZSeq2Seq(ConversationalModule):
         :return:
         """
 
-        if self.model:
+        if self.model and not self.predictor.shared:
             self.model.close()
 
     def initialize(self, args):
@@ -75,7 +86,7 @@ class MetalWOZSeq2Seq(ConversationalModule):
             print('ERROR! Ludwig MetalWOZ model not initialized!')
             return pd.DataFrame({'empty': [0]})
 
-        result = self.model.predict(pd.DataFrame(data={'user': [utterance]}))
+        result = self.predictor.predict({'user': utterance})
 
         sys_text = ' '.join([x for x in result['system_predictions'][0]])
         sys_text = sys_text.replace(' <PAD>', '')
@@ -129,7 +140,10 @@ class MetalWOZSeq2Seq(ConversationalModule):
         if isinstance(model_path, str):
             if os.path.isdir(model_path):
                 print('Loading Ludwig MetalWOZ model...')
-                self.model = LudwigModel.load(model_path)
+                self.predictor = \
+                    load_predictor(model_path, LudwigModel.load,
+                                   self.batch_size, self.batch_wait_ms)
+                self.model = self.predictor.model
                 print('done!')
 
             else:
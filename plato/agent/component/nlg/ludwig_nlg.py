@@ -13,6 +13,7 @@ __author__ = "Alexandros Papangelis"
 
 
 from ludwig.api import LudwigModel
+from plato.utilities.batch_predictor import load_predictor
 from plato.agent.component.nlg.nlg import NLG
 import os.path
 import pandas as pd
@@ -35,7 +36,17 @@ class LudwigNLG(NLG):
         if 'model_path' in args:
             model_path = args['model_path']
 
+        # Requests of concurrent dialogues are batched if batch_size > 1
+        self.batch_size = 1
+        if 'batch_size' in args:
+            self.batch_size = int(args['batch_size'])
+
+        self.batch_wait_ms = 5
+        if 'batch_wait_ms' in args:
+            self.batch_wait_ms = float(args['batch_wait_ms'])
+
         self.model = None
+        self.predictor = None
 
         self.load(model_path)
 
@@ -46,7 +57,7 @@ class LudwigNLG(NLG):
         :return:
         """
 
-        if self.model:
+        if self.model and not self.predictor.shared:
             self.model.close()
 
     def initialize(self, args):
@@ -79,7 +90,7 @@ class LudwigNLG(NLG):
             print('ERROR! Ludwig nlg model not initialized!')
             return pd.DataFrame({'empty': [0]})
 
-        return self.model.predict(pd.DataFrame(data={'nlg_input': [dacts]}))
+        return self.predictor.predict({'nlg_input': dacts})
 
     def train(self, data):
         """
@@ -127,7 +138,10 @@ class LudwigNLG(NLG):
         if isinstance(model_path, str):
             if os.path.isdir(model_path):
                 print('Loading Ludwig nlg model...')
-                self.model = LudwigModel.load(model_path)
+                self.predictor = \
+                    load_predictor(model_path, LudwigModel.load,
+                                   self.batch_size, self.batch_wait_ms)
+                self.model = self.predictor.model
                 print('done!')
 
             else:
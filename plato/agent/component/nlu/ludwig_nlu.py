@@ -13,6 +13,7 @@ __author__ = "Alexandros Papangelis"
 
 
 from ludwig.api import LudwigModel
+from plato.utilities.batch_predictor import load_predictor
 from plato.agent.component.nlu.nlu import NLU
 import os.path
 import pandas as pd
@@ -35,7 +36,17 @@ class LudwigNLU(NLU):
         if 'model_path' in args:
             model_path = args['model_path']
 
+        # Requests of concurrent dialogues are batched if batch_size > 1
+        self.batch_size = 1
+        if 'batch_size' in args:
+            self.batch_size = int(args['batch_size'])
+
+        self.batch_wait_ms = 5
+        if 'batch_wait_ms' in args:
+            self.batch_wait_ms = float(args['batch_wait_ms'])
+
         self.model = None
+        self.predictor = None
 
         self.load(model_path)
 
@@ -46,7 +57,7 @@ class LudwigNLU(NLU):
         :return:
         """
 
-        if self.model:
+        if self.model and not self.predictor.shared:
             self.model.close()
 
     def initialize(self, args):
@@ -71,10 +82,8 @@ class LudwigNLU(NLU):
 
         # Warning: Make sure the same tokenizer that was used to train the
         # model is used during prediction
-        return self.model.predict(
-            pd.DataFrame(
-                data={'transcription': [utterance]}),
-            logging_level='logging.INFO')
+        return self.predictor.predict({'transcription': utterance},
+                                      logging_level='logging.INFO')
 
     def train(self, data):
         """
@@ -122,7 +131,10 @@ class LudwigNLU(NLU):
         if isinstance(model_path, str):
             if os.path.isdir(model_path):
                 print('Loading Ludwig nlu model...')
-                self.model = LudwigModel.load(model_path)
+                self.predictor = \
+                    load_predictor(model_path, LudwigModel.load,
+                                   self.batch_size, self.batch_wait_ms)
+                self.model = self.predictor.model
                 print('done!')
 
             else:
@@ -14,7 +14,10 @@ __author__ = "Alexandros Papangelis"
 from plato.agent.component.nlu.nlu import NLU
 from plato.dialogue.action import DialogueAct, DialogueActItem, Operator
 from plato.domain.ontology import Ontology
-from plato.domain.database import DataBase, SQLDataBase, JSONDataBase
+from plato.domain.database import DataBase, SQLDataBase, JSONDataBase, \
+    ColumnarDataBase
+from plato.domain.slot_value_catalog import SlotValueCatalog
+from plato.utilities.value_spotter import ValueSpotter
 
 import string
 import re
@@ -27,6 +30,10 @@ of running Conversational Agents, sanity checks, and to aid debugging.
 
 
 class SlotFillingNLU(NLU):
+    # Database slot values and their spotters, keyed by slot value catalog,
+    # shared by all instances
+    value_spotters = {}
+
     def __init__(self, args):
         """
         Load the ontology and database, create some patterns, and preprocess
@@ -61,9 +68,11 @@ class SlotFillingNLU(NLU):
                 self.database = database
 
             elif isinstance(database, str):
-                if database[-3:] == '.db':
+                if 'db_type' in args and args['db_type'] == 'columnar':
+                    self.database = ColumnarDataBase(database)
+                elif database[-3:] == '.db':
                     self.database = SQLDataBase(database)
-                elif database[-5:] == '.json':
+                elif database[-5:] == '.json' or database[-6:] == '.jsonl':
                     self.database = JSONDataBase(database)
                 else:
                     raise ValueError('Unacceptable database type %s '
@@ -72,51 +81,17 @@ class SlotFillingNLU(NLU):
                 raise ValueError('Unacceptable database type %s ' % database)
 
         # In order to work for simulated users, we need access to possible
-        # values of requestable slots
-        cursor = self.database.SQL_connection.cursor()
-
-        print('SlotFillingNLU: Preprocessing Database... '
-              '(do not use SlotFillingNLU with large databases!)')
-
-        # Get table name
-        db_result = cursor.execute("select * from sqlite_master "
-                                   "where type = 'table';").fetchall()
-        if db_result and db_result[0] and db_result[0][1]:
-            db_table_name = db_result[0][1]
-
-            self.slot_values = {}
-
-            # Get all entries in the database
-            all_items = cursor.execute("select * from " +
-                                       db_table_name + ";").fetchall()
-
-            i = 0
-
-            for item in all_items:
-                # Get column names
-                slot_names = [i[0] for i in cursor.description]
-
-                result = dict(zip(slot_names, item))
-
-                for slot in result:
-                    if slot in ['id', 'signature', 'description']:
-                        continue
-
-                    if slot not in self.slot_values:
-                        self.slot_values[slot] = []
-
-                    if result[slot] not in self.slot_values[slot]:
-                        self.slot_values[slot].append(result[slot])
-
-                i += 1
-                if i % 2000 == 0:
-                    print(f'{float(i/len(all_items))*100}% done')
-
-            print('SlotFillingNLU: Done!')
-        else:
-            raise ValueError(
-                'dialogue Manager cannot specify Table Name from database '
-                '{0}'.format(self.database.db_file_name))
+        # values of requestable slots. These are read from the database's
+        # slot value catalog, which is shared between NLU instances, the
+        # first time they are needed.
+        self.slot_value_catalog = None
+        if self.database:
+            self.slot_value_catalog = SlotValueCatalog.get(self.database)
+
+        # Lowercase values without punctuation and their spotter, for the
+        # brute-force search of process_input() (see get_value_spotter())
+        self.normalized_values = None
+        self.value_spotter = None
 
         # For this SlotFillingNLU create a list of requestable-only to reduce
         # computational load
@@ -163,6 +138,55 @@ class SlotFillingNLU(NLU):
 
         self.cant_help_pattern = ['can not help', 'cannot help', 'cant help']
 
+        # Synonyms are replaced in a single pass. No synonym overlaps another
+        # or appears in a replacement, so this is the same as replacing them
+        # one after the other.
+        self.synonyms = {'location': 'area',
+                         'part of town': 'area',
+                         'center': 'centre',
+                         'cheaply': 'cheap',
+                         'moderately': 'moderate',
+                         'expensively': 'expensive',
+                         'address': 'addr',
+                         'telephone': 'phone',
+                         'postal code': 'postcode',
+                         'post code': 'postcode',
+                         'zip code': 'postcode',
+                         'price range': 'pricerange'}
+
+        self.synonym_regex = \
+            re.compile('|'.join(re.escape(s) for s in self.synonyms))
+
+        # Intents that are recognised by keywords, in order of priority
+        # (e.g. 'welcome' comes before 'hello' because it may contain
+        # 'hello')
+        self.intent_patterns = [('bye', self.bye_pattern),
+                                ('welcomemsg', self.welcome_pattern),
+                                ('hello', self.hi_pattern),
+                                ('reqalts', self.reqalts_pattern),
+                                ('reqmore', self.reqmore_pattern),
+                                ('repeat', self.repeat_pattern),
+                                ('restart', self.restart_pattern),
+                                ('thankyou', self.thankyou_pattern),
+                                ('request', self.request_pattern),
+                                ('select', self.select_pattern),
+                                ('confirm', self.confirm_pattern),
+                                ('expl-conf', self.expl_conf_pattern),
+                                ('canthelp', self.cant_help_pattern)]
+
+        self.intent_regex = self.compile_patterns(
+            [patterns for _, patterns in self.intent_patterns])
+
+        self.dontcare_regex = re.compile(
+            r'\b(?:{0})\b'.format(
+                '|'.join(re.escape(p) for p in self.dontcare_pattern)))
+
+        # Informable slot values, spotted as whole words in a single pass
+        self.informable_spotter = ValueSpotter(
+            (str(value), (slot, index))
+            for slot, values in self.ontology.ontology['informable'].items()
+            for index, value in enumerate(values))
+
         punctuation = string.punctuation.replace('$', '')
         punctuation = punctuation.replace('_', '')
         punctuation = punctuation.replace('.', '')
@@ -171,6 +195,125 @@ class SlotFillingNLU(NLU):
         punctuation += '.'
         self.punctuation_remover = str.maketrans('', '', punctuation)
 
+    def get_value_spotter(self):
+        """
+        Get the slot values of the database (or, if the database is empty, the
+        informable values of the ontology), lowercased and without
+        punctuation, and their spotter. They are built once per database and
+        shared between NLU instances.
+
+        :return: a list of (slot, value, normalized value) tuples, and a
+                 ValueSpotter whose keys are indices in that list
+        """
+
+        if self.value_spotter is not None:
+            return self.normalized_values, self.value_spotter
+
+        catalog = self.slot_value_catalog
+        key = catalog.key if catalog else None
+
+        if key is not None and key in self.value_spotters:
+            self.slot_values, self.normalized_values, self.value_spotter = \
+                self.value_spotters[key]
+
+            return self.normalized_values, self.value_spotter
+
+        self.slot_values = {}
+
+        if catalog and catalog.get_item_count():
+            for slot in catalog.get_slot_names():
+                if slot in ['id', 'signature', 'description']:
+                    continue
+
+                self.slot_values[slot] = catalog.get_slot_values(slot)
+
+        slot_vals = self.ontology.ontology['informable']
+        if self.slot_values:
+            slot_vals = self.slot_values
+
+        self.normalized_values = \
+            [(slot, value, value.lower().translate(self.punctuation_remover))
+             for slot in slot_vals for value in slot_vals[slot] if value]
+
+        self.value_spotter = ValueSpotter(
+            (normalized_value, index)
+            for index, (_, _, normalized_value)
+            in enumerate(self.normalized_values))
+
+        # The ontology's values are only shared along with the database's
+        if self.slot_values:
+            # Spotters of older versions of the database are not used any
+            # more
+            for old_key in [k for k in self.value_spotters
+                            if k[0] == key[0]]:
+                del self.value_spotters[old_key]
+
+            self.value_spotters[key] = \
+                (self.slot_values, self.normalized_values, self.value_spotter)
+
+        return self.normalized_values, self.value_spotter
+
+    @staticmethod
+    def compile_patterns(pattern_lists):
+        """
+        Compile lists of patterns into a single regular expression, with one
+        group per list. The expression matches (without consuming anything)
+        wherever a pattern matches as a whole word, so re.finditer() finds
+        the patterns of every list in one scan, even where they overlap. At
+        each position, the group of the first list with a matching pattern
+        is set.
+
+        :param pattern_lists: a list of lists of (literal) patterns
+        :return: a compiled regular expression
+        """
+
+        # A list without patterns gets a group that never matches
+        groups = ['({0})'.format('|'.join(re.escape(str(p)) for p in patterns)
+                                 if patterns else '(?!)')
+                  for patterns in pattern_lists]
+
+        return re.compile(r'(?=\b(?:{0})\b)'.format('|'.join(groups)))
+
+    @staticmethod
+    def first_match(regex, utterance):
+        """
+        Find the first list of patterns (see compile_patterns()) that has a
+        pattern in the utterance.
+
+        :param regex: a regular expression returned by compile_patterns()
+        :param utterance: the utterance
+        :return: the index of the list, or None if no pattern matches
+        """
+
+        first = None
+
+        for match in regex.finditer(utterance):
+            if first is None or match.lastindex - 1 < first:
+                first = match.lastindex - 1
+
+                if not first:
+                    break
+
+        return first
+
+    def first_informable_values(self, utterance):
+        """
+        Find the informable slot values that are mentioned in the utterance
+        as whole words and, for each slot, keep the value that comes first
+        in the ontology.
+
+        :param utterance: the utterance
+        :return: a dictionary of slot -> index of the value in the ontology
+        """
+
+        first_values = {}
+
+        for slot, index in self.informable_spotter.find_keys(utterance):
+            if slot not in first_values or index < first_values[slot]:
+                first_values[slot] = index
+
+        return first_values
+
     def initialize(self, args):
         """
         Nothing to do here.
@@ -205,18 +348,8 @@ class SlotFillingNLU(NLU):
         utterance = utterance.translate(self.punctuation_remover)
 
         # Replace synonyms
-        utterance = utterance.replace('location', 'area')
-        utterance = utterance.replace('part of town', 'area')
-        utterance = utterance.replace('center', 'centre')
-        utterance = utterance.replace('cheaply', 'cheap')
-        utterance = utterance.replace('moderately', 'moderate')
-        utterance = utterance.replace('expensively', 'expensive')
-        utterance = utterance.replace('address', 'addr')
-        utterance = utterance.replace('telephone', 'phone')
-        utterance = utterance.replace('postal code', 'postcode')
-        utterance = utterance.replace('post code', 'postcode')
-        utterance = utterance.replace('zip code', 'postcode')
-        utterance = utterance.replace('price range', 'pricerange')
+        utterance = self.synonym_regex.sub(
+            lambda match: self.synonyms[match.group(0)], utterance)
 
         # First check if the user doesn't care
         if last_sys_act and last_sys_act.intent in ['request', 'expl-conf']:
@@ -251,98 +384,17 @@ class SlotFillingNLU(NLU):
                 dact.intent = 'affirm'
                 break
 
-        # Check for dialogue ending
-        for p in self.bye_pattern:
-            match = re.search(r'\b{0}\b'.format(p), utterance)
-            if match:
-                dact.intent = 'bye'
-                break
-
-        # Search for 'welcome' first because it may contain 'hello'
-        if dact.intent == 'UNK':
-            for p in self.welcome_pattern:
-                match = re.search(r'\b{0}\b'.format(p), utterance)
-                if match:
-                    dact.intent = 'welcomemsg'
-                    break
-
-        if dact.intent == 'UNK':
-            for p in self.hi_pattern:
-                match = re.search(r'\b{0}\b'.format(p), utterance)
-                if match:
-                    dact.intent = 'hello'
-                    break
-
-        if dact.intent == 'UNK':
-            for p in self.reqalts_pattern:
-                match = re.search(r'\b{0}\b'.format(p), utterance)
-                if match:
-                    dact.intent = 'reqalts'
-                    break
-
-        if dact.intent == 'UNK':
-            for p in self.reqmore_pattern:
-                match = re.search(r'\b{0}\b'.format(p), utterance)
-                if match:
-                    dact.intent = 'reqmore'
-                    break
-
-        if dact.intent == 'UNK':
-            for p in self.repeat_pattern:
-                match = re.search(r'\b{0}\b'.format(p), utterance)
-                if match:
-                    dact.intent = 'repeat'
-                    break
-
-        if dact.intent == 'UNK':
-            for p in self.restart_pattern:
-                match = re.search(r'\b{0}\b'.format(p), utterance)
-                if match:
-                    dact.intent = 'restart'
-                    break
-
-        if dact.intent == 'UNK':
-            for p in self.thankyou_pattern:
-                match = re.search(r'\b{0}\b'.format(p), utterance)
-                if match:
-                    dact.intent = 'thankyou'
-                    break
-
-        if dact.intent == 'UNK':
-            for p in self.request_pattern:
-                match = re.search(r'\b{0}\b'.format(p), utterance)
-                if match:
-                    dact.intent = 'request'
-                    break
+        # Check for dialogue ending (which overrides the above) and the other
+        # intents, in one scan
+        intent_index = self.first_match(self.intent_regex, utterance)
 
-        if dact.intent == 'UNK':
-            for p in self.select_pattern:
-                match = re.search(r'\b{0}\b'.format(p), utterance)
-                if match:
-                    dact.intent = 'select'
-                    break
+        if intent_index is not None and \
+                (dact.intent == 'UNK' or not intent_index):
+            dact.intent = self.intent_patterns[intent_index][0]
 
-        if dact.intent == 'UNK':
-            for p in self.confirm_pattern:
-                match = re.search(r'\b{0}\b'.format(p), utterance)
-                if match:
-                    dact.intent = 'confirm'
-                    break
-
-        if dact.intent == 'UNK':
-            for p in self.expl_conf_pattern:
-                match = re.search(r'\b{0}\b'.format(p), utterance)
-                if match:
-                    dact.intent = 'expl-conf'
-                    break
-
-        if dact.intent == 'UNK':
-            for p in self.cant_help_pattern:
-                match = re.search(r'\b{0}\b'.format(p), utterance)
-                if match:
-                    dact.intent = 'canthelp'
-                    dact.params = []
-                    return [dact]
+            if dact.intent == 'canthelp':
+                dact.params = []
+                return [dact]
 
         if dact.intent == 'UNK':
             dact.intent = 'inform'
@@ -371,6 +423,10 @@ class SlotFillingNLU(NLU):
                 # Else do nothing, and see if anything matches below
 
         if dact.intent in ['inform', 'request']:
+            # Informable values are only spotted if an informable slot is
+            # mentioned
+            first_values = None
+
             for word in words:
                 # Check for requests. Requests for informable slots are
                 # captured below
@@ -401,34 +457,36 @@ class SlotFillingNLU(NLU):
                             DialogueActItem(word, Operator.EQ, ''))
                         break
 
-                    found = False
+                    if first_values is None:
+                        first_values = \
+                            self.first_informable_values(utterance)
 
-                    for p in self.ontology.ontology['informable'][word]:
-                        match = re.search(r'\b{0}\b'.format(p), utterance)
-                        if match:
-                            if word == 'name':
-                                dact.intent = 'offer'
-                            else:
-                                dact.intent = 'inform'
+                    value_index = first_values.get(word)
 
-                            dact.params.append(
-                                DialogueActItem(word, Operator.EQ, p))
-                            found = True
-                            break
+                    if value_index is not None:
+                        if word == 'name':
+                            dact.intent = 'offer'
+                        else:
+                            dact.intent = 'inform'
+
+                        dact.params.append(
+                            DialogueActItem(
+                                word,
+                                Operator.EQ,
+                                self.ontology.ontology['informable'][word][
+                                    value_index]))
 
-                    if not found:
+                    else:
                         # Search for dontcare (e.g. I want any area)
-                        for p in self.dontcare_pattern:
-                            match = re.search(r'\b{0}\b'.format(p), utterance)
-                            if match:
-                                dact.intent = 'inform'
-                                dact.params.append(
-                                    DialogueActItem(
-                                        word,
-                                        Operator.EQ,
-                                        'dontcare'))
-
-                                return [dact]
+                        if self.dontcare_regex.search(utterance):
+                            dact.intent = 'inform'
+                            dact.params.append(
+                                DialogueActItem(
+                                    word,
+                                    Operator.EQ,
+                                    'dontcare'))
+
+                            return [dact]
 
                         dact.intent = 'request'
                         dact.params.append(
@@ -436,22 +494,19 @@ class SlotFillingNLU(NLU):
 
         # If nothing was recognised, do an even more brute-force search
         if dact.intent in ['UNK', 'inform'] and not dact.params:
-            slot_vals = self.ontology.ontology['informable']
-            if self.slot_values:
-                slot_vals = self.slot_values
-
-            for slot in slot_vals:
-                for value in slot_vals[slot]:
-                    if value and \
-                            value.lower().translate(self.punctuation_remover) \
-                            in utterance:
-                        if slot == 'name':
-                            dact.intent = 'offer'
+            normalized_values, value_spotter = self.get_value_spotter()
+            mentioned = value_spotter.find_keys(utterance, whole_words=False)
+
+            for index in sorted(mentioned):
+                slot, value, _ = normalized_values[index]
+
+                if slot == 'name':
+                    dact.intent = 'offer'
 
-                        di = DialogueActItem(slot, Operator.EQ, value)
+                di = DialogueActItem(slot, Operator.EQ, value)
 
-                        if di not in dact.params:
-                            dact.params.append(di)
+                if di not in dact.params:
+                    dact.params.append(di)
 
         # Check if something has been missed (e.g. utterance is dont care and
         # there's no previous sys act)
@@ -478,14 +533,12 @@ class SlotFillingNLU(NLU):
                     if slot in utterance:
                         # We can only handle 'dontcare' kind of values here,
                         # as we do not know values of req. slots.
-                        for p in self.dontcare_pattern:
-                            match = re.search(r'\b{0}\b'.format(p), utterance)
-                            if match:
-                                dact.params = \
-                                    [DialogueActItem(
-                                        slot,
-                                        Operator.EQ,
-                                        'dontcare')]
+                        if self.dontcare_regex.search(utterance):
+                            dact.params = \
+                                [DialogueActItem(
+                                    slot,
+                                    Operator.EQ,
+                                    'dontcare')]
 
                 dact.intent = 'UNK'
 
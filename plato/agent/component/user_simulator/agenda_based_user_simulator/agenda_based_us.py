@@ -19,7 +19,8 @@ from copy import deepcopy
 from plato.dialogue.action import DialogueAct, DialogueActItem, Operator
 from plato.agent.component.nlg.slot_filling_nlg import SlotFillingNLG
 from plato.agent.component.nlu.slot_filling_nlu import SlotFillingNLU
-from plato.domain.database import DataBase, SQLDataBase, JSONDataBase
+from plato.domain.database import DataBase, SQLDataBase, JSONDataBase, \
+    ColumnarDataBase
 from plato.domain.ontology import Ontology
 from plato.agent.component.user_simulator.agenda_based_user_simulator import \
     error_model, agenda
@@ -90,9 +91,11 @@ class AgendaBasedUS(user_simulator.UserSimulator):
             self.database = database
 
         elif isinstance(database, str):
-            if database[-3:] == '.db':
+            if 'db_type' in args and args['db_type'] == 'columnar':
+                self.database = ColumnarDataBase(database)
+            elif database[-3:] == '.db':
                 self.database = SQLDataBase(database)
-            elif database[-5:] == '.json':
+            elif database[-5:] == '.json' or database[-6:] == '.jsonl':
                 self.database = JSONDataBase(database)
             else:
                 raise ValueError('Unacceptable database type %s ' % database)
@@ -16,7 +16,8 @@ from copy import deepcopy
 from plato.agent.component.user_simulator.user_simulator import UserSimulator
 from plato.agent.component.user_simulator.goal import GoalGenerator
 from plato.domain.ontology import Ontology
-from plato.domain.database import DataBase, SQLDataBase, JSONDataBase
+from plato.domain.database import DataBase, SQLDataBase, JSONDataBase, \
+    ColumnarDataBase
 from plato.dialogue.action import DialogueActItem, Operator, DialogueAct
 
 import os.path
@@ -68,9 +69,11 @@ class DTLUserSimulator(UserSimulator):
             self.database = database
 
         elif isinstance(database, str):
-            if database[-3:] == '.db':
+            if 'db_type' in args and args['db_type'] == 'columnar':
+                self.database = ColumnarDataBase(database)
+            elif database[-3:] == '.db':
                 self.database = SQLDataBase(database)
-            elif database[-5:] == '.json':
+            elif database[-5:] == '.json' or database[-6:] == '.jsonl':
                 self.database = JSONDataBase(database)
             else:
                 raise ValueError('Unacceptable database type %s ' % database)
@@ -18,6 +18,7 @@ import pickle
 import random
 
 from plato.dialogue.action import DialogueActItem, Operator
+from plato.dialogue.state import SlotFillingDialogueState
 from plato.domain.ontology import Ontology
 from plato.domain.database import DataBase, SQLDataBase, JSONDataBase
 
@@ -110,7 +111,8 @@ class GoalGenerator:
         elif isinstance(args['database'], str):
             if args['database'][-3:] == '.db':
                 self.database = SQLDataBase(args['database'])
-            elif args['database'][-5:] == '.json':
+            elif args['database'][-5:] == '.json' or \
+                    args['database'][-6:] == '.jsonl':
                 self.database = JSONDataBase(args['database'])
             else:
                 raise ValueError('Unacceptable database type %s '
@@ -128,28 +130,11 @@ class GoalGenerator:
         if self.goals_file:
             self.load_goals(self.goals_file)
 
-        # Get the slot names from the database
-        cursor = self.database.SQL_connection.cursor()
-
-        # Get Table name
-        result = \
-            cursor.execute(
-                "select * from sqlite_master where type = 'table';").fetchall()
-        if result and result[0] and result[0][1]:
-            self.db_table_name = result[0][1]
-        else:
-            raise ValueError('Goal Generator cannot specify Table Name from '
-                             'database {0}'.format(self.database.db_file_name))
-
-        # Dummy SQL command
-        sql_command = "SELECT * FROM " + self.db_table_name + " LIMIT 1;"
-
-        cursor.execute(sql_command)
-        self.slot_names = [i[0] for i in cursor.description]
-
-        self.db_row_count = \
-            cursor.execute("SELECT COUNT(*) FROM " +
-                           self.db_table_name + ";").fetchall()[0][0]
+        # Get the table name, slot names, and number of items from the
+        # database
+        self.db_table_name = self.database.get_table_name()
+        self.slot_names = self.database.get_slot_names()
+        self.db_row_count = self.database.get_item_count()
 
     def generate(self, goal_slot_selection_weights=None):
         """
@@ -165,36 +150,23 @@ class GoalGenerator:
             return random.choice(self.goals)
 
         # Randomly pick an item from the database
-        cursor = self.database.SQL_connection.cursor()
-
-        sql_command = "SELECT * FROM " + self.db_table_name + \
-                      " WHERE ROWID == (" + \
-                      str(random.randint(1, self.db_row_count)) + ");"
-
-        cursor.execute(sql_command)
-        db_result = cursor.fetchone()
+        result = self.database.get_item(random.randint(1, self.db_row_count))
 
         attempt = 0
-        while attempt < 3 and not db_result:
+        while attempt < 3 and not result:
             print('GoalGenerator: Database {0} appears to be empty!'
                   .format(self.database))
             print(f'Trying again (attempt {attempt} out of 3)...')
 
-            sql_command = "SELECT * FROM " + self.db_table_name + \
-                          " WHERE ROWID == (" + \
-                          str(random.randint(1, self.db_row_count)) + ");"
-
-            cursor.execute(sql_command)
-            db_result = cursor.fetchone()
+            result = \
+                self.database.get_item(random.randint(1, self.db_row_count))
 
             attempt += 1
 
-        if not db_result:
+        if not result:
             raise LookupError('GoalGenerator: Database {0} appears to be '
                               'empty!'.format(self.database))
 
-        result = dict(zip(self.slot_names, db_result))
-
         # Generate goal
         goal = Goal()
 
@@ -367,14 +339,8 @@ class ComplexGoalGenerator(GoalGenerator):
             return random.sample(self.goals)
 
         # Randomly pick an item from the database
-        cursor = self.database.SQL_connection.cursor()
-
-        sql_command = "SELECT * FROM " + self.db_table_name + \
-                      " WHERE ROWID == (" + \
-                      str(random.randint(1, self.db_row_count)) + ");"
-
-        cursor.execute(sql_command)
-        db_result = cursor.fetchone()
+        db_result = \
+            self.database.get_item(random.randint(1, self.db_row_count))
 
         global_key_value = ''
         global_attempt = 0
@@ -388,12 +354,8 @@ class ComplexGoalGenerator(GoalGenerator):
                       .format(self.database))
                 print(f'Trying again (attempt {attempt} out of 3)...')
 
-                sql_command = "SELECT * FROM " + self.db_table_name + \
-                              " WHERE ROWID == (" + \
-                              str(random.randint(1, self.db_row_count)) + ");"
-
-                cursor.execute(sql_command)
-                db_result = cursor.fetchone()
+                db_result = self.database.get_item(
+                    random.randint(1, self.db_row_count))
 
                 attempt += 1
 
@@ -401,7 +363,7 @@ class ComplexGoalGenerator(GoalGenerator):
                 raise LookupError('GoalGenerator: Database {0} appears to be '
                                   'empty!'.format(self.database))
 
-            result = dict(zip(self.slot_names, db_result))
+            result = db_result
 
             if self.global_key in result:
                 global_key_value = result[self.global_key]
@@ -422,19 +384,14 @@ class ComplexGoalGenerator(GoalGenerator):
 
         # Fetch all items from the database that satisfy the constraints
         # sampled above
-        sql_command = "SELECT * FROM " + self.db_table_name + \
-                      " WHERE " + self.global_key + " = \"" + \
-                      global_key_value + "\" AND "
+        constraints = SlotFillingDialogueState(
+            {'slots': [self.global_key] + global_inf_slots})
+        constraints.slots_filled[self.global_key] = global_key_value
 
         for gs in global_inf_slots:
-            sql_command += gs + " = \"" + result[gs] + "\" AND "
-        # Trim last 'AND '
-        sql_command = sql_command[:-4] + ";"
-
-        cursor.execute(sql_command)
-        db_results = cursor.fetchall()
+            constraints.slots_filled[gs] = result[gs]
 
-        results = [dict(zip(self.slot_names, dbr)) for dbr in db_results]
+        results = self.database.db_lookup(constraints)
 
         for slot in global_inf_slots:
             # Check that the slot has a value in the retrieved item
@@ -79,6 +79,7 @@ class ConversationalGenericAgent(ConversationalAgent):
 
         self.SAVE_LOG = True
         self.SAVE_INTERVAL = 1000
+        self.SAVE_MODELS = True
         self.MAX_TURNS = 15
         self.INTERACTION_MODE = 'simulation'
         self.USE_GUI = False
@@ -135,6 +136,10 @@ class ConversationalGenericAgent(ConversationalAgent):
             if 'use_gui' in self.configuration['GENERAL']:
                 self.USE_GUI = self.configuration['GENERAL']['use_gui']
 
+            if 'save_models' in self.configuration['GENERAL']:
+                self.SAVE_MODELS = \
+                    bool(self.configuration['GENERAL']['save_models'])
+
             if 'experience_logs' in self.configuration['GENERAL']:
                 dialogues_path = None
                 if 'path' in self.configuration['GENERAL']['experience_logs']:
@@ -160,6 +165,13 @@ class ConversationalGenericAgent(ConversationalAgent):
                             'experience_logs']['save']
                     )
 
+                    if self.SAVE_LOG and 'flush_interval' in \
+                            self.configuration['GENERAL']['experience_logs']:
+                        self.recorder.stream(
+                            self.configuration['GENERAL'][
+                                'experience_logs']['flush_interval']
+                        )
+
             self.NModules = 0
             if 'modules' in self.configuration[ag_id_str]:
                 self.NModules = int(
@@ -319,12 +331,13 @@ class ConversationalGenericAgent(ConversationalAgent):
         if self.recorder and self.SAVE_LOG:
             self.recorder.save()
 
-        for m in self.ConversationalModules:
-            if isinstance(m, list):
-                for sm in m:
-                    sm.save()
-            else:
-                m.save()
+        if self.SAVE_MODELS:
+            for m in self.ConversationalModules:
+                if isinstance(m, list):
+                    for sm in m:
+                        sm.save()
+                else:
+                    m.save()
 
     # Dynamically load classes
     @staticmethod
@@ -490,7 +503,8 @@ class ConversationalGenericAgent(ConversationalAgent):
                 else:
                     m.train(self.recorder.dialogues)
 
-        if self.dialogue_episode % self.SAVE_INTERVAL == 0:
+        if self.SAVE_MODELS and \
+                self.dialogue_episode % self.SAVE_INTERVAL == 0:
             for m in self.ConversationalModules:
                 if isinstance(m, list):
                     for sm in m:
@@ -30,6 +30,7 @@ from plato.agent.component.user_simulator.goal \
 from plato.agent.component.user_simulator.user_model \
     import UserModel
 from plato.utilities.dialogue_episode_recorder import DialogueEpisodeRecorder
+from plato.utilities.replay_buffer import ReplayBuffer
 
 """
 The ConversationalMultiAgent is a conversational agent that can 
@@ -90,6 +91,13 @@ class ConversationalMultiAgent(ConversationalAgent):
         self.train_epochs = 3
         self.global_args = {}
 
+        # If set, minibatches are sampled from the transitions of the replay
+        # buffer instead of the recorded dialogues
+        self.replay_buffer = None
+
+        # Number of the recorder's dialogues added to the replay buffer
+        self.replay_num_added = 0
+
         # Alternate training between the agents
         self.train_alternate_training = True
         self.train_switch_trainable_agents_every = self.train_interval
@@ -103,6 +111,7 @@ class ConversationalMultiAgent(ConversationalAgent):
         self.USER_HAS_INITIATIVE = True
         self.SAVE_LOG = True
         self.SAVE_INTERVAL = 10000
+        self.SAVE_MODELS = True
 
         # The dialogue will terminate after MAX_TURNS (this agent will issue
         # a bye() dialogue act.
@@ -166,6 +175,10 @@ class ConversationalMultiAgent(ConversationalAgent):
                     self.global_args = \
                         self.configuration['GENERAL']['global_arguments']
 
+                if 'save_models' in self.configuration['GENERAL']:
+                    self.SAVE_MODELS = \
+                        bool(self.configuration['GENERAL']['save_models'])
+
                 if 'experience_logs' in self.configuration['GENERAL']:
                     dialogues_path = None
                     if 'path' in \
@@ -198,6 +211,14 @@ class ConversationalMultiAgent(ConversationalAgent):
                                 'experience_logs']['save']
                         )
 
+                        if self.SAVE_LOG and 'flush_interval' in \
+                                self.configuration['GENERAL'][
+                                    'experience_logs']:
+                            self.recorder.stream(
+                                self.configuration['GENERAL'][
+                                    'experience_logs']['flush_interval']
+                            )
+
                         # Retrieve agent role
                         if 'role' in self.configuration[ag_id_str]:
                             self.agent_role = self.configuration[ag_id_str][
@@ -243,8 +264,13 @@ class ConversationalMultiAgent(ConversationalAgent):
                     db_path = self.global_args['database']
 
                 if db_path and os.path.isfile(db_path):
-                    if db_path[-3:] == '.db':
+                    if self.configuration['DIALOGUE'].get('db_type') == \
+                            'columnar':
+                        self.database = database.ColumnarDataBase(db_path)
+                    elif db_path[-3:] == '.db':
                         self.database = database.SQLDataBase(db_path)
+                    elif db_path[-5:] == '.json' or db_path[-6:] == '.jsonl':
+                        self.database = database.JSONDataBase(db_path)
                     else:
                         self.database = database.DataBase(db_path)
                 else:
@@ -307,6 +333,18 @@ class ConversationalMultiAgent(ConversationalAgent):
                 self.train_epochs = \
                     self.configuration[ag_id_str]['train_epochs']
 
+            if 'replay_buffer' in self.configuration[ag_id_str]:
+                self.replay_buffer = ReplayBuffer.from_config(
+                    self.configuration[ag_id_str]['replay_buffer'])
+
+                # Start from the most recent loaded dialogues, if any
+                for d in range(max(len(self.recorder.dialogues) -
+                                   self.replay_buffer.capacity, 0),
+                               len(self.recorder.dialogues)):
+                    self.replay_buffer.add_dialogue(self.recorder.dialogues[d])
+
+                self.replay_num_added = self.recorder.num_added
+
             if 'save_interval' in self.configuration[ag_id_str]:
                 self.SAVE_INTERVAL = \
                     self.configuration[ag_id_str]['save_interval']
@@ -411,14 +449,15 @@ class ConversationalMultiAgent(ConversationalAgent):
         if self.recorder and self.SAVE_LOG:
             self.recorder.save()
 
-        if self.nlu:
-            self.nlu.save()
+        if self.SAVE_MODELS:
+            if self.nlu:
+                self.nlu.save()
 
-        if self.dialogue_manager:
-            self.dialogue_manager.save()
+            if self.dialogue_manager:
+                self.dialogue_manager.save()
 
-        if self.nlg:
-            self.nlg.save()
+            if self.nlg:
+                self.nlg.save()
 
         self.prev_state = None
         self.curr_state = None
@@ -596,7 +635,7 @@ class ConversationalMultiAgent(ConversationalAgent):
         # Keep track of prev_state, for the DialogueEpisodeRecorder
         # Store here because this is the state that the dialogue
         # manager will use to make a decision.
-        self.curr_state = deepcopy(self.dialogue_manager.get_state())
+        self.curr_state = self.dialogue_manager.get_state().snapshot()
 
         # Update goal's ground truth
         if self.agent_role == 'system':
@@ -656,9 +695,9 @@ class ConversationalMultiAgent(ConversationalAgent):
 
         self.dialogue_turn += 1
 
-        self.prev_state = deepcopy(self.curr_state)
-        self.prev_usr_utterance = deepcopy(other_input_raw)
-        self.prev_sys_utterance = deepcopy(sys_utterance)
+        self.prev_state = self.curr_state.snapshot()
+        self.prev_usr_utterance = other_input_raw
+        self.prev_sys_utterance = sys_utterance
         self.prev_action = deepcopy(response)
         self.prev_reward = rew
         self.prev_success = success
@@ -713,6 +752,9 @@ class ConversationalMultiAgent(ConversationalAgent):
 
         self.dialogue_episode += 1
 
+        if self.replay_buffer is not None:
+            self.update_replay_buffer()
+
         if self.IS_TRAINING:
             if not self.train_alternate_training or \
                     (self.train_system and
@@ -720,8 +762,13 @@ class ConversationalMultiAgent(ConversationalAgent):
                      not self.train_system and
                      self.agent_role == 'user'):
 
+                if self.replay_buffer is not None:
+                    experience_length = len(self.replay_buffer)
+                else:
+                    experience_length = len(self.recorder.dialogues)
+
                 if self.dialogue_episode % self.train_interval == 0 and \
-                        len(self.recorder.dialogues) >= self.minibatch_length:
+                        experience_length >= self.minibatch_length:
                     for epoch in range(self.train_epochs):
                         print(
                             '{0}: Training epoch {1} of {2}'.format(
@@ -732,10 +779,14 @@ class ConversationalMultiAgent(ConversationalAgent):
                         )
 
                         # Sample minibatch
-                        minibatch = random.sample(
-                            self.recorder.dialogues,
-                            self.minibatch_length
-                        )
+                        if self.replay_buffer is not None:
+                            minibatch = self.replay_buffer.sample_dialogues(
+                                self.minibatch_length)
+                        else:
+                            minibatch = random.sample(
+                                self.recorder.dialogues,
+                                self.minibatch_length
+                            )
 
                         if self.nlu:
                             self.nlu.train(minibatch)
@@ -745,13 +796,19 @@ class ConversationalMultiAgent(ConversationalAgent):
                         if self.nlg:
                             self.nlg.train(minibatch)
 
+                        # Prioritize the sampled transitions by the TD errors
+                        # that the policy recorded in them
+                        if self.replay_buffer is not None:
+                            self.replay_buffer.update_td_errors(minibatch)
+
         self.cumulative_rewards += \
             self.recorder.dialogues[-1][-1]['cumulative_reward']
 
         if self.dialogue_turn > 0:
             self.total_dialogue_turns += self.dialogue_turn
 
-        if self.dialogue_episode % self.SAVE_INTERVAL == 0:
+        if self.SAVE_MODELS and \
+                self.dialogue_episode % self.SAVE_INTERVAL == 0:
             if self.nlu:
                 self.nlu.save()
 
@@ -785,6 +842,24 @@ class ConversationalMultiAgent(ConversationalAgent):
                 self.recorder.dialogues[-1][-1]['task_success']
             )
 
+    def update_replay_buffer(self):
+        """
+        Add the dialogues that the recorder completed since the last update
+        to the replay buffer. The recorder may have truncated some of them
+        already.
+
+        :return: nothing
+        """
+
+        num_new = min(self.recorder.num_added - self.replay_num_added,
+                      len(self.recorder.dialogues))
+
+        for d in range(len(self.recorder.dialogues) - num_new,
+                       len(self.recorder.dialogues)):
+            self.replay_buffer.add_dialogue(self.recorder.dialogues[d])
+
+        self.replay_num_added = self.recorder.num_added
+
     def terminated(self):
         """
         Check if this agent is at a terminal state.
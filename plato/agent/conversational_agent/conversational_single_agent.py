@@ -25,6 +25,7 @@ from plato.agent.component.user_simulator.goal import GoalGenerator
 from plato.agent.component.dialogue_policy.reinforcement_learning.\
     reward_function import SlotFillingReward
 from plato.utilities.dialogue_episode_recorder import DialogueEpisodeRecorder
+from plato.utilities.replay_buffer import ReplayBuffer
 from plato.domain import ontology, database
 from plato.dialogue.action import DialogueAct
 
@@ -100,6 +101,11 @@ class ConversationalSingleAgent(ConversationalAgent):
         self.USER_HAS_INITIATIVE = True
         self.SAVE_LOG = True
         self.SAVE_INTERVAL = 10000
+        self.SAVE_MODELS = True
+
+        # If False, the models are not trained after dialogues (e.g. when
+        # the agent is an actor whose experience a learner trains on)
+        self.TRAIN_ONLINE = True
 
         # The dialogue will terminate after MAX_TURNS (this agent will issue
         # a bye() dialogue act.
@@ -135,6 +141,10 @@ class ConversationalSingleAgent(ConversationalAgent):
 
         self.recorder = DialogueEpisodeRecorder()
 
+        # If set, minibatches are sampled from the transitions of the replay
+        # buffer instead of from the recorded dialogues
+        self.replay_buffer = None
+
         # TODO: Handle this properly - get reward function type from config
         self.reward_func = SlotFillingReward()
         # self.reward_func = SlotFillingGoalAdvancementReward()
@@ -208,6 +218,19 @@ class ConversationalSingleAgent(ConversationalAgent):
                                 self.database = database.SQLDataBase(
                                     self.configuration['DIALOGUE']['db_path']
                                 )
+                            elif self.configuration['DIALOGUE'][
+                                    'db_type'] == 'columnar':
+                                self.database = database.ColumnarDataBase(
+                                    self.configuration['DIALOGUE']['db_path']
+                                )
+                            elif self.configuration['DIALOGUE'][
+                                    'db_type'] == 'json':
+                                self.database = database.JSONDataBase(
+                                    self.configuration['DIALOGUE']['db_path'],
+                                    'db_mmap' in self.configuration[
+                                        'DIALOGUE'] and
+                                    self.configuration['DIALOGUE']['db_mmap']
+                                )
                             else:
                                 self.database = database.DataBase(
                                     self.configuration['DIALOGUE']['db_path']
@@ -259,6 +282,14 @@ class ConversationalSingleAgent(ConversationalAgent):
                 if 'global_arguments' in self.configuration['GENERAL']:
                     self.global_args = \
                         self.configuration['GENERAL']['global_arguments']
+
+                if 'save_models' in self.configuration['GENERAL']:
+                    self.SAVE_MODELS = \
+                        bool(self.configuration['GENERAL']['save_models'])
+
+                if 'train_online' in self.configuration['GENERAL']:
+                    self.TRAIN_ONLINE = \
+                        bool(self.configuration['GENERAL']['train_online'])
                     
                 if 'experience_logs' in self.configuration['GENERAL']:
                     dialogues_path = None
@@ -287,6 +318,14 @@ class ConversationalSingleAgent(ConversationalAgent):
                                 'experience_logs']['save']
                         )
 
+                        if self.SAVE_LOG and 'flush_interval' in \
+                                self.configuration['GENERAL'][
+                                    'experience_logs']:
+                            self.recorder.stream(
+                                self.configuration['GENERAL'][
+                                    'experience_logs']['flush_interval']
+                            )
+
                 if self.configuration['GENERAL']['interaction_mode'] == \
                         'simulation':
                     self.USE_USR_SIMULATOR = True
@@ -335,6 +374,16 @@ class ConversationalSingleAgent(ConversationalAgent):
                 self.train_epochs = \
                     self.configuration['AGENT_0']['train_epochs']
 
+            if 'replay_buffer' in self.configuration['AGENT_0']:
+                self.replay_buffer = ReplayBuffer.from_config(
+                    self.configuration['AGENT_0']['replay_buffer'])
+
+                # Start from the most recent loaded dialogues, if any
+                for d in range(max(len(self.recorder.dialogues) -
+                                   self.replay_buffer.capacity, 0),
+                               len(self.recorder.dialogues)):
+                    self.replay_buffer.add_dialogue(self.recorder.dialogues[d])
+
             if 'save_interval' in self.configuration['AGENT_0']:
                 self.SAVE_INTERVAL = \
                     self.configuration['AGENT_0']['save_interval']
@@ -471,14 +520,8 @@ class ConversationalSingleAgent(ConversationalAgent):
         if self.recorder and self.SAVE_LOG:
             self.recorder.save()
 
-        if self.nlu:
-            self.nlu.save()
-
-        if self.dialogue_manager:
-            self.dialogue_manager.save()
-
-        if self.nlg:
-            self.nlg.save()
+        if self.SAVE_MODELS:
+            self.save_models()
 
         self.curr_state = None
         self.prev_state = None
@@ -587,7 +630,7 @@ class ConversationalSingleAgent(ConversationalAgent):
                 rew, success, task_success = 0, None, None
 
             self.recorder.record(
-                deepcopy(self.dialogue_manager.get_state()),
+                self.dialogue_manager.get_state().snapshot(),
                 self.dialogue_manager.get_state(),
                 sys_response,
                 rew,
@@ -684,7 +727,7 @@ class ConversationalSingleAgent(ConversationalAgent):
         # Keep track of prev_state, for the DialogueEpisodeRecorder
         # Store here because this is the state that the dialogue manager
         # will use to make a decision.
-        self.curr_state = deepcopy(self.dialogue_manager.get_state())
+        self.curr_state = self.dialogue_manager.get_state().snapshot()
 
         if self.dialogue_turn < self.MAX_TURNS:
             sys_response = self.dialogue_manager.generate_output()
@@ -741,10 +784,10 @@ class ConversationalSingleAgent(ConversationalAgent):
 
         self.dialogue_turn += 1
 
-        self.prev_state = deepcopy(self.curr_state)
+        self.prev_state = self.curr_state.snapshot()
         self.prev_action = deepcopy(sys_response)
-        self.prev_usr_utterance = deepcopy(usr_utterance)
-        self.prev_sys_utterance = deepcopy(sys_utterance)
+        self.prev_usr_utterance = usr_utterance
+        self.prev_sys_utterance = sys_utterance
         self.prev_reward = rew
         self.prev_success = success
         self.prev_task_success = task_success
@@ -769,31 +812,14 @@ class ConversationalSingleAgent(ConversationalAgent):
             force_terminate=True
         )
 
-        self.dialogue_episode += 1
-
-        if self.IS_TRAINING:
-            if self.dialogue_episode % self.train_interval == 0 and \
-                    len(self.recorder.dialogues) >= self.minibatch_length:
-                for epoch in range(self.train_epochs):
-                    print('Training epoch {0} of {1}'.format(
-                        (epoch+1),
-                        self.train_epochs)
-                    )
-
-                    # Sample minibatch
-                    minibatch = random.sample(
-                        self.recorder.dialogues,
-                        self.minibatch_length
-                    )
-
-                    if self.nlu and self.nlu.training:
-                        self.nlu.train(minibatch)
+        if self.replay_buffer is not None:
+            self.replay_buffer.add_dialogue(self.recorder.dialogues[-1])
 
-                    if self.dialogue_manager.is_training():
-                        self.dialogue_manager.train(minibatch)
+        self.dialogue_episode += 1
 
-                    if self.nlg and self.nlg.training:
-                        self.nlg.train(minibatch)
+        if self.IS_TRAINING and self.TRAIN_ONLINE:
+            if self.dialogue_episode % self.train_interval == 0:
+                self.train_models()
 
         # Keep track of dialogue statistics
         self.cumulative_rewards += \
@@ -804,15 +830,9 @@ class ConversationalSingleAgent(ConversationalAgent):
         if self.dialogue_turn > 0:
             self.total_dialogue_turns += self.dialogue_turn
 
-        if self.dialogue_episode % self.SAVE_INTERVAL == 0:
-            if self.nlu:
-                self.nlu.save()
-
-            if self.dialogue_manager:
-                self.dialogue_manager.save()
-
-            if self.nlg:
-                self.nlg.save()
+        if self.SAVE_MODELS and \
+                self.dialogue_episode % self.SAVE_INTERVAL == 0:
+            self.save_models()
 
         # Count successful dialogues
         if self.recorder.dialogues[-1][-1]['success']:
@@ -830,6 +850,85 @@ class ConversationalSingleAgent(ConversationalAgent):
         print('OBJECTIVE TASK SUCCESS: {0}'.
               format(self.recorder.dialogues[-1][-1]['task_success']))
 
+    def add_dialogues(self, dialogues):
+        """
+        Add dialogues that were run elsewhere (e.g. by actors, see
+        BasicController.run_actor_learner()) to this agent's experience.
+
+        :param dialogues: a list of dialogues
+        :return: nothing
+        """
+
+        self.recorder.extend(dialogues)
+
+        if self.replay_buffer is not None:
+            for dialogue in dialogues:
+                self.replay_buffer.add_dialogue(dialogue)
+
+    def train_models(self):
+        """
+        Train the models that are being trained on minibatches of the
+        recorded dialogues, or of the replay buffer's transitions (as one-turn
+        dialogues) if the agent has one.
+
+        :return: True if there was enough experience to train on
+        """
+
+        if self.replay_buffer is not None:
+            if len(self.replay_buffer) < self.minibatch_length:
+                return False
+
+        elif len(self.recorder.dialogues) < self.minibatch_length:
+            return False
+
+        for epoch in range(self.train_epochs):
+            print('Training epoch {0} of {1}'.format(
+                (epoch+1),
+                self.train_epochs)
+            )
+
+            # Sample minibatch
+            if self.replay_buffer is not None:
+                minibatch = self.replay_buffer.sample_dialogues(
+                    self.minibatch_length)
+            else:
+                minibatch = random.sample(
+                    self.recorder.dialogues,
+                    self.minibatch_length
+                )
+
+            if self.nlu and self.nlu.training:
+                self.nlu.train(minibatch)
+
+            if self.dialogue_manager.is_training():
+                self.dialogue_manager.train(minibatch)
+
+            if self.nlg and self.nlg.training:
+                self.nlg.train(minibatch)
+
+            # Prioritize the sampled transitions by the TD errors that the
+            # policy recorded in them
+            if self.replay_buffer is not None:
+                self.replay_buffer.update_td_errors(minibatch)
+
+        return True
+
+    def save_models(self):
+        """
+        Save the models.
+
+        :return: nothing
+        """
+
+        if self.nlu:
+            self.nlu.save()
+
+        if self.dialogue_manager:
+            self.dialogue_manager.save()
+
+        if self.nlg:
+            self.nlg.save()
+
     def terminated(self):
         """
         Check if this agent is at a terminal state.
@@ -18,20 +18,122 @@ from plato.agent.conversational_agent.conversational_multi_agent import \
     ConversationalMultiAgent
 from plato.agent.conversational_agent.conversational_generic_agent import \
     ConversationalGenericAgent
+from plato.utilities.dialogue_episode_recorder import DialogueEpisodeRecorder
 
+from copy import deepcopy
+
+import multiprocessing
+import numpy as np
 import configparser
+import queue
 import yaml
 import sys
 import os
 import time
 import random
+import traceback
 
 """
 The controller class is responsible for running each dialogue until the 
 agent(s) terminate. In the multi-agent case, the controller will pass the 
 appropriate input to each agent.
+
+Simulations can also run in parallel (see BasicController.run_parallel()): the
+dialogues are then split across a number of worker processes, each with its 
+own agents, and the controller merges their experience and statistics.
 """
 
+# Number of dialogues that a parallel simulation worker sends to the
+# controller at a time
+PARALLEL_BATCH_SIZE = 10
+
+
+def simulation_worker(worker, config, num_dialogues, num_agents,
+                      interaction_mode, seed, results, snapshots=None):
+    """
+    Run a shard of a parallel simulation (see BasicController.run_parallel())
+    and send the dialogues of AGENT_0 and the statistics to the controller.
+    As an actor of BasicController.run_actor_learner(), the worker does not
+    train its models but reloads the dialogue manager whenever the learner
+    publishes a new version of it.
+
+    :param worker: the worker's index
+    :param config: a dictionary containing settings
+    :param num_dialogues: how many dialogues to run for
+    :param num_agents: how many agents to spawn
+    :param interaction_mode: 'simulation' or 'multi_agent'
+    :param seed: the worker's random seed
+    :param results: a queue to send ('dialogues', worker, dialogues),
+                    ('statistics', worker, statistics) or
+                    ('error', worker, message) messages to
+    :param snapshots: (version, lock) of the learner's models, for actors
+    :return: nothing
+    """
+
+    random.seed(seed)
+    np.random.seed(seed % 2 ** 32)
+
+    # The controller loads and saves the merged experience log, and the
+    # workers' models are not saved, as each worker has a copy of them
+    config = deepcopy(config)
+    config['GENERAL']['save_models'] = False
+
+    if 'experience_logs' in config['GENERAL']:
+        config['GENERAL']['experience_logs']['load'] = False
+        config['GENERAL']['experience_logs']['save'] = False
+
+    if snapshots:
+        config['GENERAL']['train_online'] = False
+
+    dialogues = []
+    sent = 0
+    version = 0
+
+    def send_dialogues(agents):
+        nonlocal sent, version
+
+        # Dialogues recorded since the last call (generic agents do not
+        # record any). They are counted rather than indexed, as the oldest
+        # dialogues are dropped once the recorder is full.
+        recorder = [a for a in agents if a.agent_id == 0][0].recorder
+        num_new = min(recorder.num_added - sent, len(recorder.dialogues))
+
+        for d in range(len(recorder.dialogues) - num_new,
+                       len(recorder.dialogues)):
+            dialogues.append(recorder.dialogues[d])
+
+        sent = recorder.num_added
+
+        if len(dialogues) >= PARALLEL_BATCH_SIZE:
+            results.put(('dialogues', worker, list(dialogues)))
+            dialogues.clear()
+
+        if snapshots and snapshots[0].value > version:
+            # The learner does not save its models while we load them
+            with snapshots[1]:
+                version = snapshots[0].value
+
+                for agent in agents:
+                    agent.dialogue_manager.load(None)
+
+    try:
+        if interaction_mode == 'multi_agent':
+            statistics = BasicController.run_multi_agent(
+                config, num_dialogues, num_agents, send_dialogues)
+        else:
+            statistics = BasicController.run_single_agent(
+                config, num_dialogues, send_dialogues)
+
+    except Exception:
+        # Report any crash, with its traceback, rather than just an exit code
+        results.put(('error', worker, traceback.format_exc()))
+        return
+
+    if dialogues:
+        results.put(('dialogues', worker, dialogues))
+
+    results.put(('statistics', worker, statistics))
+
 
 class BasicController(controller.Controller):
     def __init__(self):
@@ -46,12 +148,14 @@ class BasicController(controller.Controller):
         self.goal = None
 
     @staticmethod
-    def run_single_agent(config, num_dialogues):
+    def run_single_agent(config, num_dialogues, dialogue_callback=None):
         """
         This function will create an agent and orchestrate the conversation.
 
         :param config: a dictionary containing settings
         :param num_dialogues: how many dialogues to run for
+        :param dialogue_callback: optional function to call with the list of
+                                  agents after each dialogue
         :return: some statistics
         """
         if 'GENERAL' in config and 'generic' in config['GENERAL'] \
@@ -73,6 +177,9 @@ class BasicController(controller.Controller):
 
             ca.end_dialogue()
 
+            if dialogue_callback:
+                dialogue_callback([ca])
+
         # Collect statistics
         statistics = {'AGENT_0': {}}
 
@@ -94,7 +201,8 @@ class BasicController(controller.Controller):
         return statistics
 
     @staticmethod
-    def run_multi_agent(config, num_dialogues, num_agents):
+    def run_multi_agent(config, num_dialogues, num_agents,
+                        dialogue_callback=None):
         """
         This function will create multiple conversational agents and
         orchestrate the conversation among them.
@@ -104,6 +212,8 @@ class BasicController(controller.Controller):
         :param config: a dictionary containing settings
         :param num_dialogues: how many dialogues to run for
         :param num_agents: how many agents to spawn
+        :param dialogue_callback: optional function to call with the list of
+                                  agents after each dialogue
         :return: some statistics
         """
 
@@ -215,6 +325,9 @@ class BasicController(controller.Controller):
             for ca in conv_user_agents:
                 ca.end_dialogue()
 
+            if dialogue_callback:
+                dialogue_callback(conv_sys_agents + conv_user_agents)
+
         # Collect statistics
         statistics = {}
 
@@ -274,6 +387,286 @@ class BasicController(controller.Controller):
 
         return statistics
 
+    @staticmethod
+    def run_parallel(config, num_dialogues, num_agents, interaction_mode,
+                     num_workers):
+        """
+        This function will split the dialogues across a number of worker
+        processes, each of which creates its own agents (and therefore
+        database connections) and has its own random seed. The workers send
+        their dialogues back as they go, which are merged into one experience
+        log, and their statistics, which are merged once all have finished.
+
+        Models are not saved by the workers, as each of them has its own copy,
+        so parallel simulations are meant for evaluating policies and for
+        generating experience.
+
+        :param config: a dictionary containing settings
+        :param num_dialogues: how many dialogues to run for
+        :param num_agents: how many agents to spawn
+        :param interaction_mode: 'simulation' or 'multi_agent'
+        :param num_workers: how many worker processes to use
+        :return: some statistics
+        """
+
+        recorder, save_log = BasicController.build_recorder(config)
+
+        workers, shards, results = BasicController.start_workers(
+            config, num_dialogues, num_agents, interaction_mode, num_workers)
+
+        statistics = BasicController.collect_results(
+            workers, results, recorder.extend)
+
+        if save_log:
+            recorder.save()
+
+        statistics = BasicController.merge_statistics(
+            [(shards[w], statistics[w]) for w in sorted(statistics)])
+
+        print('\n\nParallel simulation of {0} dialogues\n'
+              'dialogue Success Rate: {1}\nAverage Cumulative Reward: {2}'
+              '\nAverage Turns: {3}'.
+              format(num_dialogues,
+                     statistics['AGENT_0']['dialogue_success_percentage'],
+                     statistics['AGENT_0']['avg_cumulative_rewards'],
+                     statistics['AGENT_0']['avg_turns']))
+
+        return statistics
+
+    @staticmethod
+    def run_actor_learner(config, num_dialogues, num_workers):
+        """
+        This function will train a single agent with an actor-learner
+        architecture: a number of actor processes run the dialogues (see
+        run_parallel()) and the controller trains the agent's models on their
+        dialogues, as they arrive. Every time the models are trained, they are
+        saved and the actors reload them after their current dialogue, so
+        simulation does not wait for training and vice versa.
+
+        :param config: a dictionary containing settings
+        :param num_dialogues: how many dialogues to run for
+        :param num_workers: how many actor processes to use
+        :return: some statistics
+        """
+
+        context = multiprocessing.get_context()
+
+        # The learner is an agent that does not run any dialogues. It loads
+        # and saves the experience log and saves the models when it is
+        # deleted, like any other agent. Agents add objects such as database
+        # connections to their configuration, so it gets its own copy.
+        learner = ConversationalSingleAgent(deepcopy(config))
+        learner.initialize()
+
+        version = context.Value('i', 0)
+        lock = context.Lock()
+
+        def learn(dialogues):
+            for dialogue in dialogues:
+                learner.add_dialogues([dialogue])
+                learner.dialogue_episode += 1
+
+                if learner.dialogue_episode % learner.train_interval == 0 \
+                        and learner.train_models():
+                    # Publish the new models to the actors
+                    with lock:
+                        learner.save_models()
+                        version.value += 1
+
+        workers, shards, results = BasicController.start_workers(
+            config, num_dialogues, 1, 'simulation', num_workers,
+            (version, lock))
+
+        statistics = BasicController.collect_results(
+            workers, results, learn)
+
+        statistics = BasicController.merge_statistics(
+            [(shards[w], statistics[w]) for w in sorted(statistics)])
+
+        print('\n\nActor-learner training with {0} dialogues and {1} '
+              'model versions\n'
+              'dialogue Success Rate: {2}\nAverage Cumulative Reward: {3}'
+              '\nAverage Turns: {4}'.
+              format(num_dialogues, version.value,
+                     statistics['AGENT_0']['dialogue_success_percentage'],
+                     statistics['AGENT_0']['avg_cumulative_rewards'],
+                     statistics['AGENT_0']['avg_turns']))
+
+        return statistics
+
+    @staticmethod
+    def start_workers(config, num_dialogues, num_agents, interaction_mode,
+                      num_workers, snapshots=None):
+        """
+        Split the dialogues across a number of simulation worker processes
+        and start them (see simulation_worker()).
+
+        :param config: a dictionary containing settings
+        :param num_dialogues: how many dialogues to run for
+        :param num_agents: how many agents to spawn
+        :param interaction_mode: 'simulation' or 'multi_agent'
+        :param num_workers: how many worker processes to use
+        :param snapshots: (version, lock) of the learner's models, for actors
+        :return: the processes, their numbers of dialogues, and the queue
+                 that they send their results to
+        """
+
+        shards = [num_dialogues // num_workers +
+                  (1 if w < num_dialogues % num_workers else 0)
+                  for w in range(num_workers)]
+        shards = [shard for shard in shards if shard > 0]
+
+        # Worker w uses seed + w, so a seed makes the simulation repeatable
+        if 'seed' in config['GENERAL']:
+            seed = int(config['GENERAL']['seed'])
+        else:
+            seed = random.randrange(2 ** 31)
+
+        context = multiprocessing.get_context()
+        results = context.Queue()
+        workers = [context.Process(target=simulation_worker,
+                                   args=(w, config, shard, num_agents,
+                                         interaction_mode, seed + w, results,
+                                         snapshots))
+                   for w, shard in enumerate(shards)]
+
+        print(f'Running {num_dialogues} dialogues in {len(workers)} '
+              f'parallel workers')
+
+        for process in workers:
+            process.start()
+
+        return workers, shards, results
+
+    @staticmethod
+    def collect_results(workers, results, receive_dialogues):
+        """
+        Receive the dialogues and statistics of simulation workers until all
+        of them have finished.
+
+        :param workers: the worker processes (see start_workers())
+        :param results: the queue that the workers send their results to
+        :param receive_dialogues: function to call with each batch of
+                                  dialogues
+        :return: a dictionary of worker index -> statistics
+        """
+
+        statistics = {}
+        errors = []
+        finished = set()
+
+        try:
+            while len(finished) < len(workers):
+                try:
+                    message = results.get(timeout=1)
+
+                except queue.Empty:
+                    # Workers that crashed will not send their statistics
+                    for w, process in enumerate(workers):
+                        if w not in finished and \
+                                process.exitcode not in (None, 0):
+                            errors.append(f'worker {w} exited with code '
+                                          f'{process.exitcode}')
+                            finished.add(w)
+                    continue
+
+                kind, w = message[0], message[1]
+
+                if kind == 'dialogues':
+                    receive_dialogues(message[2])
+
+                elif kind == 'statistics':
+                    statistics[w] = message[2]
+                    finished.add(w)
+
+                else:
+                    errors.append(f'worker {w}: {message[2]}')
+                    finished.add(w)
+
+                    # No point in simulating the rest
+                    for process in workers:
+                        process.terminate()
+
+        except BaseException:
+            # Workers may be blocked sending results that will never be
+            # received, so they would never finish
+            for process in workers:
+                process.terminate()
+
+            raise
+
+        finally:
+            for process in workers:
+                process.join()
+
+        if errors:
+            raise ValueError('Parallel simulation failed ({0})'
+                             .format('; '.join(errors)))
+
+        return statistics
+
+    @staticmethod
+    def build_recorder(config):
+        """
+        Create a dialogue episode recorder for the experience log in the
+        configuration, like the agents do.
+
+        :param config: a dictionary containing settings
+        :return: the recorder, and whether the log should be saved
+        """
+
+        recorder = DialogueEpisodeRecorder()
+        save_log = False
+
+        if 'experience_logs' in config['GENERAL']:
+            logs = config['GENERAL']['experience_logs']
+            path = logs['path'] if 'path' in logs else None
+
+            if 'load' in logs and bool(logs['load']):
+                if path and os.path.isfile(path):
+                    recorder.load(path)
+                else:
+                    raise FileNotFoundError(
+                        'dialogue Log file %s not found (did you '
+                        'provide one?)' % path)
+
+            if 'save' in logs and path:
+                recorder.set_path(path)
+                save_log = bool(logs['save'])
+
+                if save_log and 'flush_interval' in logs:
+                    recorder.stream(logs['flush_interval'])
+
+        return recorder, save_log
+
+    @staticmethod
+    def merge_statistics(results):
+        """
+        Merge the statistics of a number of simulations. Since statistics are
+        averages over dialogues, they are weighted by the number of dialogues
+        of each simulation.
+
+        :param results: a list of (number of dialogues, statistics) tuples
+        :return: the merged statistics
+        """
+
+        total = sum(num_dialogues for num_dialogues, _ in results)
+        merged = {}
+
+        for num_dialogues, statistics in results:
+            for agent, values in statistics.items():
+                merged_values = merged.setdefault(agent, {})
+
+                for key, value in values.items():
+                    if isinstance(value, (int, float)) and \
+                            not isinstance(value, bool):
+                        merged_values[key] = merged_values.get(key, 0) + \
+                            value * num_dialogues / total
+                    else:
+                        merged_values[key] = value
+
+        return merged
+
     def arg_parse(self, args=None):
         """
         This function will parse the configuration file that was provided as a
@@ -320,6 +713,8 @@ class BasicController(controller.Controller):
         dialogues = 10
         interaction_mode = 'simulation'
         num_agents = 1
+        workers = 1
+        actor_learner = False
 
         if cfg_parser:
             dialogues = int(cfg_parser['DIALOGUE']['num_dialogues'])
@@ -337,11 +732,34 @@ class BasicController(controller.Controller):
             if 'tests' in cfg_parser['GENERAL']:
                 tests = int(cfg_parser['GENERAL']['tests'])
 
+            if 'parallel_workers' in cfg_parser['GENERAL']:
+                workers = int(cfg_parser['GENERAL']['parallel_workers'])
+
+                if workers > 1 and \
+                        interaction_mode not in ['simulation', 'multi_agent']:
+                    print('WARNING! Parallel workers are only supported in '
+                          'simulation and multi_agent interaction modes.')
+                    workers = 1
+
+            if 'actor_learner' in cfg_parser['GENERAL']:
+                actor_learner = bool(cfg_parser['GENERAL']['actor_learner'])
+
+                generic = 'generic' in cfg_parser['GENERAL'] and \
+                    bool(cfg_parser['GENERAL']['generic'])
+
+                if actor_learner and \
+                        (interaction_mode != 'simulation' or generic):
+                    print('WARNING! Actor-learner training is only supported '
+                          'for (non-generic) single agent simulations.')
+                    actor_learner = False
+
         return {'cfg_parser': cfg_parser,
                 'tests': tests,
                 'dialogues': dialogues,
                 'interaction_mode': interaction_mode,
                 'num_agents': num_agents,
+                'workers': workers,
+                'actor_learner': actor_learner,
                 'test_mode': False}
 
     def run_controller(self, args):
@@ -359,6 +777,9 @@ class BasicController(controller.Controller):
         num_dialogues = args['dialogues']
         interaction_mode = args['interaction_mode']
         num_agents = args['num_agents']
+        num_workers = args['workers'] if 'workers' in args else 1
+        actor_learner = \
+            args['actor_learner'] if 'actor_learner' in args else False
 
         for test in range(tests):
             # Run simulation
@@ -370,7 +791,16 @@ class BasicController(controller.Controller):
             print('=======================================\n')
 
             try:
-                if interaction_mode in ['simulation', 'text', 'speech']:
+                if num_workers > 1 and actor_learner:
+                    statistics = self.run_actor_learner(
+                        cfg_parser, num_dialogues, num_workers)
+
+                elif num_workers > 1:
+                    statistics = self.run_parallel(
+                        cfg_parser, num_dialogues, num_agents,
+                        interaction_mode, num_workers)
+
+                elif interaction_mode in ['simulation', 'text', 'speech']:
                     # YAML version
                     statistics = self.run_single_agent(
                         cfg_parser, num_dialogues)
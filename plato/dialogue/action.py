@@ -12,6 +12,7 @@ limitations under the License.
 __author__ = "Alexandros Papangelis"
 
 from enum import Enum
+from weakref import WeakValueDictionary
 
 """
 The Action class models actions that a Conversational Agent or Simulated usr 
@@ -21,11 +22,41 @@ multi-modal act, etc.) should follow.
 
 
 class Action:
+    __slots__ = ('name', 'funcName', 'params')
+
     def __init__(self):
         self.name = None
         self.funcName = None    # Function name to be called, if applicable?
         self.params = {}        # dialogue Act Items (slot - operator - value)
 
+    def __getstate__(self):
+        """
+        Get the state of the Action, for pickling and copying.
+
+        :return: a dictionary with the Action's attributes
+        """
+
+        state = dict(getattr(self, '__dict__', {}))
+
+        for cls in type(self).__mro__:
+            for attr in cls.__dict__.get('__slots__', ()):
+                if hasattr(self, attr):
+                    state[attr] = getattr(self, attr)
+
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restore the state of the Action. This also accepts Actions pickled
+        before they had __slots__.
+
+        :param state: a dictionary with the Action's attributes
+        :return: nothing
+        """
+
+        for attr, value in state.items():
+            setattr(self, attr, value)
+
 
 """
 Summary Action is a simple class to represent actions in Summary Space. 
@@ -57,6 +88,8 @@ class DialogueAct(Action):
     and a list of DialogueActItem parameters, which are triplets of
     <slot, operator, value>.
     """
+    __slots__ = ('intent',)
+
     def __init__(self, intent='', params=None):
         super(DialogueAct, self).__init__()
 
@@ -73,17 +106,53 @@ class DialogueAct(Action):
 
     def __eq__(self, other):
         """
-        Equality operator.
+        Equality operator. The order of the params does not matter.
 
         :param other: the dialogue Act to compare against
         :return: True of False
         """
 
-        # TODO: Make the check more efficient
-        return self.funcName == other.funcName and \
-            self.intent == other.intent and \
-            self.name == other.name and \
-            [s for s in self.params if s not in other.params] == []
+        if self is other:
+            return True
+
+        if not isinstance(other, DialogueAct):
+            return NotImplemented
+
+        if self.funcName != other.funcName or \
+                self.intent != other.intent or \
+                self.name != other.name:
+            return False
+
+        if self.params == other.params:
+            return True
+
+        try:
+            return set(self.params) == set(other.params)
+
+        except TypeError:
+            # Some value is not hashable
+            return all(p in other.params for p in self.params) and \
+                all(p in self.params for p in other.params)
+
+    def __hash__(self):
+        """
+        Hash the dialogue Act. Note that dialogue Acts are mutable, so they
+        should not be modified while they are used as dictionary keys; use
+        freeze() to get an immutable key instead.
+
+        :return: the hash
+        """
+
+        return hash((self.intent, frozenset(self.params)))
+
+    def freeze(self):
+        """
+        Get the immutable, interned version of this dialogue Act.
+
+        :return: a FrozenDialogueAct
+        """
+
+        return FrozenDialogueAct(self.intent, self.params)
 
     def __str__(self):
         """
@@ -118,6 +187,8 @@ triplet of (slot, operator, value).
 
 
 class DialogueActItem:
+    __slots__ = ('slot', 'op', 'value')
+
     def __init__(self, slot, op, value):
         """
         Initialize a dialogue Act Item (slot - operator - value)
@@ -149,9 +220,47 @@ class DialogueActItem:
 
         # TODO: Will need some kind of constraint satisfaction (with tolerance)
         # to efficiently handle all operators
+        if self is other:
+            return True
+
+        if not isinstance(other, DialogueActItem):
+            return NotImplemented
+
         return self.slot == other.slot and self.op == other.op and \
             self.value == other.value
 
+    def __hash__(self):
+        """
+        Hash the dialogue Act Item. Note that dialogue Act Items are mutable,
+        so they should not be modified while they are used as dictionary keys.
+
+        :return: the hash
+        """
+
+        return hash((self.slot, self.op, freeze_value(self.value)))
+
+    def __getstate__(self):
+        """
+        Get the state of the dialogue Act Item, for pickling and copying.
+
+        :return: a dictionary with the item's attributes
+        """
+
+        return {'slot': self.slot, 'op': self.op, 'value': self.value}
+
+    def __setstate__(self, state):
+        """
+        Restore the state of the dialogue Act Item. This also accepts items
+        pickled before they had __slots__.
+
+        :param state: a dictionary with the item's attributes
+        :return: nothing
+        """
+
+        self.slot = state['slot']
+        self.op = state['op']
+        self.value = state['value']
+
     def __str__(self):
         """
         Pretty print dialogue Act Item.
@@ -189,6 +298,117 @@ class DialogueActItem:
         return result
 
 
+def freeze_value(value):
+    """
+    Get a hashable version of a dialogue act item value (values may be lists,
+    e.g. when a slot has multiple values).
+
+    :param value: the value
+    :return: the value, with lists, sets, and dictionaries converted to tuples
+    """
+
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze_value(v) for v in value)
+
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted((freeze_value(v) for v in value), key=str))
+
+    if isinstance(value, dict):
+        return tuple(sorted(((k, freeze_value(v)) for k, v in value.items()),
+                            key=str))
+
+    return value
+
+
+"""
+The FrozenDialogueAct is an immutable, interned version of a DialogueAct: its 
+params are (slot, operator, value) tuples in canonical order and equal acts are 
+the same object, so they can be compared by identity and hashed in constant 
+time (e.g. to be used as dictionary keys).
+"""
+
+
+class FrozenDialogueAct:
+    __slots__ = ('intent', 'params', 'hash', '__weakref__')
+
+    # Acts that are currently in use, keyed by (intent, params)
+    interned = WeakValueDictionary()
+
+    def __new__(cls, intent, params=()):
+        """
+        Get the interned dialogue act with the given intent and params,
+        creating it if it does not exist.
+
+        :param intent: the dialogue act's intent
+        :param params: DialogueActItems or (slot, operator, value) tuples
+        :return: a FrozenDialogueAct
+        """
+
+        params = cls.canonical_params(params)
+        key = (intent, params)
+
+        act = cls.interned.get(key)
+        if act is None:
+            act = super(FrozenDialogueAct, cls).__new__(cls)
+            object.__setattr__(act, 'intent', intent)
+            object.__setattr__(act, 'params', params)
+            object.__setattr__(act, 'hash', hash(key))
+            cls.interned[key] = act
+
+        return act
+
+    @staticmethod
+    def canonical_params(params):
+        """
+        Convert params into unique (slot, operator, value) tuples, sorted by
+        slot, operator, and value.
+
+        :param params: DialogueActItems or (slot, operator, value) tuples
+        :return: a tuple of (slot, operator, value) tuples
+        """
+
+        items = set()
+        for param in params:
+            if isinstance(param, DialogueActItem):
+                param = (param.slot, param.op, param.value)
+
+            slot, op, value = param
+            items.add((slot, op, freeze_value(value)))
+
+        return tuple(sorted(items,
+                            key=lambda i: (i[0], i[1].value, str(i[2]))))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('FrozenDialogueAct is immutable')
+
+    def __hash__(self):
+        return self.hash
+
+    def __reduce__(self):
+        # Intern again when unpickling or copying
+        return FrozenDialogueAct, (self.intent, self.params)
+
+    def __str__(self):
+        """
+        Pretty print the frozen dialogue Act.
+
+        :return: string representation of the dialogue Act
+        """
+
+        return str(self.thaw())
+
+    def thaw(self):
+        """
+        Get a (mutable) DialogueAct equal to this act.
+
+        :return: a DialogueAct
+        """
+
+        return DialogueAct(self.intent,
+                           [DialogueActItem(slot, op, value)
+                            for slot, op, value in self.params])
+
+
 """
 The Expression class models complex expressions and defines how to compute 
 them.
@@ -12,7 +12,7 @@ limitations under the License.
 __author__ = "Alexandros Papangelis"
 
 from abc import ABC, abstractmethod
-from copy import deepcopy
+from copy import copy, deepcopy
 
 """
 State models the internal state of a Conversational Agent. It is the abstract 
@@ -24,6 +24,69 @@ by the dialogue_state_tracker.
 
 class State(ABC):
 
+    # Attributes that the dialogue_state_tracker modifies in place. Snapshots
+    # share these with the live State, which copies them before modifying them
+    # (see writable()). If None, snapshots are deep copies of the State.
+    COPY_ON_WRITE_FIELDS = None
+
+    # Attributes that other components may modify in place, so they are copied
+    # every time a snapshot is taken.
+    SNAPSHOT_COPY_FIELDS = ()
+
+    def snapshot(self):
+        """
+        Get a read-only copy of the State (e.g. to record it). All attributes
+        are shared with the live State, except for the SNAPSHOT_COPY_FIELDS,
+        so a snapshot only costs as much as what changes after it is taken.
+
+        :return: a copy of the State that should not be modified
+        """
+
+        if self.COPY_ON_WRITE_FIELDS is None:
+            return deepcopy(self)
+
+        state_snapshot = copy(self)
+
+        for field in self.SNAPSHOT_COPY_FIELDS:
+            setattr(state_snapshot, field, deepcopy(getattr(self, field)))
+
+        self.shared_fields = set(self.COPY_ON_WRITE_FIELDS)
+        state_snapshot.shared_fields = set(self.COPY_ON_WRITE_FIELDS)
+
+        return state_snapshot
+
+    def writable(self, field):
+        """
+        Get an attribute of the State in order to modify it in place. If the
+        attribute is shared with a snapshot, it is copied first.
+
+        :param field: the name of the attribute
+        :return: the attribute's value, owned by this State
+        """
+
+        value = getattr(self, field)
+        shared_fields = getattr(self, 'shared_fields', None)
+
+        if shared_fields and field in shared_fields:
+            value = deepcopy(value)
+            setattr(self, field, value)
+            shared_fields.discard(field)
+
+        return value
+
+    def __getstate__(self):
+        """
+        Get the attributes of the State, for pickling and copying. Equal
+        States pickle to the same bytes, regardless of what they share.
+
+        :return: a dictionary with the State's attributes
+        """
+
+        state = dict(self.__dict__)
+        state.pop('shared_fields', None)
+
+        return state
+
     @abstractmethod
     def initialize(self):
         """
@@ -78,6 +141,12 @@ class DialogueState(State):
 
 
 class SlotFillingDialogueState(DialogueState):
+    COPY_ON_WRITE_FIELDS = ('slots_filled', 'item_in_focus')
+
+    # The user goal is modified by the user simulator and may be shared
+    # between agents
+    SNAPSHOT_COPY_FIELDS = ('user_goal',)
+
     def __init__(self, args):
         """
         Initialize the Slot Filling dialogue State internal structures
@@ -118,6 +187,9 @@ class SlotFillingDialogueState(DialogueState):
         # NOTE: This should ONLY be used if an agent plays the role of a user
         self.user_goal = None
 
+        # Attributes shared with snapshots of this state
+        self.shared_fields = set()
+
     def __str__(self):
         """
         Print the Slot Filling dialogue State
@@ -168,6 +240,9 @@ class SlotFillingDialogueState(DialogueState):
         else:
             self.user_goal = None
 
+        # All attributes have been replaced, so nothing is shared anymore
+        self.shared_fields = set()
+
     def is_terminal(self):
         """
         Check if this state is terminal
@@ -18,6 +18,8 @@ import json
 import yaml
 import os
 import string
+import time
+from itertools import islice
 
 """
 This script creates an domain .json file and an SQL .db file, given a .csv or
@@ -29,6 +31,8 @@ the primary key of the .db file.
 
 
 class CreateSQLiteDB:
+    # Modifications of a table that make its statistics catalog out of date
+    STATISTICS_EVENTS = ['INSERT', 'UPDATE', 'DELETE']
 
     def create_sql_connection(self, db_file):
         """
@@ -98,18 +102,193 @@ class CreateSQLiteDB:
         with open(ontol_name, 'w') as ontology_file:
             json.dump(ontology, ontology_file, separators=(',', ':'), indent=4)
 
-    def check_float(self, number):
+    def create_indexes(self, sql_conn, tab_name, slots,
+                       composite_indexes=None):
         """
-        Checks to see if number is float or not
+        This function creates an index for each of the given slots, as well as
+        composite indexes for the given groups of slots, so that database
+        lookups do not need to scan the whole table.
 
-        :param number: the number to check
-        :return: True or False
+        :param sql_conn: an sql connection
+        :param tab_name: the table name
+        :param slots: a list of slots to index (usually the informable ones)
+        :param composite_indexes: a list of lists of slots, each of which will
+                                  get a composite index
+        :return: nothing
+        """
+
+        cursor = sql_conn.cursor()
+
+        for slot in slots:
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS '
+                           f'"idx_{tab_name}_{slot}" '
+                           f'ON "{tab_name}" ("{slot}");')
+
+        for index_slots in composite_indexes or []:
+            if len(index_slots) < 2:
+                continue
+
+            columns = ', '.join(f'"{slot}"' for slot in index_slots)
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS '
+                           f'"idx_{tab_name}_{"_".join(index_slots)}" '
+                           f'ON "{tab_name}" ({columns});')
+
+        # Gather statistics so that SQLite picks the best index per query
+        cursor.execute('ANALYZE;')
+        sql_conn.commit()
+
+    def create_fts_index(self, sql_conn, tab_name, slots):
         """
+        This function creates an FTS5 index for the given slots, so that
+        substring queries (e.g. LIKE '%x%' from slot queries) do not need to
+        scan the whole table. The index uses the trigram tokenizer and
+        external content, i.e. it does not store a copy of the data.
+
+        :param sql_conn: an sql connection
+        :param tab_name: the table name
+        :param slots: a list of slots to index
+        :return: nothing
+        """
+
+        if not slots:
+            return
+
+        fts_name = tab_name + '_fts'
+        columns = ', '.join(f'"{slot}"' for slot in slots)
+        cursor = sql_conn.cursor()
+
         try:
-            float(number)
-            return True
-        except ValueError:
-            return False
+            cursor.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS "{fts_name}" '
+                           f'USING fts5({columns}, content=\'{tab_name}\', '
+                           f'content_rowid=\'rowid\', '
+                           f'tokenize=\'trigram\');')
+            cursor.execute(f'INSERT INTO "{fts_name}"("{fts_name}") '
+                           f'VALUES(\'rebuild\');')
+            sql_conn.commit()
+
+        except Error as err:
+            print(f'Warning! CreateSQLiteDB could not create FTS5 index for '
+                  f'{slots} ({err}). Slot queries will scan the table.')
+
+    def create_statistics(self, sql_conn, tab_name):
+        """
+        This function writes a statistics catalog into the database, so that
+        dialogue components can get the number of items, the column names,
+        and the distinct values of each slot (and how many items have each
+        value) without scanning the table (see SQLDataBase). It creates two
+        tables:
+
+        <tab_name>_statistics: the number of items, the largest row id, the
+        column names (as json), and the number of rows inserted, updated, or
+        deleted since the catalog was created
+
+        <tab_name>_value_counts: the slot, value, number of items with the
+        value, and row id of the first such item, for every value of every
+        slot
+
+        The number of changes is kept by triggers on the table, so that a
+        catalog that is out of date is not used. The catalog must then be
+        created again (e.g. by SQLDataBase.rebuild_statistics).
+
+        :param sql_conn: an sql connection
+        :param tab_name: the table name
+        :return: nothing
+        """
+
+        stats_name = tab_name + '_statistics'
+        counts_name = tab_name + '_value_counts'
+        cursor = sql_conn.cursor()
+
+        cursor.execute(f'SELECT * FROM "{tab_name}" LIMIT 0;')
+        column_names = [i[0] for i in cursor.description]
+
+        cursor.execute(f'DROP TABLE IF EXISTS "{stats_name}";')
+        cursor.execute(f'DROP TABLE IF EXISTS "{counts_name}";')
+
+        cursor.execute(f'CREATE TABLE "{stats_name}" (item_count INTEGER, '
+                       f'max_rowid INTEGER, column_names TEXT, '
+                       f'changes INTEGER);')
+        cursor.execute(f'CREATE TABLE "{counts_name}" (slot TEXT, value, '
+                       f'count INTEGER, first_rowid INTEGER, '
+                       f'PRIMARY KEY (slot, first_rowid)) WITHOUT ROWID;')
+
+        cursor.execute(f'INSERT INTO "{stats_name}" '
+                       f'SELECT COUNT(*), MAX(rowid), ?, 0 '
+                       f'FROM "{tab_name}";',
+                       (json.dumps(column_names),))
+
+        for event in self.STATISTICS_EVENTS:
+            trigger_name = f'{stats_name}_{event.lower()}'
+
+            cursor.execute(f'DROP TRIGGER IF EXISTS "{trigger_name}";')
+            cursor.execute(f'CREATE TRIGGER "{trigger_name}" '
+                           f'AFTER {event} ON "{tab_name}" BEGIN '
+                           f'UPDATE "{stats_name}" '
+                           f'SET changes = changes + 1; END;')
+
+        for slot in column_names:
+            cursor.execute(f'INSERT INTO "{counts_name}" '
+                           f'SELECT ?, "{slot}", COUNT(*), MIN(rowid) '
+                           f'FROM "{tab_name}" GROUP BY "{slot}";',
+                           (slot,))
+
+        sql_conn.commit()
+
+    def clean_entry(self, entry, punctuation_remover, quote_remover):
+        """
+        Cleans the values of a data file row in a single pass: numbers are
+        rounded to one decimal digit, non-ascii characters, quotes and
+        punctuation are removed, values are lower-cased and empty values are
+        replaced by 'None'.
+
+        :param entry: a list of values (a row of the data file)
+        :param punctuation_remover: translation table that removes punctuation
+        :param quote_remover: translation table that removes quotes
+        :return: a tuple with the cleaned values
+        """
+
+        cleaned = []
+
+        for value in entry:
+            # Round to one decimal digit
+            try:
+                value = str(round(float(value), 1))
+            except ValueError:
+                pass
+
+            # Remove non-ascii characters and quotes
+            value = value.encode('ascii', 'ignore').decode('ascii')
+            value = value.translate(quote_remover)
+
+            # Remove punctuation
+            value = value.rstrip().lower().translate(punctuation_remover)
+
+            # Replace empty values with None
+            # Put an actual string here so the slot entropy calculation can
+            # take the absence of values into account
+            cleaned.append(value if value else 'None')
+
+        return tuple(cleaned)
+
+    def set_bulk_load_pragmas(self, sql_conn, pragmas):
+        """
+        Sets the given pragmas (e.g. journal_mode, synchronous) on the
+        connection and returns their previous values, so that they can be
+        restored once loading is done.
+
+        :param sql_conn: an sql connection
+        :param pragmas: a dictionary of pragma names and values
+        :return: a dictionary with the previous pragma values
+        """
+
+        cursor = sql_conn.cursor()
+        previous = {}
+
+        for pragma, value in pragmas.items():
+            previous[pragma] = cursor.execute(f'PRAGMA {pragma};').fetchone()[0]
+            cursor.execute(f'PRAGMA {pragma} = {value};')
+
+        return previous
 
     def arg_parse(self, cfg_filename):
         """
@@ -186,112 +365,132 @@ def run(config):
             system_requestable_slots = \
                 args['ONTOLOGY']['system_requestable_slots']
 
-    column_names = []
+    create_indexes = True
+    composite_indexes = None
+    fts_slots = []
+
+    if 'INDEXES' in args and args['INDEXES']:
+        if 'create_indexes' in args['INDEXES']:
+            create_indexes = bool(args['INDEXES']['create_indexes'])
+
+        if 'composite_indexes' in args['INDEXES']:
+            composite_indexes = args['INDEXES']['composite_indexes']
+
+        if 'fts_slots' in args['INDEXES']:
+            fts_slots = args['INDEXES']['fts_slots']
+
+    batch_size = args['GENERAL'].get('batch_size', 10000)
 
     MAX_DB_ENTRIES = -1
 
     delim = '\t' if csv_filename.split('.')[1] == 'tsv' else ','
 
+    punctuation = string.punctuation.replace('$', '')
+    punctuation = punctuation.replace('-', '')
+    punctuation = punctuation.replace('_', '')
+    punctuation = punctuation.replace('.', '')
+    punctuation = punctuation.replace('&', '')
+    punctuation_remover = str.maketrans('', '', punctuation)
+    quote_remover = str.maketrans('', '', '\'"')
+
+    # Create a database connection
+    conn = db_creator.create_sql_connection(db_name)
+
+    if conn is None:
+        raise ValueError('Error! cannot create the database connection.')
+
     # Read csv entries and create items
     with open(csv_filename) as csv_input:
         csv_reader = csv.reader(csv_input, delimiter=delim)
 
-        for entry in csv_reader:
-            column_names = entry
+        # First row contains the column names
+        column_names = next(csv_reader)
 
-            if not informable_slots:
-                # Skip the primary key (first column by default)
-                informable_slots = column_names[1:]
+        if not informable_slots:
+            # Skip the primary key (first column by default)
+            informable_slots = column_names[1:]
 
-            if not requestable_slots:
-                requestable_slots = column_names[1:]
+        if not requestable_slots:
+            requestable_slots = column_names[1:]
 
-            if not system_requestable_slots:
-                system_requestable_slots = column_names[1:]
+        if not system_requestable_slots:
+            system_requestable_slots = column_names[1:]
 
-            break
+        # Warning! This treats all entries as strings by default
+        sqlcmd_create_table = 'CREATE TABLE IF NOT EXISTS ' + \
+                              table_name + '(' + column_names[0] + \
+                              ' text PRIMARY KEY,' + \
+                              ' text,'.join(
+                                  [column_names[c]
+                                   for c in range(1, len(column_names))]) \
+                              + ');'
 
-    # Warning! This treats all entries as strings by default
-    sqlcmd_create_table = 'CREATE TABLE IF NOT EXISTS ' + \
-                          table_name + '(' + column_names[0] + \
-                          ' text PRIMARY KEY,' + \
-                          ' text,'.join(
-                              [column_names[c]
-                               for c in range(1, len(column_names))]) \
-                          + ');'
+        sql_cmd = 'INSERT INTO ' + table_name + \
+                  '(' + ','.join(column_names) + ')' + \
+                  ' VALUES(' + ','.join(['?'] * len(column_names)) + ')'
 
-    # Create a database connection
-    conn = db_creator.create_sql_connection(db_name)
-    with conn:
-        if conn is not None:
-            # Create the table
-            db_creator.create_sql_table(conn, sqlcmd_create_table)
+        # Create the table
+        db_creator.create_sql_table(conn, sqlcmd_create_table)
 
-        else:
-            print("Error! cannot create the database connection.")
-
-        # Read csv entries and create items
-        with open(csv_filename) as csv_input:
-            csv_reader = csv.reader(csv_input, delimiter=delim)
-            first_entry = True
-
-            punctuation = string.punctuation.replace('$', '')
-            punctuation = punctuation.replace('-', '')
-            punctuation = punctuation.replace('_', '')
-            punctuation = punctuation.replace('.', '')
-            punctuation = punctuation.replace('&', '')
-            punctuation_remover = str.maketrans('', '', punctuation)
-
-            print('Populating database ')
-            entries_count = 1
-
-            for entry in csv_reader:
-                # Discard first entry (column names)
-                if first_entry:
-                    first_entry = False
-
-                else:
-                    # Create item
-                    sql_cmd = \
-                        "INSERT INTO " + table_name + '(' + \
-                        ','.join([c for c in column_names]) + ')' + \
-                        " VALUES(" + ','.join(
-                            ['?' for c in column_names]) + \
-                        ')'
-
-                    # Round to one decimal digit
-                    entry = [str(round(float(e), 1)) if
-                             db_creator.check_float(e) else e for e in entry]
-
-                    # Remove non-ascii characters
-                    entry = \
-                        [str(''.join(i for i in e if
-                                     ord(i) < 128)).replace('\"', '')
-                         for e in entry]
-                    entry = [e.replace('\'', '') for e in entry]
-
-                    # Remove punctuation
-                    entry = [e.rstrip().lower().translate(punctuation_remover)
-                             for e in entry]
-
-                    # Replace empty values with None
-                    # Put an actual string here so the slot entropy
-                    # calculation can take
-                    # the absence of values into account
-                    entry = [e if e else 'None' for e in entry]
-
-                    cur = conn.cursor()
-                    cur.execute(sql_cmd, tuple(entry))
-
-                    entries_count += 1
-                    if entries_count % 10000 == 0:
-                        print(f'(added {entries_count} entries)')
-
-                    if 0 < MAX_DB_ENTRIES <= entries_count:
-                        break
-
-    print(f'{table_name} database created with {entries_count} items!\n'
-          f'Creating ontology...')
+        # Nothing needs to survive a crash while the database is being built,
+        # so skip the rollback journal and fsyncs until loading is done.
+        prev_pragmas = \
+            db_creator.set_bulk_load_pragmas(conn,
+                                             {'journal_mode': 'MEMORY',
+                                              'synchronous': 'OFF'})
+
+        entries = (db_creator.clean_entry(entry,
+                                          punctuation_remover,
+                                          quote_remover)
+                   for entry in csv_reader)
+
+        if MAX_DB_ENTRIES > 0:
+            entries = islice(entries, MAX_DB_ENTRIES)
+
+        print('Populating database ')
+        entries_count = 0
+        start_time = time.time()
+
+        # Insert all items in a single transaction
+        with conn:
+            cur = conn.cursor()
+
+            while True:
+                batch = list(islice(entries, batch_size))
+
+                if not batch:
+                    break
+
+                cur.executemany(sql_cmd, batch)
+
+                entries_count += len(batch)
+                elapsed = max(time.time() - start_time, 1e-6)
+                print(f'(added {entries_count} entries, '
+                      f'{entries_count / elapsed:.0f} entries/sec)')
+
+        db_creator.set_bulk_load_pragmas(conn, prev_pragmas)
+
+    print(f'{table_name} database created with {entries_count} items '
+          f'in {time.time() - start_time:.2f} seconds!')
+
+    if create_indexes:
+        print('Creating indexes...')
+
+        if composite_indexes is None:
+            # Default to one composite index over all informable slots
+            composite_indexes = [informable_slots]
+
+        db_creator.create_indexes(conn, table_name, informable_slots,
+                                  composite_indexes)
+
+    if fts_slots:
+        print('Creating FTS5 indexes...')
+        db_creator.create_fts_index(conn, table_name, fts_slots)
+
+    print('Creating statistics catalog...')
+    db_creator.create_statistics(conn, table_name)
+
+    print('Creating ontology...')
 
     db_creator.create_ontology(conn, table_name, ontology_name,
                                informable_slots, requestable_slots,
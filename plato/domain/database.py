@@ -13,10 +13,19 @@ limitations under the License.
 __author__ = "Alexandros Papangelis"
 
 from abc import abstractmethod
+from collections import OrderedDict
 
+import json
+import math
+import mmap
 import os.path
+import re
 import sqlite3
 
+import numpy as np
+
+from plato.domain.create_domain_sqlite_db import CreateSQLiteDB
+
 """
 DataBase is the abstract parent class for all DataBase classes and defines the 
 interface that should be followed.
@@ -24,9 +33,13 @@ interface that should be followed.
 SQLDataBase is an implementation of a DataBase class that can interface with 
 SQL databases.
 
+ColumnarDataBase is an implementation of a DataBase class that loads a 
+(read-only) SQL database table in memory once per process and answers queries 
+by intersecting the rows of the constrained slot values.
+
 JSONDataBase is an implementation of a DataBase class that can interface with 
 JSON databases (i.e. databases represented
-as .json files).
+as .json or .jsonl files).
 """
 
 
@@ -51,11 +64,12 @@ class DataBase:
                              % filename)
 
     @abstractmethod
-    def db_lookup(self, dialogue_state):
+    def db_lookup(self, dialogue_state, MAX_DB_RESULTS=None):
         """
         Perform a database query.
 
         :param dialogue_state: the current dialogue state
+        :param MAX_DB_RESULTS: upper limit for results to be returned
         :return: result of the query
         """
         pass
@@ -69,8 +83,188 @@ class DataBase:
 
         pass
 
+    @abstractmethod
+    def get_item_count(self):
+        """
+        Return the number of items in the database
+        :return: the number of items
+        """
+
+        pass
+
+    @abstractmethod
+    def get_slot_names(self):
+        """
+        Return the names of the slots (columns) of the database
+        :return: a list of slot names
+        """
+
+        pass
+
+    @abstractmethod
+    def get_item(self, rowid):
+        """
+        Return an item of the database
+
+        :param rowid: the (1-based) row id of the item
+        :return: a dictionary (slot: value) or None if there is no such item
+        """
+
+        pass
+
+    @abstractmethod
+    def get_slot_values(self, slot):
+        """
+        Return the distinct values of a slot, in the order they first appear
+        in the database
+
+        :param slot: the slot
+        :return: a list of values
+        """
+
+        pass
+
+    def has_statistics(self):
+        """
+        Check if the item count and the slot values of the database can be
+        read without scanning it (e.g. because they are kept in memory)
+
+        :return: True or False
+        """
+
+        return False
+
+    @staticmethod
+    def get_query_constraints(DState):
+        """
+        Extract the constraints and queries of a dialogue state. Constraints
+        are sorted so that equivalent states map to the same compiled query,
+        while queries keep their order as their operators depend on it.
+
+        :param DState: the current dialogue state
+        :return: a tuple of (slot, value) constraints and a tuple of
+                 (slot, ((query, operator), ...)) queries
+        """
+
+        constraints = tuple(sorted(
+            (slot, value) for slot, value in DState.slots_filled.items()
+            if value and value != 'dontcare'))
+
+        queries = tuple(
+            (slot, tuple((q[0], q[1]) for q in slot_queries))
+            for slot, slot_queries in DState.slot_queries.items()
+            if slot_queries)
+
+        return constraints, queries
+
+    def get_slot_value_counts(self, dialogue_state, slots):
+        """
+        Count how many times each value of the given slots appears in the
+        results of the query for the given dialogue state. Values are listed
+        in the order they first appear in the results.
+
+        Subclasses should override this to avoid retrieving all the results.
+
+        :param dialogue_state: the current dialogue state
+        :param slots: the slots to count values for
+        :return: a dictionary of slot: {value: count}
+        """
+
+        value_counts = {slot: {} for slot in slots}
+
+        for db_item in self.db_lookup(dialogue_state) or []:
+            for slot in slots:
+                value_counts[slot][db_item[slot]] = \
+                    value_counts[slot].get(db_item[slot], 0) + 1
+
+        return value_counts
+
+    def get_slot_entropies(self, dialogue_state, slots):
+        """
+        Calculate the entropy of the values of the given slots in the
+        results of the query for the given dialogue state.
+
+        :param dialogue_state: the current dialogue state
+        :param slots: the slots to calculate entropies for
+        :return: a dictionary of slot: entropy
+        """
+
+        value_counts = self.get_slot_value_counts(dialogue_state, slots)
+
+        return {slot: self.entropy(value_counts[slot]) for slot in slots}
+
+    @staticmethod
+    def entropy(value_counts):
+        """
+        Calculate the entropy of a distribution given its value counts.
+
+        :param value_counts: a dictionary of value: count
+        :return: the entropy
+        """
+
+        total = sum(value_counts.values())
+        entropy = 0
+
+        for count in value_counts.values():
+            probability = count / total
+            entropy += probability * math.log(probability)
+
+        return -entropy
+
+    @staticmethod
+    def like_pattern(query):
+        """
+        Compile the equivalent of SQL's LIKE '%query%' (i.e. case insensitive
+        substring match, with % and _ as wildcards) into a regular expression.
+
+        :param query: the value to look for
+        :return: a compiled regular expression
+        """
+
+        pattern = ''.join('.*' if c == '%' else '.' if c == '_'
+                          else re.escape(c) for c in query)
+
+        return re.compile(pattern, re.IGNORECASE | re.DOTALL)
+
+    @staticmethod
+    def combine_query_matches(queries, get_matches):
+        """
+        Combine the matches of slot queries the way SQLDataBase does, i.e.
+        each query's operator joins it to the previous query and AND binds
+        tighter than OR.
+
+        :param queries: (slot, ((query, operator), ...)) tuples
+        :param get_matches: function that returns the matches (a set or a
+                            boolean array) of a slot and a query
+        :return: the combined matches, or None if there are no queries
+        """
+
+        matches = None
+        group_matches = None
+
+        for slot, slot_queries in queries:
+            for query, op in slot_queries:
+                query_matches = get_matches(slot, query)
+
+                if group_matches is None:
+                    group_matches = query_matches
+                elif str(op).upper() == 'OR':
+                    matches = group_matches if matches is None \
+                        else matches | group_matches
+                    group_matches = query_matches
+                else:
+                    group_matches = group_matches & query_matches
+
+        if matches is None:
+            return group_matches
+
+        return matches | group_matches
+
 
 class SQLDataBase(DataBase):
+    # Maximum number of constraint sets to cache slot value counts for
+    MAX_CACHED_COUNTS = 1024
+
     def __init__(self, filename):
         """
         Initialize the internal structures of the SQL parser Base
@@ -81,6 +275,23 @@ class SQLDataBase(DataBase):
 
         self.SQL_connection = None
         self.db_table_name = None
+        self.db_column_names = []
+
+        # Slots that have an FTS5 index (see CreateSQLiteDB.create_fts_index)
+        self.db_fts_table_name = None
+        self.db_fts_column_names = []
+
+        # Tables of the statistics catalog (see
+        # CreateSQLiteDB.create_statistics), and the statistics read from it
+        self.db_statistics_table_name = None
+        self.db_value_counts_table_name = None
+        self.statistics = None
+
+        # Compiled SQL statements, keyed by the slots they constrain
+        self.compiled_queries = {}
+
+        # Slot value counts, keyed by constraints (least recently used first)
+        self.slot_value_counts = OrderedDict()
 
         if isinstance(filename, str):
             if os.path.isfile(filename):
@@ -100,6 +311,35 @@ class SQLDataBase(DataBase):
                         'database {0}'.format(
                             self.db_file_name))
 
+                cursor.execute(f'SELECT * FROM "{self.db_table_name}" '
+                               f'LIMIT 0;')
+                self.db_column_names = [i[0] for i in cursor.description]
+
+                fts_table_name = self.db_table_name + '_fts'
+                if cursor.execute("select * from sqlite_master "
+                                  "where type = 'table' and name = ?;",
+                                  (fts_table_name,)).fetchall():
+                    try:
+                        cursor.execute(f'SELECT * FROM "{fts_table_name}" '
+                                       f'LIMIT 0;')
+                        self.db_fts_table_name = fts_table_name
+                        self.db_fts_column_names = \
+                            [i[0] for i in cursor.description]
+
+                    except sqlite3.Error as err:
+                        print(f'Warning! SQLDataBase cannot use FTS5 index '
+                              f'{fts_table_name} ({err}).')
+
+                statistics_table_name = self.db_table_name + '_statistics'
+                value_counts_table_name = self.db_table_name + '_value_counts'
+                if len(cursor.execute(
+                        "select * from sqlite_master "
+                        "where type = 'table' and name in (?, ?);",
+                        (statistics_table_name,
+                         value_counts_table_name)).fetchall()) == 2:
+                    self.db_statistics_table_name = statistics_table_name
+                    self.db_value_counts_table_name = value_counts_table_name
+
             else:
                 raise FileNotFoundError('Database file %s not found'
                                         % filename)
@@ -107,68 +347,384 @@ class SQLDataBase(DataBase):
             raise ValueError('Unacceptable value for database file name: %s '
                              % filename)
 
-    def db_lookup(self, DState, MAX_DB_RESULTS=None):
+    def db_lookup(self, DState, MAX_DB_RESULTS=None, lazy=False):
         """
-        Perform an SQL query
+        Perform an SQL query. The query is compiled once for each combination
+        of constrained and queried slots and then executed as a parameterized
+        statement, so that SQLite can reuse the prepared statement.
 
         :param DState: the current dialogue state
-        :param MAX_DB_RESULTS: upper limit for results to be returned
+        :param MAX_DB_RESULTS: upper limit for results to be returned (pushed
+                               down to the query as a LIMIT)
+        :param lazy: if True, return a generator over the results instead of
+                     a list
         :return: the results of the SQL query
         """
-        # Query the database
-        cursor = self.SQL_connection.cursor()
-        sql_command = " SELECT * FROM " + self.db_table_name + " "
 
-        args = ''
-        prev_arg = False
-        prev_query_arg = False
+        constraints, queries = self.get_query_constraints(DState)
+        sql_command, params = \
+            self.compile_query(constraints, queries, MAX_DB_RESULTS)
+
+        cursor = self.SQL_connection.execute(sql_command, params)
+
+        if lazy:
+            return self.iterate_results(cursor)
+
+        return list(self.iterate_results(cursor))
+
+    def compile_query(self, constraints, queries, MAX_DB_RESULTS=None):
+        """
+        Get the parameterized SQL statement for the given constraints and
+        queries, compiling it if this combination of slots has not been seen
+        before.
+
+        :param constraints: (slot, value) tuples, as returned by
+                            get_query_constraints
+        :param queries: (slot, ((query, operator), ...)) tuples, as returned
+                        by get_query_constraints
+        :param MAX_DB_RESULTS: upper limit for results to be returned
+        :return: the SQL statement and its parameters
+        """
+
+        shape = self.get_query_shape(constraints, queries) + \
+            (bool(MAX_DB_RESULTS),)
+
+        if shape not in self.compiled_queries:
+            self.compiled_queries[shape] = self.build_query(*shape)
+
+        params = self.get_query_params(constraints, queries)
+
+        if MAX_DB_RESULTS:
+            params.append(MAX_DB_RESULTS)
+
+        return self.compiled_queries[shape], params
+
+    @staticmethod
+    def get_query_shape(constraints, queries):
+        """
+        Values are bound as parameters, so only the slots and the query
+        operators determine the SQL statement.
+
+        :param constraints: (slot, value) tuples
+        :param queries: (slot, ((query, operator), ...)) tuples
+        :return: a tuple of constrained slots and a tuple of
+                 (slot, (operator, ...)) queried slots
+        """
+
+        return (tuple(slot for slot, _ in constraints),
+                tuple((slot, tuple(op for _, op in slot_queries))
+                      for slot, slot_queries in queries))
+
+    @staticmethod
+    def get_query_params(constraints, queries):
+        """
+        Get the parameters to bind to a compiled SQL statement.
 
-        # Impose constraints
-        for slot in DState.slots_filled:
-            if DState.slots_filled[slot] and DState.slots_filled[slot] != \
-                    'dontcare':
-                if prev_arg:
-                    args += " AND "
+        :param constraints: (slot, value) tuples
+        :param queries: (slot, ((query, operator), ...)) tuples
+        :return: a list of parameters
+        """
+
+        params = [value for _, value in constraints]
+
+        for _, slot_queries in queries:
+            params += ['%' + query + '%' for query, _ in slot_queries]
+
+        return params
+
+    def build_query(self, constraint_slots, query_slots, limit):
+        """
+        Build the SQL statement for the given slots.
+
+        :param constraint_slots: slots that need to be equal to a value
+        :param query_slots: (slot, (operator, ...)) tuples for slots that need
+                            to contain a value
+        :param limit: whether to limit the number of results
+        :return: the SQL statement
+        """
 
-                args += slot + " = \"" + DState.slots_filled[slot] + "\""
-                prev_arg = True
+        sql_command = f'SELECT * FROM "{self.db_table_name}"' + \
+            self.build_where_clause(constraint_slots, query_slots)
+
+        # Keep the table's order regardless of which index SQLite picks
+        sql_command += ' ORDER BY rowid'
+
+        if limit:
+            sql_command += ' LIMIT ?'
+
+        return sql_command + ';'
+
+    def build_count_query(self, constraint_slots, query_slots, slot):
+        """
+        Build the SQL statement that counts the values of a slot for the given
+        constraints. Values are ordered by their first appearance in the
+        table, as if they were counted over the results of build_query.
+
+        :param constraint_slots: slots that need to be equal to a value
+        :param query_slots: (slot, (operator, ...)) tuples for slots that need
+                            to contain a value
+        :param slot: the slot whose values to count
+        :return: the SQL statement
+        """
 
-        # Impose queries
-        if prev_arg and DState.slot_queries:
-            args += " AND ("
+        if slot not in self.db_column_names:
+            raise ValueError(f'SQLDataBase: Unknown slot {slot} for '
+                             f'table {self.db_table_name}')
 
-        for slot in DState.slot_queries:
-            for slot_query in DState.slot_queries[slot]:
-                query = slot_query[0]
-                op = slot_query[1]
+        return f'SELECT "{slot}", COUNT(*) FROM "{self.db_table_name}"' + \
+            self.build_where_clause(constraint_slots, query_slots) + \
+            f' GROUP BY "{slot}" ORDER BY MIN(rowid);'
 
+    def build_where_clause(self, constraint_slots, query_slots):
+        """
+        Build the WHERE clause for the given slots.
+
+        :param constraint_slots: slots that need to be equal to a value
+        :param query_slots: (slot, (operator, ...)) tuples for slots that need
+                            to contain a value
+        :return: the WHERE clause (empty if there are no constraints)
+        """
+
+        for slot in constraint_slots + tuple(s for s, _ in query_slots):
+            if slot not in self.db_column_names:
+                raise ValueError(f'SQLDataBase: Unknown slot {slot} for '
+                                 f'table {self.db_table_name}')
+
+        args = [f'"{slot}" = ?' for slot in constraint_slots]
+
+        query_args = ''
+        prev_query_arg = False
+
+        for slot, ops in query_slots:
+            for op in ops:
                 if prev_query_arg:
-                    args += f" {op} "
+                    query_args += f' {op} '
 
-                args += slot + " LIKE \'%" + query + "%\' "
+                if slot in self.db_fts_column_names:
+                    query_args += \
+                        f'rowid IN (SELECT rowid FROM ' \
+                        f'"{self.db_fts_table_name}" WHERE "{slot}" LIKE ?)'
+                else:
+                    query_args += f'"{slot}" LIKE ?'
                 prev_query_arg = True
 
-        if prev_arg and DState.slot_queries:
-            args += " ) "
+        if query_args:
+            args.append('(' + query_args + ')')
 
         if args:
-            sql_command += " WHERE " + args + ";"
+            return ' WHERE ' + ' AND '.join(args)
 
-        cursor.execute(sql_command)
-        db_result = cursor.fetchall()
+        return ''
 
-        result = []
+    def get_slot_value_counts(self, dialogue_state, slots):
+        """
+        Count the values of the given slots with SQL aggregates, without
+        retrieving the results. Counts are cached per set of constraints, so
+        the returned dictionaries should not be modified.
 
-        if db_result:
-            # Get the slot names
-            slot_names = [i[0] for i in cursor.description]
-            for db_item in db_result:
-                result.append(dict(zip(slot_names, db_item)))
+        :param dialogue_state: the current dialogue state
+        :param slots: the slots to count values for
+        :return: a dictionary of slot: {value: count}
+        """
 
-        if MAX_DB_RESULTS:
-            return result[:MAX_DB_RESULTS]
-        else:
-            return result
+        constraints, queries = self.get_query_constraints(dialogue_state)
+        key = (constraints, queries, tuple(slots))
+
+        if key in self.slot_value_counts:
+            self.slot_value_counts.move_to_end(key)
+            return self.slot_value_counts[key]
+
+        shape = self.get_query_shape(constraints, queries)
+        params = self.get_query_params(constraints, queries)
+        value_counts = {}
+
+        # Without constraints, the counts are in the statistics catalog
+        unconstrained = not constraints and not queries and \
+            self.has_statistics()
+
+        for slot in slots:
+            if unconstrained:
+                if slot not in self.db_column_names:
+                    raise ValueError(f'SQLDataBase: Unknown slot {slot} for '
+                                     f'table {self.db_table_name}')
+
+                value_counts[slot] = self.get_catalog_value_counts(slot)
+                continue
+
+            count_shape = shape + (slot,)
+
+            if count_shape not in self.compiled_queries:
+                self.compiled_queries[count_shape] = \
+                    self.build_count_query(*count_shape)
+
+            value_counts[slot] = dict(
+                self.SQL_connection.execute(
+                    self.compiled_queries[count_shape], params).fetchall())
+
+        self.slot_value_counts[key] = value_counts
+
+        if len(self.slot_value_counts) > self.MAX_CACHED_COUNTS:
+            self.slot_value_counts.popitem(last=False)
+
+        return value_counts
+
+    def get_statistics(self):
+        """
+        Read the number of items and the column names from the statistics
+        catalog, the first time they are needed. A catalog that does not
+        match the table (i.e. rows have been inserted, updated, or deleted
+        since it was created, as counted by its triggers) is not used.
+
+        :return: a dictionary with the item count and the column names, or
+                 None if the database has no (usable) statistics catalog
+        """
+
+        if self.statistics is None and self.db_statistics_table_name:
+            trigger_names = [
+                f'{self.db_statistics_table_name}_{event.lower()}'
+                for event in CreateSQLiteDB.STATISTICS_EVENTS]
+            num_triggers = self.SQL_connection.execute(
+                f'SELECT COUNT(*) FROM sqlite_master '
+                f'WHERE type = \'trigger\' AND tbl_name = ? '
+                f'AND name IN ({", ".join("?" * len(trigger_names))});',
+                [self.db_table_name] + trigger_names).fetchone()[0]
+
+            # Catalogs created without triggers cannot be trusted
+            row = None
+            if num_triggers == len(trigger_names):
+                row = self.SQL_connection.execute(
+                    f'SELECT item_count, max_rowid, column_names, changes '
+                    f'FROM "{self.db_statistics_table_name}";').fetchone()
+            max_rowid = self.SQL_connection.execute(
+                f'SELECT MAX(rowid) FROM "{self.db_table_name}";'
+            ).fetchone()[0]
+
+            if row and row[3] == 0 and row[1] == max_rowid and \
+                    json.loads(row[2]) == self.db_column_names:
+                self.statistics = {'item_count': row[0],
+                                   'column_names': json.loads(row[2])}
+
+            else:
+                print(f'Warning! SQLDataBase statistics catalog of '
+                      f'{self.db_table_name} is out of date and will not be '
+                      f'used. Call rebuild_statistics() or create the domain '
+                      f'again to update it.')
+                self.db_statistics_table_name = None
+                self.db_value_counts_table_name = None
+
+        return self.statistics
+
+    def rebuild_statistics(self):
+        """
+        Create the statistics catalog of the table again (see
+        CreateSQLiteDB.create_statistics), e.g. after the table has been
+        modified.
+
+        :return: nothing
+        """
+
+        table_name = self.db_table_name
+
+        CreateSQLiteDB().create_statistics(self.SQL_connection, table_name)
+
+        self.db_statistics_table_name = table_name + '_statistics'
+        self.db_value_counts_table_name = table_name + '_value_counts'
+        self.statistics = None
+        self.slot_value_counts.clear()
+
+    def has_statistics(self):
+        """
+        Check if the item count and the slot values can be read from the
+        statistics catalog, without scanning the table
+
+        :return: True or False
+        """
+
+        return self.get_statistics() is not None
+
+    def get_catalog_value_counts(self, slot):
+        """
+        Read the value counts of a slot over the whole table from the
+        statistics catalog.
+
+        :param slot: the slot
+        :return: a dictionary of value: count, with values in the order they
+                 first appear in the table
+        """
+
+        return dict(self.SQL_connection.execute(
+            f'SELECT value, count FROM "{self.db_value_counts_table_name}" '
+            f'WHERE slot = ? ORDER BY first_rowid;', (slot,)).fetchall())
+
+    @staticmethod
+    def iterate_results(cursor):
+        """
+        Iterate over the rows of an executed query as dictionaries.
+
+        :param cursor: a cursor that has executed a query
+        :return: a generator of dictionaries (slot: value)
+        """
+
+        slot_names = [i[0] for i in cursor.description]
+
+        for db_item in cursor:
+            yield dict(zip(slot_names, db_item))
+
+    def get_item_count(self):
+        """
+        Get the number of items in the SQL database
+
+        :return: the number of items
+        """
+
+        if self.has_statistics():
+            return self.statistics['item_count']
+
+        return self.SQL_connection.execute(
+            f'SELECT COUNT(*) FROM "{self.db_table_name}";').fetchone()[0]
+
+    def get_slot_names(self):
+        """
+        Get the names of the SQL database's columns
+
+        :return: a list of slot names
+        """
+
+        return list(self.db_column_names)
+
+    def get_item(self, rowid):
+        """
+        Get an item of the SQL database
+
+        :param rowid: the row id of the item
+        :return: a dictionary (slot: value) or None if there is no such item
+        """
+
+        cursor = self.SQL_connection.execute(
+            f'SELECT * FROM "{self.db_table_name}" WHERE rowid = ?;',
+            (rowid,))
+
+        return next(self.iterate_results(cursor), None)
+
+    def get_slot_values(self, slot):
+        """
+        Get the distinct values of a column of the SQL database, in the order
+        they first appear in the table
+
+        :param slot: the slot
+        :return: a list of values
+        """
+
+        if slot not in self.db_column_names:
+            raise ValueError(f'SQLDataBase: Unknown slot {slot} for '
+                             f'table {self.db_table_name}')
+
+        if self.has_statistics():
+            return list(self.get_catalog_value_counts(slot))
+
+        return [value for value, in self.SQL_connection.execute(
+            f'SELECT "{slot}" FROM "{self.db_table_name}" '
+            f'GROUP BY "{slot}" ORDER BY MIN(rowid);')]
 
     def get_table_name(self):
         """
@@ -191,28 +747,680 @@ class SQLDataBase(DataBase):
         return db_table_name
 
 
-class JSONDataBase(DataBase):
+class ColumnarDataBase(DataBase):
+    # Tables loaded so far, keyed by database file, shared by all instances
+    tables = {}
+
     def __init__(self, filename):
         """
-        Initializes the internal structures of the json parser Base
+        Initialize the internal structures of the columnar database. The SQL
+        database is read once per process; all ColumnarDataBase objects
+        created for the same file share the same in-memory table, which is
+        why it must not be modified.
+
+        :param filename: path to load the (SQL) database from
+        """
+
+        super(ColumnarDataBase, self).__init__(filename)
+
+        table = self.load_table(self.db_file_name)
+
+        self.db_table_name = table['table_name']
+        self.db_column_names = table['column_names']
+
+        # Row ids and their position in the columns
+        self.rowids = table['rowids']
+        self.row_index = table['row_index']
+
+        # The values of each column, the values' codes (ids) for each row,
+        # and the distinct values of each column ordered by code
+        self.columns = table['columns']
+        self.codes = table['codes']
+        self.values = table['values']
+
+        # The code of each distinct value of each column, and the rows that
+        # have each value: the rows with code c are
+        # postings[offsets[c]:offsets[c + 1]], in ascending order
+        self.value_codes = table['value_codes']
+        self.postings = table['postings']
+        self.offsets = table['offsets']
+
+        # Slot query (LIKE) patterns, compiled into regular expressions
+        self.query_patterns = {}
+
+    @classmethod
+    def load_table(cls, filename):
+        """
+        Load an SQL database table into columns and per-value row postings,
+        or get it from the tables that have already been loaded. Building
+        them takes O(n log n) time and O(n) memory per column, no matter how
+        many distinct values a column has.
+
+        :param filename: path to the SQL database
+        :return: a dictionary holding the table
+        """
+
+        key = (os.path.abspath(filename), os.path.getmtime(filename))
+
+        if key in cls.tables:
+            return cls.tables[key]
+
+        sql_database = SQLDataBase(filename)
+        column_names = sql_database.get_slot_names()
+
+        cursor = sql_database.SQL_connection.execute(
+            f'SELECT rowid, * FROM "{sql_database.db_table_name}" '
+            f'ORDER BY rowid;')
+        rows = cursor.fetchall()
+        sql_database.SQL_connection.close()
+
+        table = {'table_name': sql_database.db_table_name,
+                 'column_names': column_names,
+                 'rowids': np.array([row[0] for row in rows], dtype=np.int64),
+                 'row_index': {row[0]: i for i, row in enumerate(rows)},
+                 'columns': {},
+                 'codes': {},
+                 'values': {},
+                 'value_codes': {},
+                 'postings': {},
+                 'offsets': {}}
+
+        for c, slot in enumerate(column_names, start=1):
+            column = tuple(row[c] for row in rows)
+            value_codes = {}
+            codes = np.fromiter(
+                (value_codes.setdefault(value, len(value_codes))
+                 for value in column), dtype=np.int32, count=len(column))
+
+            # Sorting the rows by code (stably, so that the rows of each
+            # value stay in ascending order) groups them by value
+            offsets = np.zeros(len(value_codes) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(codes, minlength=len(value_codes)),
+                      out=offsets[1:])
+
+            table['columns'][slot] = column
+            table['codes'][slot] = codes
+            table['values'][slot] = list(value_codes)
+            table['value_codes'][slot] = value_codes
+            table['postings'][slot] = np.argsort(codes, kind='stable')
+            table['offsets'][slot] = offsets
+
+        # Tables of older versions of the file are not used any more
+        for old_key in [k for k in cls.tables if k[0] == key[0]]:
+            del cls.tables[old_key]
+
+        cls.tables[key] = table
+
+        return table
+
+    def db_lookup(self, DState, MAX_DB_RESULTS=None, lazy=False):
+        """
+        Perform a query by intersecting the rows of the constrained slot
+        values. Results are in the same order as SQLDataBase's.
+
+        :param DState: the current dialogue state
+        :param MAX_DB_RESULTS: upper limit for results to be returned
+        :param lazy: if True, return a generator over the results instead of
+                     a list
+        :return: the results of the query
+        """
+
+        rows = self.get_rows(DState)
+
+        if MAX_DB_RESULTS:
+            rows = rows[:MAX_DB_RESULTS]
+
+        results = (self.make_item(i) for i in rows)
+
+        if lazy:
+            return results
+
+        return list(results)
+
+    def get_rows(self, DState):
+        """
+        Get the rows that satisfy the constraints and queries of a dialogue
+        state. The rows of the most selective constraint are filtered by the
+        value codes of the other constrained slots.
+
+        :param DState: the current dialogue state
+        :return: a numpy array of row positions, in ascending order
+        """
+
+        constraints, queries = self.get_query_constraints(DState)
+
+        for slot in [s for s, _ in constraints] + [s for s, _ in queries]:
+            if slot not in self.codes:
+                raise ValueError(f'ColumnarDataBase: Unknown slot {slot} for '
+                                 f'table {self.db_table_name}')
+
+        codes = []
+
+        for slot, value in constraints:
+            code = self.value_codes[slot].get(value)
+
+            if code is None:
+                return np.empty(0, dtype=np.int64)
+
+            codes.append((self.offsets[slot][code + 1] -
+                          self.offsets[slot][code], slot, code))
+
+        if codes:
+            codes.sort()
+            _, slot, code = codes[0]
+            rows = self.postings[slot][
+                self.offsets[slot][code]:self.offsets[slot][code + 1]]
+
+            for _, slot, code in codes[1:]:
+                rows = rows[self.codes[slot][rows] == code]
+
+        else:
+            rows = np.arange(len(self.rowids))
+
+        if queries and len(rows):
+            matches = self.combine_query_matches(queries,
+                                                 self.get_query_matches)
+            rows = rows[matches[rows]]
+
+        return rows
+
+    def get_query_matches(self, slot, query):
+        """
+        Get the rows whose slot value contains the query, as in SQL's
+        LIKE '%query%' (i.e. case insensitive, with % and _ as wildcards).
+
+        :param slot: the slot
+        :param query: the value to look for
+        :return: a boolean numpy array, True for the matching rows
+        """
+
+        if query not in self.query_patterns:
+            self.query_patterns[query] = self.like_pattern(query)
+
+        pattern = self.query_patterns[query]
+
+        matching_codes = np.array(
+            [value is not None and bool(pattern.search(str(value)))
+             for value in self.values[slot]], dtype=bool)
+
+        return matching_codes[self.codes[slot]]
+
+    def make_item(self, row):
+        """
+        Create the dictionary (slot: value) of a row.
+
+        :param row: the row's position
+        :return: a dictionary
+        """
+
+        return {slot: self.columns[slot][row] for slot in self.db_column_names}
+
+    def get_slot_value_counts(self, dialogue_state, slots):
+        """
+        Count the values of the given slots over the rows that satisfy the
+        dialogue state's constraints, using the value codes of each column.
+
+        :param dialogue_state: the current dialogue state
+        :param slots: the slots to count values for
+        :return: a dictionary of slot: {value: count}
+        """
+
+        rows = self.get_rows(dialogue_state)
+        value_counts = {}
+
+        for slot in slots:
+            if slot not in self.codes:
+                raise ValueError(f'ColumnarDataBase: Unknown slot {slot} for '
+                                 f'table {self.db_table_name}')
+
+            codes, first_rows, counts = np.unique(
+                self.codes[slot][rows], return_index=True, return_counts=True)
+
+            # List values in the order they first appear in the results
+            order = np.argsort(first_rows, kind='stable')
+            value_counts[slot] = {self.values[slot][codes[i]]: int(counts[i])
+                                  for i in order}
+
+        return value_counts
+
+    def has_statistics(self):
+        """
+        The item count and the slot values are always available, as
+        the table is kept in memory
+
+        :return: True
+        """
+
+        return True
+
+    def get_item_count(self):
+        """
+        Get the number of items in the database
+
+        :return: the number of items
+        """
+
+        return len(self.rowids)
+
+    def get_slot_names(self):
+        """
+        Get the names of the database's columns
+
+        :return: a list of slot names
+        """
+
+        return list(self.db_column_names)
+
+    def get_item(self, rowid):
+        """
+        Get an item of the database
+
+        :param rowid: the row id of the item
+        :return: a dictionary (slot: value) or None if there is no such item
+        """
+
+        if rowid not in self.row_index:
+            return None
+
+        return self.make_item(self.row_index[rowid])
+
+    def get_slot_values(self, slot):
+        """
+        Get the distinct values of a column, in the order they first appear
+        in the table
+
+        :param slot: the slot
+        :return: a list of values
+        """
+
+        if slot not in self.values:
+            raise ValueError(f'ColumnarDataBase: Unknown slot {slot} for '
+                             f'table {self.db_table_name}')
+
+        return list(self.values[slot])
+
+    def get_table_name(self):
+        """
+        Get the database's table name
+
+        :return: the table name
+        """
+
+        return self.db_table_name
+
+
+class JSONDataBase(DataBase):
+    def __init__(self, filename, use_mmap=False):
+        """
+        Initializes the internal structures of the json parser Base. The file
+        is read once and an index (value: rows) is built for each slot.
+
+        Both .json files (a list of items, or a dictionary with a single
+        table name: list of items) and .jsonl files (one item per line) are
+        supported. Large .jsonl files can be memory-mapped, in which case only
+        the indexes and the offsets of the items are kept in memory and items
+        are parsed when they are retrieved.
 
         :param filename: path to the json database
+        :param use_mmap: whether to memory-map the file (.jsonl only)
         """
         super(JSONDataBase, self).__init__(filename)
 
-    def db_lookup(self, dialogue_state):
+        self.db_table_name = \
+            os.path.splitext(os.path.basename(self.db_file_name))[0]
+        self.db_column_names = []
+        self.item_count = 0
+
+        # Parsed items, or the memory-mapped file and the start and end
+        # offsets of each item
+        self.items = []
+        self.mmap = None
+        self.item_offsets = None
+
+        # Rows of each slot value, for each slot
+        self.index = {}
+
+        # Slot query (LIKE) patterns, compiled into regular expressions
+        self.query_patterns = {}
+
+        if self.db_file_name[-6:] == '.jsonl':
+            if use_mmap:
+                self.load_jsonl_mmap()
+            else:
+                self.load_jsonl()
+
+        else:
+            if use_mmap:
+                print('Warning! JSONDataBase can only memory-map .jsonl '
+                      'files. Loading the whole file.')
+
+            self.load_json()
+
+        self.finalize_index()
+
+    def load_json(self):
         """
-        Placeholder to query the json database
+        Load a .json file, containing either a list of items or a dictionary
+        with the table name and the list of items.
 
-        :param dialogue_state: the current dialogue state
+        :return: nothing
+        """
+
+        with open(self.db_file_name, 'r') as db_file:
+            data = json.load(db_file)
+
+        if isinstance(data, dict) and len(data) == 1:
+            self.db_table_name, data = next(iter(data.items()))
+
+        if not isinstance(data, list):
+            raise ValueError(f'JSONDataBase: {self.db_file_name} does not '
+                             f'contain a list of items')
+
+        for item in data:
+            self.add_item(item)
+
+    def load_jsonl(self):
+        """
+        Load a .jsonl file, containing one item per line.
+
+        :return: nothing
+        """
+
+        with open(self.db_file_name, 'r') as db_file:
+            for line in db_file:
+                if line.strip():
+                    self.add_item(json.loads(line))
+
+    def load_jsonl_mmap(self):
+        """
+        Memory-map a .jsonl file and index its items, keeping only the
+        offsets of each item.
+
+        :return: nothing
+        """
+
+        starts = []
+        ends = []
+
+        if os.path.getsize(self.db_file_name) > 0:
+            with open(self.db_file_name, 'rb') as db_file:
+                self.mmap = mmap.mmap(db_file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+
+            start = 0
+            for line in iter(self.mmap.readline, b''):
+                if line.strip():
+                    self.add_item(json.loads(line), keep=False)
+                    starts.append(start)
+                    ends.append(start + len(line))
+
+                start += len(line)
+
+        self.item_offsets = np.array([starts, ends], dtype=np.int64)
+
+    def add_item(self, item, keep=True):
+        """
+        Add an item to the slot indexes.
+
+        :param item: a dictionary (slot: value)
+        :param keep: whether to keep the item in memory
+        :return: nothing
+        """
+
+        if not isinstance(item, dict):
+            raise ValueError(f'JSONDataBase: Unacceptable item {item} in '
+                             f'{self.db_file_name}')
+
+        for slot, value in item.items():
+            if slot not in self.index:
+                self.db_column_names.append(slot)
+                self.index[slot] = {}
+
+            self.index[slot].setdefault(self.index_value(value), []).append(
+                self.item_count)
+
+        if keep:
+            self.items.append(item)
+
+        self.item_count += 1
+
+    def finalize_index(self):
+        """
+        Index items that do not have a value for some slot under None (like
+        NULL in SQL), keeping each slot's values in the order they first
+        appear.
+
+        :return: nothing
+        """
+
+        for slot in self.db_column_names:
+            slot_index = self.index[slot]
+
+            if sum(len(rows) for rows in slot_index.values()) < \
+                    self.item_count:
+                indexed = set()
+                for rows in slot_index.values():
+                    indexed.update(rows)
+
+                slot_index.setdefault(None, []).extend(
+                    row for row in range(self.item_count)
+                    if row not in indexed)
+                slot_index[None].sort()
+
+                self.index[slot] = dict(
+                    sorted(slot_index.items(), key=lambda v: v[1][0]))
+
+    @staticmethod
+    def index_value(value):
+        """
+        Get the key under which a value is indexed (lists and dictionaries
+        are not hashable, so they are indexed by their json representation).
+
+        :param value: the value
+        :return: the index key
+        """
+
+        if isinstance(value, (list, dict)):
+            return json.dumps(value, sort_keys=True)
+
+        return value
+
+    def db_lookup(self, DState, MAX_DB_RESULTS=None, lazy=False):
+        """
+        Query the json database using the slot indexes. Constraints and slot
+        queries have the same semantics as in SQLDataBase and results are in
+        the order they appear in the file.
+
+        :param DState: the current dialogue state
+        :param MAX_DB_RESULTS: upper limit for results to be returned
+        :param lazy: if True, return a generator over the results instead of
+                     a list
         :return: the result of the query
         """
-        return []
+
+        rows = self.get_rows(DState)
+
+        if MAX_DB_RESULTS:
+            rows = rows[:MAX_DB_RESULTS]
+
+        results = (self.make_item(row) for row in rows)
+
+        if lazy:
+            return results
+
+        return list(results)
+
+    def get_rows(self, DState):
+        """
+        Get the rows that satisfy the constraints and queries of a dialogue
+        state.
+
+        :param DState: the current dialogue state
+        :return: a sorted sequence of rows
+        """
+
+        constraints, queries = self.get_query_constraints(DState)
+
+        for slot in [s for s, _ in constraints] + [s for s, _ in queries]:
+            if slot not in self.index:
+                raise ValueError(f'JSONDataBase: Unknown slot {slot} for '
+                                 f'table {self.db_table_name}')
+
+        rows = None
+
+        # Start from the most selective constraint
+        for slot, value in sorted(
+                constraints,
+                key=lambda c: len(self.index[c[0]].get(c[1], []))):
+            value_rows = self.index[slot].get(value, [])
+            rows = set(value_rows) if rows is None \
+                else rows.intersection(value_rows)
+
+            if not rows:
+                return []
+
+        if queries:
+            query_rows = self.combine_query_matches(queries,
+                                                    self.get_query_rows)
+            rows = query_rows if rows is None else rows & query_rows
+
+        if rows is None:
+            return range(self.item_count)
+
+        return sorted(rows)
+
+    def get_query_rows(self, slot, query):
+        """
+        Get the rows whose slot value contains the query, as in SQL's
+        LIKE '%query%'.
+
+        :param slot: the slot
+        :param query: the value to look for
+        :return: a set of rows
+        """
+
+        if query not in self.query_patterns:
+            self.query_patterns[query] = self.like_pattern(query)
+
+        pattern = self.query_patterns[query]
+        rows = set()
+
+        for value, value_rows in self.index[slot].items():
+            if value is not None and pattern.search(str(value)):
+                rows.update(value_rows)
+
+        return rows
+
+    def make_item(self, row):
+        """
+        Get the dictionary (slot: value) of a row, with a value (or None) for
+        every slot.
+
+        :param row: the row
+        :return: a dictionary
+        """
+
+        if self.mmap is not None:
+            item = json.loads(self.mmap[self.item_offsets[0][row]:
+                                        self.item_offsets[1][row]])
+        else:
+            item = self.items[row]
+
+        return {slot: item.get(slot) for slot in self.db_column_names}
+
+    def get_slot_value_counts(self, dialogue_state, slots):
+        """
+        Count the values of the given slots over the rows that satisfy the
+        dialogue state's constraints, using the slot indexes.
+
+        :param dialogue_state: the current dialogue state
+        :param slots: the slots to count values for
+        :return: a dictionary of slot: {value: count}
+        """
+
+        rows = set(self.get_rows(dialogue_state))
+        value_counts = {}
+
+        for slot in slots:
+            if slot not in self.index:
+                raise ValueError(f'JSONDataBase: Unknown slot {slot} for '
+                                 f'table {self.db_table_name}')
+
+            counts = []
+            for value, value_rows in self.index[slot].items():
+                matches = [row for row in value_rows if row in rows]
+
+                if matches:
+                    counts.append((matches[0], value, len(matches)))
+
+            # List values in the order they first appear in the results
+            value_counts[slot] = {value: count
+                                  for _, value, count in sorted(counts)}
+
+        return value_counts
+
+    def has_statistics(self):
+        """
+        The item count and the slot values are always available, as
+        the items are kept in memory
+
+        :return: True
+        """
+
+        return True
+
+    def get_item_count(self):
+        """
+        Get the number of items in the json database
+
+        :return: the number of items
+        """
+
+        return self.item_count
+
+    def get_slot_names(self):
+        """
+        Get the slots that appear in the json database's items
+
+        :return: a list of slot names
+        """
+
+        return list(self.db_column_names)
+
+    def get_item(self, rowid):
+        """
+        Get an item of the json database
+
+        :param rowid: the (1-based) position of the item in the file
+        :return: a dictionary (slot: value) or None if there is no such item
+        """
+
+        if 1 <= rowid <= self.item_count:
+            return self.make_item(rowid - 1)
+
+        return None
+
+    def get_slot_values(self, slot):
+        """
+        Get the distinct values of a slot, in the order they first appear in
+        the json database
+
+        :param slot: the slot
+        :return: a list of values
+        """
+
+        if slot not in self.index:
+            raise ValueError(f'JSONDataBase: Unknown slot {slot} for '
+                             f'table {self.db_table_name}')
+
+        return list(self.index[slot])
 
     def get_table_name(self):
         """
-        Placeholder to get the json database's table name
+        Get the json database's table name (the file's name, unless the file
+        contains a dictionary with the table name)
+
         :return: the table name
         """
 
-        return ''
+        return self.db_table_name
@@ -0,0 +1,275 @@
+"""
+Copyright (c) 2019 Uber Technologies, Inc.
+
+Licensed under the Uber Non-Commercial License (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at the root directory of this project.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = "Alexandros Papangelis"
+
+from collections import OrderedDict
+
+import os
+import os.path
+import threading
+
+"""
+DBLookupCache sits between a dialogue manager and its database and answers
+lookups for a dialogue state without querying the database whenever it can:
+
+- if the constraints have not changed since the last lookup of the dialogue,
+  the last results are returned;
+- results are kept in a bounded LRU, keyed by the canonical constraints (see
+  DataBase.get_query_constraints), that is shared by all the dialogues of a
+  process, as the same constraints recur across (simulated) dialogues;
+- if the constraints have only been tightened (i.e. slots have been filled)
+  and the last results of the dialogue were complete, the new results are
+  filtered from them in memory.
+
+Results and entropies are shared, so they must not be modified.
+"""
+
+
+class DBLookupCache:
+    # Results and entropies of recent lookups, of all databases, shared by
+    # all dialogues
+    lookups = OrderedDict()
+    lookups_lock = threading.Lock()
+
+    # The maximum number of lookups in the LRU
+    MAX_CACHED_LOOKUPS = 4096
+
+    def __init__(self, database):
+        """
+        Initialize the cache of a dialogue.
+
+        :param database: the database (a DataBase object)
+        """
+
+        self.database = database
+        self.database_key = None
+
+        # The constraints, queries, limit, and results of the last lookup of
+        # the dialogue
+        self.last_lookup = None
+        self.last_results = None
+
+        self.restart()
+
+    def restart(self):
+        """
+        Forget the last lookup, e.g. at the beginning of a new dialogue. The
+        database file is checked again, so that lookups of a database that
+        has changed are not answered from the LRU.
+
+        :return: nothing
+        """
+
+        stat = os.stat(self.database.db_file_name)
+        self.database_key = (type(self.database).__name__,
+                             os.path.abspath(self.database.db_file_name),
+                             stat.st_mtime, stat.st_size)
+
+        self.last_lookup = None
+        self.last_results = None
+
+    def db_lookup(self, DState, MAX_DB_RESULTS=None):
+        """
+        Get the results of the query for a dialogue state, as
+        DataBase.db_lookup() would return them.
+
+        :param DState: the current dialogue state
+        :param MAX_DB_RESULTS: upper limit for results to be returned
+        :return: a list of results (which must not be modified)
+        """
+
+        constraints, queries = self.database.get_query_constraints(DState)
+        lookup = (constraints, queries, MAX_DB_RESULTS)
+
+        if lookup == self.last_lookup:
+            return self.last_results
+
+        key = self.database_key + lookup
+        results = self.get_cached(key)
+
+        if results is None:
+            results = self.refine(constraints, queries, MAX_DB_RESULTS)
+
+            if results is None:
+                results = self.database.db_lookup(DState, MAX_DB_RESULTS)
+
+            self.add_cached(key, results)
+
+        self.last_lookup = lookup
+        self.last_results = results
+
+        return results
+
+    def refine(self, constraints, queries, MAX_DB_RESULTS=None):
+        """
+        Filter the last results of the dialogue in memory, if the new
+        constraints only add to the ones of the last lookup, which returned
+        all of its results (i.e. was not cut short by MAX_DB_RESULTS).
+
+        Databases compare strings exactly, so only string constraints and
+        values are compared in memory.
+
+        :param constraints: (slot, value) tuples
+        :param queries: (slot, ((query, operator), ...)) tuples
+        :param MAX_DB_RESULTS: upper limit for results to be returned
+        :return: a list of results, or None if they cannot be filtered from
+                 the last results
+        """
+
+        if not self.is_complete() or queries != self.last_lookup[1]:
+            return None
+
+        last_constraints = set(self.last_lookup[0])
+
+        if not last_constraints.issubset(constraints):
+            return None
+
+        new_constraints = [(slot, value) for slot, value in constraints
+                           if (slot, value) not in last_constraints]
+
+        if not all(isinstance(value, str) for _, value in new_constraints):
+            return None
+
+        results = []
+
+        for db_item in self.last_results:
+            for slot, value in new_constraints:
+                # Let the database decide (e.g. raise an error for unknown
+                # slots, or convert numbers)
+                if slot not in db_item:
+                    return None
+
+                item_value = db_item[slot]
+
+                if item_value is not None and not isinstance(item_value, str):
+                    return None
+
+                if item_value != value:
+                    break
+
+            else:
+                results.append(db_item)
+
+        if MAX_DB_RESULTS:
+            results = results[:MAX_DB_RESULTS]
+
+        return results
+
+    def get_slot_entropies(self, DState, slots):
+        """
+        Get the entropy of the values of the given slots in the results of the
+        query for a dialogue state, as DataBase.get_slot_entropies() would
+        calculate them. If the last lookup of the dialogue was for the same
+        state and returned all of its results, they are calculated from them
+        in memory.
+
+        :param DState: the current dialogue state
+        :param slots: the slots to calculate entropies for
+        :return: a dictionary of slot: entropy (which must not be modified)
+        """
+
+        constraints, queries = self.database.get_query_constraints(DState)
+        key = self.database_key + (constraints, queries, 'entropies',
+                                   tuple(slots))
+
+        entropies = self.get_cached(key)
+
+        if entropies is None:
+            if self.last_lookup and \
+                    self.last_lookup[:2] == (constraints, queries) and \
+                    self.is_complete():
+                entropies = self.calculate_entropies(slots)
+
+            if entropies is None:
+                entropies = self.database.get_slot_entropies(DState, slots)
+
+            self.add_cached(key, entropies)
+
+        return entropies
+
+    def calculate_entropies(self, slots):
+        """
+        Calculate slot entropies from the last results of the dialogue, which
+        must be complete. Values are counted in the order they first appear,
+        like the databases count them, so the entropies are exactly the same.
+
+        :param slots: the slots to calculate entropies for
+        :return: a dictionary of slot: entropy, or None if the results have
+                 values that the database may count differently
+        """
+
+        value_counts = {slot: {} for slot in slots}
+
+        for db_item in self.last_results:
+            for slot in slots:
+                if slot not in db_item:
+                    return None
+
+                value = db_item[slot]
+
+                if value is not None and not isinstance(value, str):
+                    return None
+
+                value_counts[slot][value] = \
+                    value_counts[slot].get(value, 0) + 1
+
+        return {slot: self.database.entropy(value_counts[slot])
+                for slot in slots}
+
+    def is_complete(self):
+        """
+        Check if the last lookup of the dialogue returned all the items that
+        satisfy its constraints.
+
+        :return: True or False
+        """
+
+        if self.last_lookup is None:
+            return False
+
+        max_db_results = self.last_lookup[2]
+
+        return not max_db_results or len(self.last_results) < max_db_results
+
+    @classmethod
+    def get_cached(cls, key):
+        """
+        Get a lookup from the LRU.
+
+        :param key: the lookup's key
+        :return: the cached value, or None if it is not cached
+        """
+
+        with cls.lookups_lock:
+            if key not in cls.lookups:
+                return None
+
+            cls.lookups.move_to_end(key)
+
+            return cls.lookups[key]
+
+    @classmethod
+    def add_cached(cls, key, value):
+        """
+        Add a lookup to the LRU, evicting the least recently used one if the
+        LRU is full.
+
+        :param key: the lookup's key
+        :param value: the results or entropies
+        :return: nothing
+        """
+
+        with cls.lookups_lock:
+            cls.lookups[key] = value
+
+            if len(cls.lookups) > cls.MAX_CACHED_LOOKUPS:
+                cls.lookups.popitem(last=False)
@@ -0,0 +1,222 @@
+"""
+Copyright (c) 2019 Uber Technologies, Inc.
+
+Licensed under the Uber Non-Commercial License (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at the root directory of this project.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = "Alexandros Papangelis"
+
+import json
+import os
+import os.path
+import threading
+
+"""
+SlotValueCatalog holds the item count and the distinct values of each slot of
+a database. Unless the database has statistics that provide them without a
+scan, it is saved in a sidecar file next to the database (e.g.
+CamRestaurants-dbase.db.slot_values.json), so that the database is only
+scanned again when it changes. Catalogs are loaded lazily, the first time
+they are used, and shared by everyone who uses the same database file in a
+process.
+"""
+
+
+class SlotValueCatalog:
+    # Catalogs created so far, keyed by database file, shared by all users
+    catalogs = {}
+    catalogs_lock = threading.Lock()
+
+    # Appended to the database file name to get the sidecar file name
+    SIDECAR_SUFFIX = '.slot_values.json'
+
+    # The version of the sidecar format
+    VERSION = 1
+
+    def __init__(self, database, key):
+        """
+        Initialize an empty catalog. Use SlotValueCatalog.get() to get the
+        shared catalog of a database.
+
+        :param database: the database (a DataBase object)
+        :param key: the database file's path, modification time, and size
+        """
+
+        self.database = database
+        self.key = key
+        self.sidecar_file_name = database.db_file_name + self.SIDECAR_SUFFIX
+
+        self.loaded = False
+        self.load_lock = threading.Lock()
+
+        self.item_count = 0
+        self.slot_values = {}
+
+    @classmethod
+    def get(cls, database):
+        """
+        Get the catalog of a database, creating it (without loading it) if
+        it does not exist. A catalog is created again if its database file
+        has changed.
+
+        :param database: the database (a DataBase object)
+        :return: a SlotValueCatalog
+        """
+
+        stat = os.stat(database.db_file_name)
+        key = (os.path.abspath(database.db_file_name), stat.st_mtime,
+               stat.st_size)
+
+        with cls.catalogs_lock:
+            if key not in cls.catalogs:
+                # Catalogs of older versions of the file are not used any more
+                for old_key in [k for k in cls.catalogs if k[0] == key[0]]:
+                    del cls.catalogs[old_key]
+
+                cls.catalogs[key] = cls(database, key)
+
+            return cls.catalogs[key]
+
+    def load(self):
+        """
+        Load the catalog. Databases that have statistics (e.g. the statistics
+        catalog that plato domain writes into SQL databases) are read
+        directly. Otherwise, the catalog is loaded from its sidecar file or,
+        if there is no sidecar file for the current version of the database,
+        built from the database and saved.
+
+        :return: nothing
+        """
+
+        with self.load_lock:
+            if self.loaded:
+                return
+
+            if self.database.has_statistics():
+                self.build()
+
+            elif not self.load_sidecar():
+                self.build()
+                self.save_sidecar()
+
+            self.loaded = True
+
+    def build(self):
+        """
+        Read the item count and the distinct values of each slot from the
+        database.
+
+        :return: nothing
+        """
+
+        self.item_count = self.database.get_item_count()
+        self.slot_values = {}
+
+        for slot in self.database.get_slot_names():
+            self.slot_values[slot] = \
+                self.database.get_slot_values(slot) if self.item_count else []
+
+    def load_sidecar(self):
+        """
+        Load the catalog from its sidecar file, if it was saved for the
+        current version of the database.
+
+        :return: True if the catalog was loaded
+        """
+
+        if not os.path.isfile(self.sidecar_file_name):
+            return False
+
+        try:
+            with open(self.sidecar_file_name) as sidecar_file:
+                sidecar = json.load(sidecar_file)
+
+        except (OSError, ValueError) as err:
+            print(f'WARNING! SlotValueCatalog cannot read '
+                  f'{self.sidecar_file_name} ({err}).')
+            return False
+
+        if sidecar.get('version') != self.VERSION or \
+                sidecar.get('db_mtime') != self.key[1] or \
+                sidecar.get('db_size') != self.key[2]:
+            return False
+
+        self.item_count = sidecar['item_count']
+        self.slot_values = sidecar['slot_values']
+
+        return True
+
+    def save_sidecar(self):
+        """
+        Save the catalog to its sidecar file. The catalog is still usable if
+        it cannot be saved (e.g. if the database's directory is read-only).
+
+        :return: nothing
+        """
+
+        sidecar = {'version': self.VERSION,
+                   'db_mtime': self.key[1],
+                   'db_size': self.key[2],
+                   'item_count': self.item_count,
+                   'slot_values': self.slot_values}
+
+        # Write to a temporary file first, so that other processes never
+        # read a partially written sidecar
+        temp_file_name = f'{self.sidecar_file_name}.{os.getpid()}.tmp'
+
+        try:
+            with open(temp_file_name, 'w') as sidecar_file:
+                json.dump(sidecar, sidecar_file)
+
+            os.replace(temp_file_name, self.sidecar_file_name)
+
+        except (OSError, TypeError, ValueError) as err:
+            print(f'WARNING! SlotValueCatalog cannot save '
+                  f'{self.sidecar_file_name} ({err}).')
+
+            if os.path.isfile(temp_file_name):
+                os.remove(temp_file_name)
+
+    def get_item_count(self):
+        """
+        Get the number of items in the database
+
+        :return: the number of items
+        """
+
+        self.load()
+
+        return self.item_count
+
+    def get_slot_names(self):
+        """
+        Get the names of the database's slots
+
+        :return: a list of slot names
+        """
+
+        self.load()
+
+        return list(self.slot_values)
+
+    def get_slot_values(self, slot):
+        """
+        Get the distinct values of a slot, in the order they first appear in
+        the database
+
+        :param slot: the slot
+        :return: a list of values (which must not be modified)
+        """
+
+        self.load()
+
+        if slot not in self.slot_values:
+            raise ValueError(f'SlotValueCatalog: Unknown slot {slot} for '
+                             f'database {self.database.db_file_name}')
+
+        return self.slot_values[slot]
@@ -0,0 +1,273 @@
+"""
+Copyright (c) 2019 Uber Technologies, Inc.
+
+Licensed under the Uber Non-Commercial License (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at the root directory of this project.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = "Alexandros Papangelis"
+
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+"""
+The BatchPredictor collects prediction requests (one row each) from many
+dialogues, e.g. from the threads of an application that serves many sessions,
+and runs a single predict() over each batch of them. A batch is predicted once
+max_batch_size requests have been collected, or max_wait_ms milliseconds
+after its first request arrived, whichever comes first. The rows of the
+result are then dispatched back to the callers.
+
+There is no background thread: the caller whose request starts a batch
+collects it, predicts it, and wakes up the other callers in the batch.
+"""
+
+
+# Predictors whose model is shared by the components that use it, by model path
+SHARED_PREDICTORS = {}
+SHARED_PREDICTORS_LOCK = threading.Lock()
+
+
+class PredictionRequest:
+    """
+    A row waiting to be predicted, and its result.
+    """
+
+    def __init__(self, row, predict_args):
+        """
+        Initialize a pending request.
+
+        :param row: a dictionary of column -> value
+        :param predict_args: keyword arguments for the model's predict()
+        """
+
+        self.row = row
+        self.predict_args = predict_args
+
+        # Whether the request has been taken into a batch, and whether that
+        # batch has been predicted
+        self.taken = False
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+class BatchPredictor:
+    """
+    Micro-batches the predict() calls of a model (e.g. a Ludwig model) that
+    takes a pandas DataFrame with one row per input.
+    """
+
+    def __init__(self, model, max_batch_size=1, max_wait_ms=0, shared=False):
+        """
+        Initialize the predictor.
+
+        :param model: the model; its predict() takes a DataFrame
+        :param max_batch_size: the maximum number of rows per predict(); if 1,
+                               every request is predicted right away
+        :param max_wait_ms: how long a batch waits for more requests
+        :param shared: whether the model is shared by several components (see
+                       load_predictor()) and must therefore not be closed by
+                       any one of them
+        """
+
+        if max_batch_size < 1:
+            raise ValueError(f'BatchPredictor: Unacceptable batch size '
+                             f'{max_batch_size}')
+
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(max_wait_ms, 0) / 1000.0
+        self.shared = shared
+
+        self.pending = []
+        self.collecting = False
+        self.condition = threading.Condition()
+
+        # Models are not necessarily thread safe, so predictions are
+        # serialized, while the next batch is being collected
+        self.model_lock = threading.Lock()
+
+    def predict(self, row, **predict_args):
+        """
+        Predict a single row, batched with the rows of concurrent requests
+        that have the same predict() arguments.
+
+        :param row: a dictionary of column -> value
+        :param predict_args: keyword arguments for the model's predict()
+        :return: the model's result for the row, in the format the model
+                 returns (e.g. a one-row DataFrame)
+        """
+
+        if self.max_batch_size == 1:
+            with self.model_lock:
+                return self.model.predict(
+                    pd.DataFrame(data=[row]), **predict_args)
+
+        request = PredictionRequest(row, predict_args)
+
+        with self.condition:
+            self.pending.append(request)
+            self.condition.notify_all()
+
+            while not request.done:
+                if self.collecting or request.taken:
+                    self.condition.wait()
+                    continue
+
+                # No one is collecting a batch, so this caller collects the
+                # next one (which may not include its own request)
+                self.collecting = True
+                batch = self.collect_batch()
+                self.collecting = False
+                self.condition.notify_all()
+
+                self.condition.release()
+                try:
+                    self.predict_requests(batch)
+                finally:
+                    self.condition.acquire()
+
+                self.condition.notify_all()
+
+        if request.error is not None:
+            raise request.error
+
+        return request.result
+
+    def collect_batch(self):
+        """
+        Wait (with the condition held) until enough requests are pending or
+        the first pending request has waited for long enough, and take the
+        pending requests that have the same predict() arguments as the first.
+
+        :return: a list of requests
+        """
+
+        deadline = time.monotonic() + self.max_wait
+
+        while len(self.pending) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+
+            if remaining <= 0:
+                break
+
+            self.condition.wait(remaining)
+
+        predict_args = self.pending[0].predict_args
+        batch = []
+        rest = []
+
+        for request in self.pending:
+            if len(batch) < self.max_batch_size and \
+                    request.predict_args == predict_args:
+                request.taken = True
+                batch.append(request)
+            else:
+                rest.append(request)
+
+        self.pending = rest
+
+        return batch
+
+    def predict_requests(self, batch):
+        """
+        Predict a batch of requests with a single predict() and mark them as
+        done.
+
+        :param batch: a list of requests with the same predict() arguments
+        :return: nothing
+        """
+
+        try:
+            results = self.predict_batch([request.row for request in batch],
+                                         **batch[0].predict_args)
+
+            for request, result in zip(batch, results):
+                request.result = result
+
+        except Exception as e:
+            for request in batch:
+                request.error = e
+
+        with self.condition:
+            for request in batch:
+                request.done = True
+
+    def predict_batch(self, rows, **predict_args):
+        """
+        Predict a number of rows with a single predict() (e.g. for offline
+        evaluation).
+
+        :param rows: a list of dictionaries of column -> value
+        :param predict_args: keyword arguments for the model's predict()
+        :return: a list with the model's result for each row
+        """
+
+        if not rows:
+            return []
+
+        with self.model_lock:
+            result = self.model.predict(pd.DataFrame(data=rows),
+                                        **predict_args)
+
+        if len(rows) == 1:
+            return [result]
+
+        return [split_result(result, i) for i in range(len(rows))]
+
+
+def split_result(result, index):
+    """
+    Get the result of a single row from the result of a batch, keeping its
+    format, so that e.g. result['intent']['predictions'][0] works for both.
+
+    :param result: the result of a batch: a DataFrame, or a (nested)
+                   dictionary of DataFrames, Series, arrays, or lists
+    :param index: the index of the row
+    :return: the result of the row
+    """
+
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return result.iloc[index:index + 1].reset_index(drop=True)
+
+    if isinstance(result, dict):
+        return {key: split_result(value, index)
+                for key, value in result.items()}
+
+    if isinstance(result, (list, np.ndarray)):
+        return result[index:index + 1]
+
+    return result
+
+
+def load_predictor(model_path, load, max_batch_size=1, max_wait_ms=0):
+    """
+    Load a model and create its predictor. If batching is enabled, the model
+    is loaded once per process and shared by all the components that use the
+    same model path, so that their requests can be batched together.
+
+    :param model_path: the path to the model
+    :param load: a function that loads a model, given its path
+    :param max_batch_size: the maximum number of rows per predict()
+    :param max_wait_ms: how long a batch waits for more requests
+    :return: a BatchPredictor
+    """
+
+    if max_batch_size <= 1:
+        return BatchPredictor(load(model_path))
+
+    with SHARED_PREDICTORS_LOCK:
+        if model_path not in SHARED_PREDICTORS:
+            SHARED_PREDICTORS[model_path] = \
+                BatchPredictor(load(model_path), max_batch_size, max_wait_ms,
+                               shared=True)
+
+        return SHARED_PREDICTORS[model_path]
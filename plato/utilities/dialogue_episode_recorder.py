@@ -11,6 +11,8 @@ limitations under the License.
 
 __author__ = "Alexandros Papangelis"
 
+from plato.dialogue.state import State
+from plato.utilities.episode_log import EpisodeLog, is_episode_log
 from copy import deepcopy
 
 import pickle
@@ -21,6 +23,12 @@ import datetime
 The DialogueEpisodeRecorder is responsible for keeping track of the dialogue 
 experience. It has some standard fields and provides a custom field for any 
 other information we may want to keep track of.
+
+Experience is saved as a pickle file, or as a binary episode log (see 
+plato.utilities.episode_log) if the file name ends with .eplog. Episode logs 
+can also be streamed: completed dialogues are then appended to the log by a 
+background writer every few dialogues, rather than all at once when the log is 
+saved.
 """
 
 
@@ -30,6 +38,9 @@ class DialogueEpisodeRecorder:
     turn.
     """
 
+    # Logs with this extension are saved in the binary episode log format
+    EPISODE_LOG_EXTENSION = '.eplog'
+
     def __init__(self, size=None, path=None):
         """
         Initializes the Dialogue Episode Recorder
@@ -38,12 +49,20 @@ class DialogueEpisodeRecorder:
         :param path: path to save / load the experience
 
         """
-        self.dialogues = []
+        self.dialogues = EpisodeLog()
         self.size = size
         self.current_dialogue = None
         self.cumulative_reward = 0
         self.path = path
 
+        # Number of dialogues added so far, including any that have been
+        # truncated since
+        self.num_added = 0
+
+        # Number of completed dialogues to keep in memory before streaming
+        # them to the log (see stream())
+        self.flush_interval = None
+
         if path:
             self.load(path)
 
@@ -87,8 +106,8 @@ class DialogueEpisodeRecorder:
             self.current_dialogue = []
 
         self.current_dialogue.append({
-            'state': deepcopy(state),
-            'new_state': deepcopy(new_state),
+            'state': self.copy_state(state),
+            'new_state': self.copy_state(new_state),
             'action': deepcopy(action),
             'reward': deepcopy(reward),
             'input_utterance':
@@ -110,15 +129,84 @@ class DialogueEpisodeRecorder:
                 print('Warning! DialogueEpisodeRecorder terminal state '
                       'without success signal.')
 
-            # Check if maximum size has been reached
-            if self.size and len(self.dialogues) >= self.size:
-                self.dialogues = \
-                    self.dialogues[(len(self.dialogues)-self.size + 1):]
-
-            self.dialogues.append(self.current_dialogue)
+            self.add_dialogue(self.current_dialogue)
             self.current_dialogue = []
             self.cumulative_reward = 0
 
+    def extend(self, dialogues):
+        """
+        Records completed dialogues, e.g. dialogues that were recorded by
+        another recorder.
+
+        :param dialogues: a list of dialogues, each a list of turns
+        :return: nothing
+        """
+
+        for dialogue in dialogues:
+            self.add_dialogue(dialogue)
+
+    def add_dialogue(self, dialogue):
+        """
+        Adds a completed dialogue to the experience, streaming it to the log
+        if needed (see stream()).
+
+        :param dialogue: the dialogue, a list of turns
+        :return: nothing
+        """
+
+        # Check if maximum size has been reached
+        if self.size and len(self.dialogues) >= self.size:
+            self.dialogues.truncate(self.size - 1)
+
+        self.dialogues.append(dialogue)
+        self.num_added += 1
+
+        if self.flush_interval:
+            # Neither of these waits for the disk
+            self.dialogues.commit()
+
+            if self.dialogues.num_unsaved() >= self.flush_interval:
+                self.dialogues.flush()
+
+    def stream(self, flush_interval):
+        """
+        Stream completed dialogues to the log file in the background, every
+        flush_interval dialogues. The log file must be an episode log.
+
+        :param flush_interval: the number of completed dialogues to keep in
+                               memory before streaming them
+        :return: nothing
+        """
+
+        if not self.path or \
+                not self.path.endswith(self.EPISODE_LOG_EXTENSION):
+            print(f'WARNING! Dialogue Episode Recorder can only stream to '
+                  f'{self.EPISODE_LOG_EXTENSION} logs, not to {self.path}. '
+                  f'The log will be saved when the agent terminates.')
+            return
+
+        # If the directory does not exist, create it
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self.dialogues.stream(self.path)
+        self.flush_interval = max(int(flush_interval), 1)
+
+    @staticmethod
+    def copy_state(state):
+        """
+        Copy a state to be recorded. States are snapshotted (see
+        State.snapshot()) rather than deep copied, if possible.
+
+        :param state: the state to copy
+        :return: a copy of the state
+        """
+
+        if isinstance(state, State):
+            return state.snapshot()
+
+        return deepcopy(state)
+
     def save(self, path=None):
         """
         Saves the experience to a file.
@@ -147,11 +235,15 @@ class DialogueEpisodeRecorder:
 
             print('No Log file name provided. Using default: {0}'.format(path))
 
-        obj = {'dialogues': self.dialogues}
-
         try:
-            with open(path, 'wb') as file:
-                pickle.dump(obj, file, pickle.HIGHEST_PROTOCOL)
+            if path.endswith(self.EPISODE_LOG_EXTENSION):
+                self.dialogues.save(path)
+
+            else:
+                obj = {'dialogues': list(self.dialogues)}
+
+                with open(path, 'wb') as file:
+                    pickle.dump(obj, file, pickle.HIGHEST_PROTOCOL)
 
         except IOError:
             raise IOError('Dialogue Episode Recorder I/O Error when '
@@ -178,11 +270,21 @@ class DialogueEpisodeRecorder:
                 print(f'Dialogue Episode Recorder loading dialogues from '
                       f'{path}...')
 
+                if is_episode_log(path):
+                    self.dialogues = EpisodeLog(path=path)
+
+                    if self.size:
+                        self.dialogues.truncate(self.size)
+
+                    print('Dialogue Episode Recorder loaded from {0}.'
+                          .format(path))
+                    return
+
                 with open(path, 'rb') as file:
                     obj = pickle.load(file)
 
                     if 'dialogues' in obj:
-                        self.dialogues = obj['dialogues']
+                        self.dialogues = EpisodeLog(obj['dialogues'])
 
                     print('Dialogue Episode Recorder loaded from {0}.'
                           .format(path))
@@ -0,0 +1,739 @@
+"""
+Copyright (c) 2019 Uber Technologies, Inc.
+
+Licensed under the Uber Non-Commercial License (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at the root directory of this project.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = "Alexandros Papangelis"
+
+from collections.abc import Sequence
+from queue import Queue, Empty
+
+import numpy as np
+
+import json
+import mmap
+import os
+import pickle
+import struct
+import threading
+
+"""
+The EpisodeLog is a compact, binary format for dialogue experience. An episode
+log file is a sequence of chunks, each of which holds a number of complete
+dialogues. The fields of all turns in a chunk are stored as typed columns
+(e.g. rewards as float64, success flags as int8) and states, actions,
+utterances, etc. are stored once in per-chunk tables and referred to by id.
+
+Chunks are only ever appended to the file, and the file is memory-mapped when
+it is loaded, so dialogues are decoded only when they are accessed. Chunks can
+also be appended by a background writer while dialogues are being recorded, so
+that completed dialogues reach the disk without the recorder waiting for it.
+"""
+
+# Episode log files start with these bytes
+MAGIC = b'PLATOEPL'
+VERSION = 1
+
+# Chunk prefix: magic, version, header length, data length
+PREFIX = struct.Struct('<8sIIQ')
+
+# Columns are aligned to this many bytes
+ALIGNMENT = 8
+
+# Value of the success and task_success columns if no signal was recorded
+NO_SIGNAL = -1
+
+
+def is_episode_log(path):
+    """
+    Check if a file is an episode log.
+
+    :param path: the path to the file
+    :return: True or False
+    """
+
+    if not os.path.isfile(path):
+        return False
+
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def pad(length):
+    """
+    Get the number of padding bytes needed to align something.
+
+    :param length: the length of what needs to be aligned
+    :return: the number of padding bytes
+    """
+
+    return -length % ALIGNMENT
+
+
+class ValueTable:
+    """
+    Stores each distinct value once and assigns it an id. Values are
+    serialized with pickle, or encoded as utf-8 if they are strings.
+    """
+
+    def __init__(self, strings=False):
+        """
+        Initialize the table.
+
+        :param strings: whether the values are strings
+        """
+
+        self.strings = strings
+        self.ids = {}
+        self.data = []
+
+    def add(self, value):
+        """
+        Add a value to the table, if it does not already exist.
+
+        :param value: the value
+        :return: the value's id
+        """
+
+        if self.strings:
+            data = value.encode('utf-8')
+        else:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+        value_id = self.ids.get(data)
+
+        if value_id is None:
+            value_id = len(self.data)
+            self.ids[data] = value_id
+            self.data.append(data)
+
+        return value_id
+
+    def to_columns(self):
+        """
+        Get the table's columns: the values' offsets and their data.
+
+        :return: an int64 array and a uint8 array
+        """
+
+        offsets = np.zeros(len(self.data) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(data) for data in self.data])
+
+        return offsets, np.frombuffer(b''.join(self.data), dtype=np.uint8)
+
+
+class EpisodeLogChunk:
+    """
+    A chunk of an episode log. Its columns are views into the memory-mapped
+    log file.
+    """
+
+    # Turn fields that are stored as ids into a table
+    TABLE_FIELDS = {'state': 'states',
+                    'new_state': 'states',
+                    'action': 'actions',
+                    'input_utterance': 'strings',
+                    'output_utterance': 'strings',
+                    'role': 'strings',
+                    'custom': 'objects'}
+
+    STRING_TABLES = ('strings',)
+
+    def __init__(self, buffer, offset):
+        """
+        Read the chunk that starts at offset.
+
+        :param buffer: the (memory-mapped) log file
+        :param offset: the offset of the chunk in the file
+        """
+
+        magic, version, header_length, data_length = \
+            PREFIX.unpack_from(buffer, offset)
+
+        if magic != MAGIC:
+            raise ValueError('Not an episode log chunk')
+
+        if version > VERSION:
+            raise ValueError(f'Unsupported episode log version: {version}')
+
+        header_start = offset + PREFIX.size
+        data_start = header_start + header_length + pad(header_length)
+        self.end = data_start + data_length
+
+        if self.end > len(buffer):
+            raise ValueError('Incomplete episode log chunk')
+
+        header = json.loads(
+            bytes(buffer[header_start:header_start + header_length]))
+
+        self.num_dialogues = header['dialogues']
+        self.columns = {}
+
+        for name, (dtype, column_offset, count) in header['columns'].items():
+            self.columns[name] = np.frombuffer(buffer,
+                                               dtype=dtype,
+                                               count=count,
+                                               offset=data_start +
+                                               column_offset)
+
+    @staticmethod
+    def encode(dialogues):
+        """
+        Encode dialogues into a chunk.
+
+        :param dialogues: a list of dialogues (lists of turns)
+        :return: the chunk's bytes
+        """
+
+        tables = {'states': ValueTable(),
+                  'actions': ValueTable(),
+                  'strings': ValueTable(strings=True),
+                  'objects': ValueTable()}
+
+        num_turns = sum(len(dialogue) for dialogue in dialogues)
+
+        columns = {
+            'dialogue_offsets': np.zeros(len(dialogues) + 1, dtype=np.int64),
+            'reward': np.zeros(num_turns, dtype=np.float64),
+            'cumulative_reward': np.zeros(num_turns, dtype=np.float64),
+            'success': np.zeros(num_turns, dtype=np.int8),
+            'task_success': np.zeros(num_turns, dtype=np.int8)
+        }
+
+        for field in EpisodeLogChunk.TABLE_FIELDS:
+            columns[field] = np.zeros(num_turns, dtype=np.int32)
+
+        t = 0
+        for d, dialogue in enumerate(dialogues):
+            for turn in dialogue:
+                for field, table in EpisodeLogChunk.TABLE_FIELDS.items():
+                    columns[field][t] = tables[table].add(turn[field])
+
+                columns['reward'][t] = turn['reward']
+                columns['cumulative_reward'][t] = turn['cumulative_reward']
+
+                for field in ['success', 'task_success']:
+                    columns[field][t] = \
+                        NO_SIGNAL if turn[field] == '' else bool(turn[field])
+
+                t += 1
+
+            columns['dialogue_offsets'][d + 1] = t
+
+        for name, table in tables.items():
+            columns[name + '_offsets'], columns[name + '_data'] = \
+                table.to_columns()
+
+        header = {'dialogues': len(dialogues), 'turns': num_turns,
+                  'columns': {}}
+        data = []
+        data_length = 0
+
+        for name, column in columns.items():
+            header['columns'][name] = \
+                [column.dtype.str, data_length, len(column)]
+
+            data.append(column.tobytes())
+            data.append(b'\0' * pad(column.nbytes))
+            data_length += column.nbytes + pad(column.nbytes)
+
+        header = json.dumps(header).encode('utf-8')
+
+        return b''.join([PREFIX.pack(MAGIC, VERSION, len(header),
+                                     data_length),
+                         header,
+                         b'\0' * pad(len(header))] + data)
+
+    def get_value(self, table, value_id):
+        """
+        Get a value from one of the chunk's tables.
+
+        :param table: the name of the table
+        :param value_id: the id of the value
+        :return: the value
+        """
+
+        offsets = self.columns[table + '_offsets']
+        data = self.columns[table + '_data'][
+               offsets[value_id]:offsets[value_id + 1]]
+
+        if table in self.STRING_TABLES:
+            return data.tobytes().decode('utf-8')
+
+        return pickle.loads(data)
+
+    def get_dialogue(self, index):
+        """
+        Decode a dialogue of this chunk.
+
+        :param index: the index of the dialogue in the chunk
+        :return: the dialogue, as a list of turns
+        """
+
+        start, end = self.columns['dialogue_offsets'][index:index + 2]
+        values = {}
+        dialogue = []
+
+        for t in range(start, end):
+            turn = {}
+
+            for field, table in self.TABLE_FIELDS.items():
+                # Each state is usually the new state of the previous turn
+                key = (table, int(self.columns[field][t]))
+
+                if key not in values:
+                    values[key] = self.get_value(*key)
+
+                turn[field] = values[key]
+
+            turn['reward'] = float(self.columns['reward'][t])
+            turn['cumulative_reward'] = \
+                float(self.columns['cumulative_reward'][t])
+
+            for field in ['success', 'task_success']:
+                value = self.columns[field][t]
+                turn[field] = '' if value == NO_SIGNAL else bool(value)
+
+            dialogue.append(turn)
+
+        return dialogue
+
+
+class EpisodeLogWriter:
+    """
+    Appends chunks of dialogues to an episode log file in a background
+    thread, so that whoever records the dialogues never waits for the disk.
+    """
+
+    def __init__(self, path):
+        """
+        Start the writer thread.
+
+        :param path: the path of the episode log file to append to
+        """
+
+        self.path = path
+        self.queue = Queue()
+        self.results = Queue()
+        self.failed = False
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, dialogues):
+        """
+        Queue dialogues to be written. This does not block.
+
+        :param dialogues: a list of dialogues
+        :return: nothing
+        """
+
+        for i in range(0, len(dialogues), EpisodeLog.CHUNK_SIZE):
+            self.queue.put(dialogues[i:i + EpisodeLog.CHUNK_SIZE])
+
+    def run(self):
+        """
+        Write queued dialogues until the writer is closed. After each chunk
+        is written, the number of dialogues in it and the new length of the
+        file are put in the results queue. If writing fails, the exception is
+        put in the results queue instead and the writer stops writing.
+
+        :return: nothing
+        """
+
+        with open(self.path, 'ab') as file:
+            while True:
+                dialogues = self.queue.get()
+
+                try:
+                    if dialogues is None:
+                        break
+
+                    if self.failed:
+                        continue
+
+                    file.write(EpisodeLogChunk.encode(dialogues))
+                    file.flush()
+
+                    self.results.put((len(dialogues), file.tell()))
+
+                except Exception as e:
+                    self.failed = True
+                    self.results.put(e)
+
+                finally:
+                    self.queue.task_done()
+
+    def get_results(self):
+        """
+        Get the results of the writes that have completed since the last
+        call. This does not block.
+
+        :return: a list of (number of dialogues, file length) tuples or
+                 exceptions
+        """
+
+        results = []
+
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+
+            except Empty:
+                return results
+
+    def wait(self):
+        """
+        Wait until all queued dialogues have been written.
+
+        :return: nothing
+        """
+
+        self.queue.join()
+
+    def close(self):
+        """
+        Write all queued dialogues and stop the writer thread.
+
+        :return: nothing
+        """
+
+        self.queue.put(None)
+        self.thread.join()
+
+
+class EpisodeLog(Sequence):
+    """
+    A sequence of dialogues that are either stored in an episode log file or
+    kept in memory until they are saved. Dialogues can also be streamed to
+    the file by a background writer (see stream()).
+    """
+
+    # Maximum number of dialogues per chunk
+    CHUNK_SIZE = 1000
+
+    def __init__(self, dialogues=None, path=None):
+        """
+        Initialize the episode log.
+
+        :param dialogues: dialogues to keep in memory
+        :param path: the path of an episode log file to load
+        """
+
+        self.chunks = []
+
+        # Index of the first dialogue of each chunk, and the total
+        self.chunk_starts = np.zeros(1, dtype=np.int64)
+
+        # Dialogues that are kept in memory until they are saved
+        self.dialogues = list(dialogues) if dialogues else []
+
+        # Dialogues that are being written by the writer, in order
+        self.flushing = []
+
+        # Number of stored or flushing dialogues that have been discarded
+        # (see truncate())
+        self.start = 0
+
+        self.path = None
+        self.file_length = 0
+        self.writer = None
+
+        if path:
+            self.load(path)
+
+    def load(self, path):
+        """
+        Memory-map an episode log file and read its chunks.
+
+        :param path: the path of the episode log file
+        :return: nothing
+        """
+
+        self.path = path
+        self.file_length = 0
+        self.chunks = []
+        self.chunk_starts = np.zeros(1, dtype=np.int64)
+        self.start = 0
+
+        self.read_chunks()
+
+    def read_chunks(self, length=None):
+        """
+        Read any chunks that have been appended to the episode log file since
+        it was last read.
+
+        :param length: read the file only up to this length
+        :return: nothing
+        """
+
+        if length is None:
+            length = os.path.getsize(self.path)
+
+        if not length > self.file_length:
+            return
+
+        with open(self.path, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), length, access=mmap.ACCESS_READ)
+
+        offset = self.file_length
+        num_dialogues = [chunk.num_dialogues for chunk in self.chunks]
+
+        while offset < len(buffer):
+            try:
+                chunk = EpisodeLogChunk(buffer, offset)
+
+            except (ValueError, struct.error):
+                print(f'WARNING! Episode log {self.path} has an invalid or '
+                      f'incomplete chunk at byte {offset}, ignoring the rest '
+                      f'of the file.')
+                break
+
+            self.chunks.append(chunk)
+            num_dialogues.append(chunk.num_dialogues)
+            offset = chunk.end
+
+        self.file_length = offset
+        self.chunk_starts = np.zeros(len(self.chunks) + 1, dtype=np.int64)
+        self.chunk_starts[1:] = np.cumsum(num_dialogues)
+
+    def prepare(self, path):
+        """
+        Prepare an episode log file for appending the dialogues of this log.
+        If the file is not the one that this log was loaded from, the stored
+        dialogues are copied to it first.
+
+        :param path: the path of the episode log file
+        :return: nothing
+        """
+
+        if self.path and os.path.abspath(path) == os.path.abspath(self.path):
+            # Drop anything after the last valid chunk
+            if os.path.getsize(path) > self.file_length:
+                with open(path, 'r+b') as file:
+                    file.truncate(self.file_length)
+
+            return
+
+        if self.path:
+            # Copy the stored chunks
+            with open(self.path, 'rb') as source, open(path, 'wb') as file:
+                file.write(source.read(self.file_length))
+
+        else:
+            # Start a new log
+            open(path, 'wb').close()
+
+        start = self.start
+        self.load(path)
+        self.start = start
+
+    def save(self, path=None):
+        """
+        Append the dialogues that are kept in memory to an episode log file.
+        The dialogues are then discarded from memory and read from the file
+        when needed.
+
+        :param path: the path of the episode log file
+        :return: nothing
+        """
+
+        if self.writer:
+            if path and \
+                    os.path.abspath(path) != os.path.abspath(self.path):
+                raise ValueError('EpisodeLog: Cannot save to a different '
+                                 'file while streaming!')
+
+            self.flush()
+            self.writer.wait()
+            self.commit()
+
+            if self.writer:
+                return
+
+        if not path:
+            path = self.path
+
+        if not path:
+            raise ValueError('EpisodeLog: No path provided to save to!')
+
+        self.prepare(path)
+
+        with open(path, 'ab') as file:
+            for i in range(0, len(self.dialogues), self.CHUNK_SIZE):
+                file.write(EpisodeLogChunk.encode(
+                    self.dialogues[i:i + self.CHUNK_SIZE]))
+
+        self.read_chunks()
+        self.dialogues = []
+
+    def stream(self, path):
+        """
+        Start a background writer that appends dialogues to an episode log
+        file whenever flush() is called.
+
+        :param path: the path of the episode log file
+        :return: nothing
+        """
+
+        if self.writer:
+            self.close()
+
+        self.prepare(path)
+        self.writer = EpisodeLogWriter(path)
+
+    def flush(self):
+        """
+        Hand the dialogues that are kept in memory to the background writer.
+        This does not block.
+
+        :return: nothing
+        """
+
+        if not self.writer or not self.dialogues:
+            return
+
+        self.writer.write(self.dialogues)
+        self.flushing.extend(self.dialogues)
+        self.dialogues = []
+
+    def commit(self):
+        """
+        Read the chunks that the background writer has written since the
+        last call, and discard the corresponding dialogues from memory. If
+        the writer has failed, stop streaming and keep all dialogues that
+        have not been written in memory. This does not block.
+
+        :return: nothing
+        """
+
+        if not self.writer:
+            return
+
+        for result in self.writer.get_results():
+            if isinstance(result, Exception):
+                print(f'WARNING! Episode log writer failed to write to '
+                      f'{self.path} ({result}), keeping dialogues in memory.')
+
+                self.dialogues = self.flushing + self.dialogues
+                self.flushing = []
+                self.writer.close()
+                self.writer = None
+                return
+
+            num_dialogues, length = result
+            self.read_chunks(length)
+            del self.flushing[:num_dialogues]
+
+    def close(self):
+        """
+        Write all flushed dialogues and stop the background writer.
+
+        :return: nothing
+        """
+
+        if self.writer:
+            self.writer.close()
+            self.commit()
+
+        if self.writer:
+            self.writer = None
+
+    def append(self, dialogue):
+        """
+        Add a dialogue to the log. It is kept in memory until the log is
+        saved or flushed.
+
+        :param dialogue: the dialogue, as a list of turns
+        :return: nothing
+        """
+
+        self.dialogues.append(dialogue)
+
+    def extend(self, dialogues):
+        """
+        Add a number of dialogues to the log.
+
+        :param dialogues: a list of dialogues
+        :return: nothing
+        """
+
+        self.dialogues.extend(dialogues)
+
+    def truncate(self, size):
+        """
+        Discard the oldest dialogues, so that at most size dialogues remain.
+
+        :param size: the number of dialogues to keep
+        :return: nothing
+        """
+
+        excess = len(self) - max(size, 0)
+
+        if excess <= 0:
+            return
+
+        discarded = min(excess, self.num_stored())
+        self.start += discarded
+        del self.dialogues[:excess - discarded]
+
+    def num_unsaved(self):
+        """
+        :return: the number of dialogues that are only kept in memory
+        """
+
+        return len(self.dialogues)
+
+    def num_stored(self):
+        """
+        :return: the number of available dialogues that are stored in the
+                 file or are being written to it
+        """
+
+        return int(self.chunk_starts[-1]) + len(self.flushing) - self.start
+
+    def __len__(self):
+        return self.num_stored() + len(self.dialogues)
+
+    def __getitem__(self, index):
+        """
+        Get a dialogue (decoding it if it is stored in the file) or a list of
+        dialogues.
+
+        :param index: the index of the dialogue, or a slice
+        :return: the dialogue as a list of turns, or a list of dialogues
+        """
+
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError('EpisodeLog index out of range')
+
+        num_stored = self.num_stored()
+
+        if index >= num_stored:
+            return self.dialogues[index - num_stored]
+
+        index += self.start
+        num_written = int(self.chunk_starts[-1])
+
+        if index >= num_written:
+            return self.flushing[index - num_written]
+
+        c = int(np.searchsorted(self.chunk_starts, index, side='right')) - 1
+
+        return self.chunks[c].get_dialogue(index - int(self.chunk_starts[c]))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
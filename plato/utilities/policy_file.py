@@ -0,0 +1,604 @@
+"""
+Copyright (c) 2019 Uber Technologies, Inc.
+
+Licensed under the Uber Non-Commercial License (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at the root directory of this project.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = "Alexandros Papangelis"
+
+from collections.abc import Mapping
+
+import numpy as np
+
+import json
+import os
+import pickle
+import struct
+
+"""
+A policy file stores a dialogue policy's model as raw numeric arrays, so that
+it can be memory-mapped instead of unpickled. Loading a policy file only reads
+its header; the arrays are read by the operating system when they are accessed,
+and processes that load the same file share its pages.
+
+A policy file holds a JSON header (the policy's name and its scalar parameters,
+e.g. the learning rate) followed by named arrays. Tables map state encodings to
+rows of arrays through an index of sorted keys:
+
+- dense tables have one row per state (e.g. Q values over all actions)
+- ragged tables have a variable number of (label, value) entries per state
+  (e.g. Q values of visited actions only, or action probabilities)
+
+Tables that are read from a policy file are read-only Mappings; policies that
+need to modify them (e.g. to continue training) convert them with to_dict().
+"""
+
+# Policy files start with these bytes
+MAGIC = b'PLATOPOL'
+VERSION = 1
+
+# File prefix: magic, version, header length
+PREFIX = struct.Struct('<8sII')
+
+# Arrays are aligned to this many bytes
+ALIGNMENT = 8
+
+# Policies are saved as policy files if their path has this extension
+POLICY_FILE_EXTENSION = '.policy'
+
+
+def is_policy_file(path):
+    """
+    Check if a file is a policy file.
+
+    :param path: the path to the file
+    :return: True or False
+    """
+
+    if not os.path.isfile(path):
+        return False
+
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def pad(length):
+    """
+    Get the number of padding bytes needed to align something.
+
+    :param length: the length of what needs to be aligned
+    :return: the number of padding bytes
+    """
+
+    return -length % ALIGNMENT
+
+
+def encode_key(key):
+    """
+    Encode a table key (an integer state encoding or a string) into bytes.
+
+    :param key: the key
+    :return: the key's bytes
+    """
+
+    if isinstance(key, (int, np.integer)) and not isinstance(key, bool):
+        key = int(key)
+        return b'i' + key.to_bytes(key.bit_length() // 8 + 1, 'big',
+                                   signed=True)
+
+    if isinstance(key, str):
+        return b's' + key.encode('utf-8')
+
+    raise ValueError(f'Policy file: Unacceptable key type {type(key)}')
+
+
+def decode_key(data):
+    """
+    Decode a table key.
+
+    :param data: the key's bytes
+    :return: the key
+    """
+
+    if data[:1] == b'i':
+        return int.from_bytes(data[1:], 'big', signed=True)
+
+    return data[1:].decode('utf-8')
+
+
+def dense_table(keys, values, dtype=np.float64, **columns):
+    """
+    Describe a dense table, to be saved with save_policy_file().
+
+    :param keys: the state encodings (or other keys) of the rows
+    :param values: the values of each key, in the same order (rows of
+                   equal shape)
+    :param dtype: the dtype of the values
+    :param columns: additional arrays with one row per key
+    :return: the table's description
+    """
+
+    keys = list(keys)
+
+    if not isinstance(values, np.ndarray):
+        values = list(values)
+
+    values = np.asarray(values, dtype=dtype)
+
+    if len(keys) != len(values):
+        raise ValueError('Policy file: Dense table keys and values have '
+                         'different lengths')
+
+    columns = dict(values=values,
+                   **{name: np.asarray(column)
+                      for name, column in columns.items()})
+
+    return {'kind': 'dense', 'keys': keys, 'columns': columns}
+
+
+def ragged_table(rows, field=None):
+    """
+    Describe a ragged table, to be saved with save_policy_file().
+
+    :param rows: a dictionary of key -> dictionary of label -> value (e.g.
+                 state encoding -> action encoding -> Q value)
+    :param field: if provided, the rows are read back as
+                  {field: {label: value}}
+    :return: the table's description
+    """
+
+    return {'kind': 'ragged', 'keys': list(rows), 'rows': list(rows.values()),
+            'field': field}
+
+
+class KeyIndex(Mapping):
+    """
+    Maps the keys of a table to row numbers. Keys are stored sorted, either
+    as int64 integers or (if any key does not fit) as bytes.
+    """
+
+    def __init__(self, arrays, name, kind):
+        """
+        Read the index of a table.
+
+        :param arrays: the policy file's arrays
+        :param name: the name of the table
+        :param kind: 'int64' or 'bytes'
+        """
+
+        self.kind = kind
+
+        if kind == 'int64':
+            self.keys = arrays[name + '/keys']
+            self.length = len(self.keys)
+        else:
+            self.key_offsets = arrays[name + '/key_offsets']
+            self.key_data = arrays[name + '/key_data']
+            self.length = len(self.key_offsets) - 1
+
+        # Row of each key, in sorted key order
+        self.rows = arrays[name + '/rows']
+
+    @staticmethod
+    def encode(keys):
+        """
+        Build the index arrays of a table.
+
+        :param keys: the table's keys, in row order
+        :return: the kind of the index and a dictionary of arrays
+        """
+
+        if all(isinstance(k, (int, np.integer)) and
+               not isinstance(k, bool) and
+               -2 ** 63 <= k < 2 ** 63 for k in keys):
+            int_keys = np.array(keys, dtype=np.int64)
+            order = np.argsort(int_keys, kind='stable')
+
+            return 'int64', {'keys': int_keys[order],
+                             'rows': order.astype(np.int64)}
+
+        encoded = [encode_key(k) for k in keys]
+        order = sorted(range(len(keys)), key=encoded.__getitem__)
+
+        key_offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        key_offsets[1:] = np.cumsum([len(encoded[i]) for i in order])
+
+        return 'bytes', {
+            'key_offsets': key_offsets,
+            'key_data': np.frombuffer(b''.join(encoded[i] for i in order),
+                                      dtype=np.uint8),
+            'rows': np.array(order, dtype=np.int64)}
+
+    def key_at(self, position):
+        """
+        Get the key at a position in sorted order, as bytes.
+
+        :param position: the position
+        :return: the encoded key
+        """
+
+        return self.key_data[self.key_offsets[position]:
+                             self.key_offsets[position + 1]].tobytes()
+
+    def position(self, key):
+        """
+        Find the position of a key in sorted order.
+
+        :param key: the key
+        :return: the position, or -1 if the table does not have the key
+        """
+
+        if self.kind == 'int64':
+            if not isinstance(key, (int, np.integer)) or \
+                    isinstance(key, bool) or not -2 ** 63 <= key < 2 ** 63:
+                return -1
+
+            position = int(np.searchsorted(self.keys, key))
+
+            if position < self.length and self.keys[position] == key:
+                return position
+
+            return -1
+
+        try:
+            data = encode_key(key)
+        except ValueError:
+            return -1
+
+        low = 0
+        high = self.length
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self.key_at(middle) < data:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < self.length and self.key_at(low) == data:
+            return low
+
+        return -1
+
+    def __getitem__(self, key):
+        position = self.position(key)
+
+        if position < 0:
+            raise KeyError(key)
+
+        return int(self.rows[position])
+
+    def __contains__(self, key):
+        return self.position(key) >= 0
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for position in range(self.length):
+            if self.kind == 'int64':
+                yield int(self.keys[position])
+            else:
+                yield decode_key(self.key_at(position))
+
+
+class DenseTable(Mapping):
+    """
+    A read-only dense table of a policy file. Looking up a key returns a
+    read-only view of its row of values.
+    """
+
+    def __init__(self, arrays, name, header):
+        """
+        Read a dense table.
+
+        :param arrays: the policy file's arrays
+        :param name: the name of the table
+        :param header: the table's header entry
+        """
+
+        self.index = KeyIndex(arrays, name, header['index'])
+        self.columns = {column: arrays[name + '/' + column]
+                        for column in header['columns']}
+        self.values = self.columns['values']
+
+    def __getitem__(self, key):
+        return self.values[self.index[key]]
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def to_dict(self):
+        """
+        Copy the table into a dictionary of key -> row, with rows converted
+        to (nested) lists, or to scalars for 1-dimensional tables.
+
+        :return: a dictionary
+        """
+
+        return {key: self.values[row].tolist()
+                for key, row in self.index.items()}
+
+
+class RaggedTable(Mapping):
+    """
+    A read-only ragged table of a policy file. Looking up a key returns a new
+    dictionary of label -> value.
+    """
+
+    def __init__(self, arrays, name, header):
+        """
+        Read a ragged table.
+
+        :param arrays: the policy file's arrays
+        :param name: the name of the table
+        :param header: the table's header entry
+        """
+
+        self.index = KeyIndex(arrays, name, header['index'])
+        self.row_offsets = arrays[name + '/row_offsets']
+        self.labels = arrays[name + '/labels']
+        self.values = arrays[name + '/values']
+        self.label_names = header['label_names']
+        self.field = header['field']
+
+    def get_row(self, row):
+        """
+        Get the entries of a row.
+
+        :param row: the row number
+        :return: a dictionary of label -> value
+        """
+
+        start = self.row_offsets[row]
+        end = self.row_offsets[row + 1]
+
+        labels = self.labels[start:end].tolist()
+        if self.label_names is not None:
+            labels = [self.label_names[label] for label in labels]
+
+        entries = dict(zip(labels, self.values[start:end].tolist()))
+
+        if self.field is not None:
+            return {self.field: entries}
+
+        return entries
+
+    def __getitem__(self, key):
+        return self.get_row(self.index[key])
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def to_dict(self):
+        """
+        Copy the table into a dictionary of key -> dictionary.
+
+        :return: a dictionary
+        """
+
+        return {key: self.get_row(row) for key, row in self.index.items()}
+
+
+def to_dict(table):
+    """
+    Get a table that can be modified: tables read from a policy file are
+    copied into dictionaries, and other tables are returned as they are.
+
+    :param table: a table
+    :return: a dictionary
+    """
+
+    if isinstance(table, (DenseTable, RaggedTable)):
+        return table.to_dict()
+
+    return table
+
+
+def to_arrays(table):
+    """
+    Get a table (e.g. Q) as a dictionary of state encoding -> float64 array
+    that can be modified, converting tables that were read from a policy
+    file or that have lists as rows.
+
+    :param table: a table
+    :return: a dictionary whose rows are arrays
+    """
+
+    if isinstance(table, DenseTable):
+        return {key: np.array(table.values[row], dtype=np.float64)
+                for key, row in table.index.items()}
+
+    if table and not isinstance(next(iter(table.values())), np.ndarray):
+        return {key: np.asarray(row, dtype=np.float64)
+                for key, row in table.items()}
+
+    return table
+
+
+def save_policy_file(path, policy, params=None, arrays=None, tables=None):
+    """
+    Save a policy model as a policy file. The file is written next to path
+    and then moved in place, so processes that have the previous version
+    mapped keep reading it undisturbed.
+
+    :param path: the path to the file
+    :param policy: the name of the policy (e.g. its class name)
+    :param params: a dictionary of JSON serializable parameters
+    :param arrays: a dictionary of name -> numpy array
+    :param tables: a dictionary of name -> table description (see
+                   dense_table() and ragged_table())
+    :return: nothing
+    """
+
+    header = {'policy': policy,
+              'params': params or {},
+              'arrays': {},
+              'tables': {}}
+
+    all_arrays = {name: np.asarray(array)
+                  for name, array in (arrays or {}).items()}
+
+    for name, table in (tables or {}).items():
+        kind, index_arrays = KeyIndex.encode(table['keys'])
+        entry = {'kind': table['kind'], 'index': kind}
+
+        for array_name, array in index_arrays.items():
+            all_arrays[name + '/' + array_name] = array
+
+        if table['kind'] == 'dense':
+            entry['columns'] = list(table['columns'])
+
+            for column, array in table['columns'].items():
+                all_arrays[name + '/' + column] = array
+
+        else:
+            label_list = [label for row in table['rows'] for label in row]
+            label_names = None
+
+            if not all(isinstance(label, (int, np.integer)) and label >= 0
+                       for label in label_list):
+                label_names = sorted(set(label_list), key=str)
+                label_ids = {label: i for i, label in enumerate(label_names)}
+                label_list = [label_ids[label] for label in label_list]
+
+            row_offsets = np.zeros(len(table['rows']) + 1, dtype=np.int64)
+            row_offsets[1:] = np.cumsum([len(row) for row in table['rows']])
+
+            entry['label_names'] = label_names
+            entry['field'] = table['field']
+
+            all_arrays[name + '/row_offsets'] = row_offsets
+            all_arrays[name + '/labels'] = \
+                np.array(label_list, dtype=np.int64)
+            all_arrays[name + '/values'] = \
+                np.array([value for row in table['rows']
+                          for value in row.values()], dtype=np.float64)
+
+        header['tables'][name] = entry
+
+    data = []
+    data_length = 0
+
+    for name, array in all_arrays.items():
+        array = np.ascontiguousarray(array)
+
+        if array.dtype.hasobject:
+            raise ValueError(f'Policy file: Array {name} is not numeric')
+
+        header['arrays'][name] = \
+            [array.dtype.str, data_length, list(array.shape)]
+
+        data.append(array.tobytes())
+        data.append(b'\0' * pad(array.nbytes))
+        data_length += array.nbytes + pad(array.nbytes)
+
+    header = json.dumps(header).encode('utf-8')
+
+    # If the directory does not exist, create it
+    if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    temporary_path = path + '.tmp'
+
+    with open(temporary_path, 'wb') as file:
+        file.write(PREFIX.pack(MAGIC, VERSION, len(header)))
+        file.write(header)
+        file.write(b'\0' * pad(PREFIX.size + len(header)))
+
+        for d in data:
+            file.write(d)
+
+    os.replace(temporary_path, path)
+
+
+class PolicyFile:
+    """
+    A policy file, memory-mapped for reading.
+    """
+
+    def __init__(self, path):
+        """
+        Open a policy file.
+
+        :param path: the path to the file
+        """
+
+        self.path = path
+        buffer = np.memmap(path, dtype=np.uint8, mode='r')
+
+        magic, version, header_length = PREFIX.unpack_from(buffer, 0)
+
+        if magic != MAGIC:
+            raise ValueError(f'Not a policy file: {path}')
+
+        if version > VERSION:
+            raise ValueError(f'Unsupported policy file version: {version}')
+
+        header_end = PREFIX.size + header_length
+        header = json.loads(buffer[PREFIX.size:header_end].tobytes())
+        data_start = header_end + pad(header_end)
+
+        self.policy = header['policy']
+        self.params = header['params']
+        self.arrays = {}
+
+        for name, (dtype, offset, shape) in header['arrays'].items():
+            dtype = np.dtype(dtype)
+            count = int(np.prod(shape, dtype=np.int64))
+            start = data_start + offset
+
+            if start + count * dtype.itemsize > len(buffer):
+                raise ValueError(f'Incomplete policy file: {path}')
+
+            self.arrays[name] = \
+                buffer[start:start + count * dtype.itemsize] \
+                .view(dtype).reshape(shape)
+
+        self.tables = {}
+
+        for name, entry in header['tables'].items():
+            if entry['kind'] == 'dense':
+                self.tables[name] = DenseTable(self.arrays, name, entry)
+            else:
+                self.tables[name] = RaggedTable(self.arrays, name, entry)
+
+
+def load_model(path):
+    """
+    Load a policy model that was saved either as a policy file or as a
+    pickled dictionary.
+
+    :param path: the path to the model
+    :return: a dictionary with the model's parameters, tables, and arrays
+    """
+
+    if is_policy_file(path):
+        model = PolicyFile(path)
+
+        obj = dict(model.params)
+        obj.update(model.arrays)
+        obj.update(model.tables)
+
+        return obj
+
+    with open(path, 'rb') as file:
+        return pickle.load(file)
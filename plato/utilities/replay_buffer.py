@@ -0,0 +1,366 @@
+"""
+Copyright (c) 2019 Uber Technologies, Inc.
+
+Licensed under the Uber Non-Commercial License (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at the root directory of this project.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = "Alexandros Papangelis"
+
+import numpy as np
+
+"""
+The ReplayBuffer keeps the most recent dialogue turns (transitions) in a ring
+buffer, so that policies can be trained on minibatches of transitions instead
+of whole dialogues. Transitions are sampled uniformly, or in proportion to
+their priority (prioritized experience replay), using a sum tree. Adding a
+transition and sampling one both take O(log n) time.
+
+Sampled transitions are handed to dialogue policies as one-turn dialogues,
+which the Q-Learning, WoLF-PHC, MinimaxQ, and REINFORCE policies can all train
+on. Each transition carries the rewards of its dialogue and its index in it,
+for policies that need the rest of the dialogue (e.g. to compute returns).
+Sampled transitions also carry their index in the buffer ('replay_index') and
+their importance sampling weight ('weight'), by which the policies scale
+their updates. The Q-Learning, WoLF-PHC, and MinimaxQ policies record the TD
+error of each sampled transition ('td_error'), which becomes its new priority
+(see update_td_errors()).
+"""
+
+
+class SumTree:
+    """
+    A binary tree whose leaves hold non-negative values (e.g. priorities) and
+    whose inner nodes hold the sum of their children, stored in an array.
+    Leaves can be updated, and found by prefix sum, in O(log n) time.
+    """
+
+    def __init__(self, capacity):
+        """
+        Initialize a tree whose leaves are all zero.
+
+        :param capacity: the number of leaves
+        """
+
+        self.capacity = capacity
+
+        # The number of leaves of the full tree, a power of two
+        self.num_leaves = 1 << max(capacity - 1, 0).bit_length()
+        self.depth = self.num_leaves.bit_length() - 1
+
+        # Node i has children 2i and 2i + 1, and leaf j is node num_leaves + j
+        self.nodes = np.zeros(2 * self.num_leaves, dtype=np.float64)
+
+    def total(self):
+        """
+        :return: the sum of all leaves
+        """
+
+        return self.nodes[1]
+
+    def get(self, indices):
+        """
+        Get the values of a number of leaves.
+
+        :param indices: the indices of the leaves
+        :return: an array of values
+        """
+
+        return self.nodes[np.asarray(indices, dtype=np.int64) +
+                          self.num_leaves]
+
+    def set(self, index, value):
+        """
+        Set the value of a leaf and update its ancestors.
+
+        :param index: the index of the leaf
+        :param value: the new value
+        :return: nothing
+        """
+
+        nodes = self.nodes
+        node = index + self.num_leaves
+        nodes[node] = value
+
+        # Plain floats are much faster than NumPy calls for a single path
+        while node > 1:
+            node //= 2
+            nodes[node] = float(nodes[2 * node]) + float(nodes[2 * node + 1])
+
+    def update(self, indices, values):
+        """
+        Set the values of a number of leaves and update their ancestors. The
+        sums are recomputed from the children, so they do not drift.
+
+        :param indices: the indices of the leaves
+        :param values: the new values
+        :return: nothing
+        """
+
+        nodes = np.asarray(indices, dtype=np.int64) + self.num_leaves
+        self.nodes[nodes] = values
+
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.nodes[nodes] = self.nodes[2 * nodes] + \
+                self.nodes[2 * nodes + 1]
+
+    def find(self, prefix_sums):
+        """
+        Find the leaves at a number of prefix sums, i.e. for each sum s the
+        leaf j such that the sum of leaves 0..j-1 <= s < the sum of leaves
+        0..j.
+
+        :param prefix_sums: the prefix sums, in [0, total())
+        :return: an array of leaf indices
+        """
+
+        values = np.array(prefix_sums, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+
+        for _ in range(self.depth):
+            left = 2 * nodes
+            right = values >= self.nodes[left]
+
+            values = np.where(right, values - self.nodes[left], values)
+            nodes = np.where(right, left + 1, left)
+
+        return nodes - self.num_leaves
+
+
+class ReplayBuffer:
+    """
+    A ring buffer of transitions, with optional prioritized sampling.
+    """
+
+    # The capacity of buffers whose configuration does not set one
+    DEFAULT_CAPACITY = 10000
+
+    # The arguments that can be set in an agent's replay_buffer section
+    CONFIG_ARGUMENTS = ['capacity', 'prioritized', 'alpha', 'beta', 'epsilon']
+
+    def __init__(self, capacity, prioritized=False, alpha=0.6, beta=0.4,
+                 epsilon=1e-6):
+        """
+        Initialize an empty buffer.
+
+        :param capacity: the maximum number of transitions; the oldest ones
+                         are replaced once it is reached
+        :param prioritized: sample transitions in proportion to their
+                            priority rather than uniformly
+        :param alpha: how much priorities matter (0 is uniform sampling)
+        :param beta: how much the importance sampling weights correct for
+                     prioritized sampling (1 corrects fully)
+        :param epsilon: added to priorities, so that every transition can be
+                        sampled
+        """
+
+        if capacity < 1:
+            raise ValueError(f'ReplayBuffer: Unacceptable capacity '
+                             f'{capacity}')
+
+        self.capacity = capacity
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+
+        self.transitions = [None] * capacity
+
+        # Where the next transition goes, and the number of transitions
+        self.position = 0
+        self.count = 0
+
+        self.tree = SumTree(capacity) if prioritized else None
+
+        # New transitions get the maximum priority seen so far by default
+        self.max_priority = 1.0
+
+    def __len__(self):
+        return self.count
+
+    @classmethod
+    def from_config(cls, args):
+        """
+        Create a replay buffer from the replay_buffer section of an agent's
+        configuration.
+
+        :param args: a dictionary with the capacity (DEFAULT_CAPACITY if not
+                     set) and, optionally, prioritized, alpha, beta, and
+                     epsilon (see __init__())
+        :return: a ReplayBuffer
+        """
+
+        args = dict(args or {})
+
+        for arg in args:
+            if arg not in cls.CONFIG_ARGUMENTS:
+                raise ValueError(f'ReplayBuffer: Unknown replay_buffer '
+                                 f'argument {arg} (expected one of '
+                                 f'{", ".join(cls.CONFIG_ARGUMENTS)})')
+
+        args.setdefault('capacity', cls.DEFAULT_CAPACITY)
+
+        return cls(**args)
+
+    def add(self, transition, priority=None):
+        """
+        Add a transition, replacing the oldest one if the buffer is full.
+
+        :param transition: the transition (e.g. a dialogue turn)
+        :param priority: the transition's priority (e.g. its TD error), or
+                         None for the maximum priority seen so far
+        :return: the index of the transition
+        """
+
+        index = self.position
+        self.transitions[index] = transition
+
+        if self.tree is not None:
+            if priority is None:
+                priority = self.max_priority
+
+            priority = abs(priority)
+            self.max_priority = max(self.max_priority, priority)
+            self.tree.set(index, (priority + self.epsilon) ** self.alpha)
+
+        self.position = (self.position + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+        return index
+
+    def add_dialogue(self, dialogue, priorities=None):
+        """
+        Add the turns of a dialogue as transitions. Like the policies do
+        before training, the reward of the last turn is copied to the turn
+        before it. Each transition is a copy of its turn, with the rewards
+        of the whole dialogue ('dialogue_rewards') and the turn's index in it
+        ('turn_index').
+
+        :param dialogue: the dialogue, a list of turns
+        :param priorities: the priority of each turn; by default, turns are
+                           prioritized by the magnitude of their reward
+                           (e.g. the last turns of dialogues), until
+                           update_priorities() is called with e.g. their TD
+                           errors
+        :return: the indices of the transitions
+        """
+
+        rewards = [turn['reward'] for turn in dialogue]
+
+        if len(rewards) > 1:
+            rewards[-2] = rewards[-1]
+
+        if priorities is None:
+            priorities = [abs(reward) for reward in rewards]
+
+        indices = []
+
+        for t, turn in enumerate(dialogue):
+            transition = dict(turn)
+            transition['reward'] = rewards[t]
+            transition['dialogue_rewards'] = rewards
+            transition['turn_index'] = t
+
+            indices.append(self.add(transition, priorities[t]))
+
+        return indices
+
+    def sample(self, batch_size):
+        """
+        Sample a number of transitions (with replacement). Prioritized
+        sampling is stratified: the total priority is split into batch_size
+        equal ranges and one transition is sampled from each.
+
+        :param batch_size: the number of transitions
+        :return: the transitions, their indices, and their importance sampling
+                 weights (all ones for uniform sampling)
+        """
+
+        if not self.count:
+            return [], np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        if self.tree is None:
+            indices = np.random.randint(0, self.count, size=batch_size)
+            weights = np.ones(batch_size)
+
+        else:
+            total = self.tree.total()
+            prefix_sums = (np.arange(batch_size) +
+                           np.random.random(batch_size)) * total / batch_size
+
+            # Rounding may lead past the last transition
+            indices = np.minimum(self.tree.find(prefix_sums), self.count - 1)
+
+            probabilities = self.tree.get(indices) / total
+            weights = (self.count * probabilities) ** -self.beta
+            weights /= weights.max()
+
+        return [self.transitions[i] for i in indices], indices, weights
+
+    def sample_dialogues(self, batch_size):
+        """
+        Sample a number of transitions as one-turn dialogues, which dialogue
+        policies can train on. Each transition is a copy, with its index in
+        the buffer ('replay_index') and its importance sampling weight
+        ('weight').
+
+        :param batch_size: the number of transitions
+        :return: a list of one-turn dialogues
+        """
+
+        transitions, indices, weights = self.sample(batch_size)
+
+        return [[dict(transition, replay_index=int(index),
+                      weight=float(weight))]
+                for transition, index, weight in
+                zip(transitions, indices, weights)]
+
+    def update_td_errors(self, dialogues):
+        """
+        Set the priorities of the transitions sampled by sample_dialogues() to
+        the TD errors that the policies recorded in them ('td_error') while
+        training on them. Transitions without a TD error keep their priority.
+
+        :param dialogues: the one-turn dialogues returned by
+                          sample_dialogues()
+        :return: nothing
+        """
+
+        indices = []
+        td_errors = []
+
+        for dialogue in dialogues:
+            for transition in dialogue:
+                if 'replay_index' in transition and \
+                        'td_error' in transition:
+                    indices.append(transition['replay_index'])
+                    td_errors.append(transition['td_error'])
+
+        if indices:
+            self.update_priorities(indices, td_errors)
+
+    def update_priorities(self, indices, priorities):
+        """
+        Set the priorities of a number of transitions (e.g. to their TD errors
+        after training on them).
+
+        :param indices: the indices of the transitions, as returned by add()
+                        or sample()
+        :param priorities: the new priorities
+        :return: nothing
+        """
+
+        if self.tree is None:
+            return
+
+        priorities = np.abs(np.asarray(priorities, dtype=np.float64))
+
+        if len(priorities):
+            self.max_priority = max(self.max_priority, priorities.max())
+
+        self.tree.update(indices, (priorities + self.epsilon) ** self.alpha)
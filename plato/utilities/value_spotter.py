@@ -0,0 +1,197 @@
+"""
+Copyright (c) 2019 Uber Technologies, Inc.
+
+Licensed under the Uber Non-Commercial License (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at the root directory of this project.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = "Alexandros Papangelis"
+
+from collections import deque
+
+"""
+The ValueSpotter finds all mentions of a (possibly very large) set of values,
+e.g. the values of the informable slots of an ontology, in a text in a single
+pass, using an Aho-Corasick automaton. Finding the mentions takes time linear
+in the length of the text and the number of mentions, no matter how many
+values there are.
+"""
+
+
+def is_word_character(c):
+    """
+    Check if a character is a word character, like \\w of regular expressions.
+
+    :param c: the character
+    :return: True if the character is a word character
+    """
+
+    return c.isalnum() or c == '_'
+
+
+class ValueSpotter:
+    """
+    An Aho-Corasick automaton over a set of values, each with a key (e.g. a
+    (slot, value) tuple). Values can be spotted anywhere in a text, or only
+    as whole words, i.e. where r'\\b<value>\\b' would match.
+    """
+
+    def __init__(self, values):
+        """
+        Build the automaton.
+
+        :param values: an iterable of (value, key) tuples; values are strings,
+                       and several values can have the same key
+        """
+
+        # The transitions, failure links and outputs of the states, where
+        # state 0 is the root. Outputs are tuples of (value length, key)
+        # tuples; unlike lists, the garbage collector stops tracking them,
+        # which matters for automata with millions of states.
+        self.transitions = [{}]
+        self.failures = [0]
+        self.outputs = [()]
+
+        # Keys of empty values, which match everywhere
+        self.empty_keys = []
+
+        for value, key in values:
+            self.add(value, key)
+
+        self.build()
+
+    def add(self, value, key):
+        """
+        Add a value to the trie of the automaton.
+
+        :param value: the value
+        :param key: the value's key
+        :return: nothing
+        """
+
+        if not value:
+            self.empty_keys.append(key)
+            return
+
+        state = 0
+
+        for c in value:
+            next_state = self.transitions[state].get(c)
+
+            if next_state is None:
+                next_state = len(self.transitions)
+                self.transitions[state][c] = next_state
+                self.transitions.append({})
+                self.failures.append(0)
+                self.outputs.append(())
+
+            state = next_state
+
+        self.outputs[state] += ((len(value), key),)
+
+    def build(self):
+        """
+        Compute the failure links of the trie in breadth first order, and
+        merge the outputs of each state with those of its failure state.
+
+        :return: nothing
+        """
+
+        queue = deque(self.transitions[0].values())
+
+        while queue:
+            state = queue.popleft()
+
+            for c, next_state in self.transitions[state].items():
+                queue.append(next_state)
+
+                failure = self.failures[state]
+                while failure and c not in self.transitions[failure]:
+                    failure = self.failures[failure]
+
+                failure = self.transitions[failure].get(c, 0)
+
+                if failure == next_state:
+                    failure = 0
+
+                self.failures[next_state] = failure
+                self.outputs[next_state] = \
+                    self.outputs[next_state] + self.outputs[failure]
+
+    def find(self, text, whole_words=True):
+        """
+        Find all mentions of the values in a text.
+
+        :param text: the text
+        :param whole_words: only find values that start and end at word
+                            boundaries
+        :return: a list of (start, end, key) tuples, ordered by end
+        """
+
+        transitions = self.transitions
+        failures = self.failures
+        outputs = self.outputs
+
+        mentions = []
+        state = 0
+
+        for end, c in enumerate(text, 1):
+            while state and c not in transitions[state]:
+                state = failures[state]
+
+            state = transitions[state].get(c, 0)
+
+            for length, key in outputs[state]:
+                start = end - length
+
+                if not whole_words or \
+                        (self.is_boundary(text, start) and
+                         self.is_boundary(text, end)):
+                    mentions.append((start, end, key))
+
+        if self.empty_keys:
+            if not whole_words:
+                mentions += [(0, 0, key) for key in self.empty_keys]
+
+            else:
+                # Like r'\b\b', an empty value matches at the first boundary
+                for position in range(len(text) + 1):
+                    if self.is_boundary(text, position):
+                        mentions += [(position, position, key)
+                                     for key in self.empty_keys]
+                        break
+
+        return mentions
+
+    def find_keys(self, text, whole_words=True):
+        """
+        Find which values are mentioned in a text.
+
+        :param text: the text
+        :param whole_words: only find values that start and end at word
+                            boundaries
+        :return: a set of the keys of the mentioned values
+        """
+
+        return {key for _, _, key in self.find(text, whole_words)}
+
+    @staticmethod
+    def is_boundary(text, position):
+        """
+        Check if there is a word boundary at a position of a text, like \\b
+        of regular expressions.
+
+        :param text: the text
+        :param position: the position, from 0 to len(text)
+        :return: True if exactly one of the characters around the position is
+                 a word character
+        """
+
+        before = position > 0 and is_word_character(text[position - 1])
+        after = position < len(text) and is_word_character(text[position])
+
+        return before != after